@@ -0,0 +1,122 @@
+import time
+import functools
+import logging
+
+import discord
+
+# --- インタラクションの流入制御 ---
+# 荒らしやいたずらで報告ボタンが大量に押されたときに、DB接続や未処理タスクが
+# 積み上がってBot全体が固まらないよう、処理を始める前にトークンバケットで受付を絞る。
+# 受け付けられなかったインタラクションには、DBに触れずにすぐ「混雑中」と返す。
+
+BUSY_MESSAGE = "🚦 ただいま報告が集中しています。少し時間をおいてから、もう一度お試しください。"
+
+
+class TokenBucket:
+    """一定の速度で補充されるトークンを1つずつ消費するレート制限"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """全体・サーバー単位のトークンバケットと同時処理数の上限で受付を判断する"""
+    # サーバーごとのバケットがこの数を超えたら、満タン（しばらく使われていない）ものを捨てる
+    MAX_GUILD_BUCKETS = 1000
+
+    def __init__(self, global_rate=20, global_burst=40, guild_rate=5, guild_burst=10, max_in_flight=50):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.max_in_flight = max_in_flight
+        self.guild_buckets = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _guild_bucket(self, guild_id):
+        bucket = self.guild_buckets.get(guild_id)
+        if bucket is None:
+            if len(self.guild_buckets) >= self.MAX_GUILD_BUCKETS:
+                now = time.monotonic()
+                for key in [key for key, b in self.guild_buckets.items() if b.is_full(now)]:
+                    del self.guild_buckets[key]
+            bucket = self.guild_buckets[guild_id] = TokenBucket(self.guild_rate, self.guild_burst)
+        return bucket
+
+    def try_admit(self, guild_id):
+        """受け付けられる場合は True（このとき、処理が終わったら必ず release() を呼ぶ）"""
+        now = time.monotonic()
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            return False
+        # サーバー単位を先に見て、1つのサーバーの集中で全体のトークンを使い切らないようにする
+        if guild_id is not None and not self._guild_bucket(guild_id).try_take(now):
+            self.rejected += 1
+            return False
+        if not self.global_bucket.try_take(now):
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def metrics(self):
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "max_in_flight": self.max_in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "guild_buckets": len(self.guild_buckets),
+        }
+
+
+def admission_controlled(controller):
+    """インタラクションの処理関数を流入制御の対象にするデコレーター
+
+    ボタンのコールバック（self, interaction, button）とスラッシュコマンド（interaction, ...）の両方に使える。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = next(arg for arg in args if isinstance(arg, discord.Interaction))
+            if not controller.try_admit(interaction.guild_id):
+                logging.warning("混雑のため受付を見送りました: %s (処理中 %d件)", func.__name__, controller.in_flight)
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(BUSY_MESSAGE, ephemeral=True)
+                return
+            started_at = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                controller.release()
+                logging.info(
+                    "%s の処理が完了しました", func.__name__,
+                    extra={"duration_ms": round((time.monotonic() - started_at) * 1000, 2), "sampled": True}
+                )
+        return wrapper
+    return decorator
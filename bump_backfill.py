@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from collections import Counter
+
+import discord
+
+import storage
+
+db = storage.load_backend()
+
+# --- BUMP回数の過去ログ走査（バックフィル） ---
+# チャンネルの履歴を古い順に1ページずつ読み、Bumpしたユーザーごとの回数をメモリ上で集計する。
+# 数ページごとに、集計した回数の加算と「どこまで読んだか」（チャンネルごとの最後のメッセージID）を
+# 1つのトランザクションでDBに書くので、途中で落ちても続きから再開でき、同じメッセージを二重に数えない。
+# 走査を始めた時点より後のメッセージは読まない（それ以降のBumpは record_bump で数えられるため）。
+
+DISBOARD_BOT_ID = 302050872383242240
+DISBOARD_BUMP_MARKERS = ("表示順をアップ", "Bump done")
+
+HISTORY_PAGE_SIZE = 100        # 1回のAPI呼び出しで取得する件数（Discordの上限）
+HISTORY_PAGE_DELAY = 1.0       # ページ間の待ち時間（秒）。履歴取得のレート制限に当たらないように空ける
+FLUSH_EVERY_PAGES = 10         # 何ページごとにDBへ書き込むか（落ちたときに読み直すのは最大でこの分）
+
+
+def disboard_bumper_id(message):
+    """DISBOARD の /bump 成功メッセージなら、実行したユーザーのIDを返す（それ以外は None）"""
+    if message.author.id != DISBOARD_BOT_ID or message.interaction is None:
+        return None
+    for embed in message.embeds:
+        description = embed.description or ""
+        if any(marker in description for marker in DISBOARD_BUMP_MARKERS):
+            return message.interaction.user.id
+    return None
+
+
+class BumpBackfill:
+    """チャンネルの履歴からBump回数を数え直す、中断・再開できる走査"""
+    def __init__(self, detect=disboard_bumper_id, page_size=HISTORY_PAGE_SIZE,
+                 page_delay=HISTORY_PAGE_DELAY, flush_every_pages=FLUSH_EVERY_PAGES):
+        self.detect = detect
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.flush_every_pages = flush_every_pages
+
+    async def _read_page(self, channel, after_id, stop_id):
+        """after_id より新しく stop_id より古いメッセージを古い順に1ページ分読む"""
+        after = discord.Object(id=after_id) if after_id else None
+        return [
+            message async for message in channel.history(
+                limit=self.page_size, after=after, before=discord.Object(id=stop_id), oldest_first=True
+            )
+        ]
+
+    async def scan_channel(self, channel):
+        """1つのチャンネルを走査し、終わったら True を返す（前回の続きから始める）"""
+        cursor = await db.start_scan_cursor(channel.id, discord.utils.time_snowflake(discord.utils.utcnow()))
+        if cursor['completed']:
+            return True
+        last_message_id = cursor['last_message_id']
+        stop_message_id = cursor['stop_message_id']
+        counts = Counter()
+        scanned = 0
+        pages = 0
+        completed = False
+
+        logging.info(f"Bump履歴の走査を開始: #{channel} (再開位置: {last_message_id or '最初から'}, 累計 {cursor['scanned_messages']}件)")
+        try:
+            while not completed:
+                messages = await self._read_page(channel, last_message_id, stop_message_id)
+                for message in messages:
+                    user_id = self.detect(message)
+                    if user_id is not None:
+                        counts[user_id] += 1
+                if messages:
+                    last_message_id = messages[-1].id
+                    scanned += len(messages)
+                # 1ページに満たなければ走査開始時点まで読み終わった
+                completed = len(messages) < self.page_size
+                pages += 1
+                if completed or pages % self.flush_every_pages == 0:
+                    await db.flush_bump_backfill(channel.id, dict(counts), last_message_id, scanned, completed)
+                    counts.clear()
+                    scanned = 0
+                if not completed:
+                    await asyncio.sleep(self.page_delay)
+        except discord.Forbidden:
+            logging.warning(f"#{channel} の履歴を読む権限がないため、走査を中断しました")
+            return False
+
+        logging.info(f"Bump履歴の走査が完了: #{channel}")
+        return True
+
+    async def run(self, channels):
+        """複数のチャンネルを順に走査し、すべて終わったら走査完了として記録する"""
+        results = []
+        for channel in channels:
+            results.append(await self.scan_channel(channel))
+        if all(results):
+            await db.mark_scan_as_completed()
+        return all(results)
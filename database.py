@@ -1,6 +1,13 @@
 import os
+import asyncio
 import asyncpg
 import datetime
+import time
+import socket
+import hashlib
+import logging
+import json
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 # 環境変数を読み込み
@@ -9,12 +16,213 @@ load_dotenv()
 # ### Supabaseデータベース接続用の共通関数 ###
 # Supabaseローカル開発環境のPostgreSQLデータベースに直接接続
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# 読み取り専用レプリカの接続先（任意）。一覧・集計などの読み込みをこちらに回して、報告の書き込みと競合させない
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+# 日付の区切り（1日の報告数上限など）は日本時間で判定する
+JST = datetime.timezone(datetime.timedelta(hours=9))
+# 複数プロセス・複数コンテナで動かすときに各プロセスを識別するID
+INSTANCE_ID = os.environ.get('INSTANCE_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+DATABASE_CONNECT_TIMEOUT = 5  # 接続にかける最大秒数（DBが落ちているときに長く待たないように）
+
+# --- サーキットブレーカー ---
+# 接続エラーが続いたらしばらくDBへの問い合わせをやめ、すぐに DatabaseUnavailable を返す。
+# reset_seconds ごとに1回だけ試しに通し、成功したら元に戻す。
+# （DBが落ちている間、接続タイムアウトを毎回待ってインタラクションの応答が遅れないようにする）
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.TooManyConnectionsError,
+)
+
+
+class DatabaseUnavailable(Exception):
+    """DBに接続できない（サーキットブレーカーが開いている）"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """問い合わせてよいか（開いている間は reset_seconds ごとに1回だけ試しに通す）"""
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logging.info("DBへの接続が回復しました（サーキットブレーカーを閉じます）")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.error("DBへの接続エラーが続いたため、サーキットブレーカーを開きます")
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+
+class _GuardedAcquire:
+    """pool.acquire() の結果をサーキットブレーカーに伝える"""
+    def __init__(self, acquire, breaker):
+        self._acquire = acquire
+        self._breaker = breaker
+
+    async def __aenter__(self):
+        try:
+            return await self._acquire.__aenter__()
+        except CONNECTION_ERRORS as e:
+            self._breaker.record_failure()
+            raise DatabaseUnavailable(str(e)) from e
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            result = await self._acquire.__aexit__(exc_type, exc, tb)
+        except CONNECTION_ERRORS:
+            # 壊れた接続をプールに戻せなかっただけなので、元の例外を優先する
+            result = False
+        if exc_type is None:
+            self._breaker.record_success()
+        elif issubclass(exc_type, CONNECTION_ERRORS):
+            self._breaker.record_failure()
+            raise DatabaseUnavailable(str(exc)) from exc
+        return result
+
+
+class _GuardedPool:
+    """接続プールの acquire() をサーキットブレーカー越しに行う（それ以外はプールそのまま）"""
+    def __init__(self, pool, breaker):
+        self._pool = pool
+        self._breaker = breaker
+
+    def acquire(self, **kwargs):
+        return _GuardedAcquire(self._pool.acquire(**kwargs), self._breaker)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+# プロセス全体で共有する接続プール（関数呼び出しごとに新規作成しない）
+_pool = None
+_pool_lock = asyncio.Lock()
 
 async def get_pool():
     """Supabaseローカル開発環境のPostgreSQLデータベース接続プールを取得"""
+    global _pool
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL environment variable is not set.")
-    return await asyncpg.create_pool(DATABASE_URL, statement_cache_size=0)
+    if not breaker.allow():
+        raise DatabaseUnavailable("サーキットブレーカーが開いています")
+    if _pool is None or _pool.is_closing():
+        async with _pool_lock:
+            if _pool is None or _pool.is_closing():
+                try:
+                    _pool = await asyncpg.create_pool(
+                        DATABASE_URL, statement_cache_size=0, timeout=DATABASE_CONNECT_TIMEOUT
+                    )
+                except CONNECTION_ERRORS as e:
+                    breaker.record_failure()
+                    raise DatabaseUnavailable(str(e)) from e
+    return _GuardedPool(_pool, breaker)
+
+# --- 読み取り専用レプリカへの振り分け ---
+# 読み込みだけの関数は get_read_pool() を使い、DATABASE_READ_URL があればレプリカに問い合わせる。
+# レプリカは少し遅れて追いつくので、直近に書き込んだ対象（サーバー・ユーザーなど）の読み込みは
+# READ_YOUR_WRITES_SECONDS の間だけプライマリに送り、書いたばかりの内容が見えないことがないようにする。
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '10'))
+read_breaker = CircuitBreaker()
+_read_pool = None
+_recent_writes = {}  # 書き込んだ対象 -> この時刻まではプライマリから読む
+
+def _note_write(*keys):
+    """書き込んだ対象を記録する（"reports" / ("guild", id) / ("user", id) / "bumps" / ("intro", id)）"""
+    now = time.monotonic()
+    if len(_recent_writes) > 10000:
+        for key in [key for key, until in _recent_writes.items() if until <= now]:
+            del _recent_writes[key]
+    for key in keys:
+        _recent_writes[key] = now + READ_YOUR_WRITES_SECONDS
+
+def _written_recently(keys):
+    now = time.monotonic()
+    return any(_recent_writes.get(key, 0) > now for key in keys)
+
+class _ReplicaAcquire:
+    """レプリカから接続を借りる（レプリカに繋がらなければプライマリから借り直す）"""
+    def __init__(self, pool, kwargs):
+        self._pool = pool
+        self._kwargs = kwargs
+        self._acquire = None
+
+    async def __aenter__(self):
+        self._acquire = _GuardedAcquire(self._pool.acquire(**self._kwargs), read_breaker)
+        try:
+            return await self._acquire.__aenter__()
+        except DatabaseUnavailable as e:
+            logging.warning(f"読み取りレプリカに接続できないため、プライマリから読み込みます: {e}")
+        primary = await get_pool()
+        self._acquire = primary.acquire(**self._kwargs)
+        return await self._acquire.__aenter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await self._acquire.__aexit__(exc_type, exc, tb)
+
+
+class _ReplicaPool(_GuardedPool):
+    """レプリカの接続プール（acquire() でレプリカが落ちていればプライマリに切り替える）"""
+    def acquire(self, **kwargs):
+        return _ReplicaAcquire(self._pool, kwargs)
+
+
+_read_pool_lock = asyncio.Lock()  # プライマリの _pool_lock とは分ける（作成に失敗したらプライマリを取りに行くため）
+
+async def get_read_pool(*keys):
+    """読み込み専用の問い合わせに使うプール（keys は読み込む対象。直近に書き込んでいればプライマリ）"""
+    global _read_pool
+    if not DATABASE_READ_URL or _written_recently(keys) or not read_breaker.allow():
+        return await get_pool()
+    if _read_pool is None or _read_pool.is_closing():
+        async with _read_pool_lock:
+            if _read_pool is None or _read_pool.is_closing():
+                try:
+                    _read_pool = await asyncpg.create_pool(
+                        DATABASE_READ_URL, statement_cache_size=0, timeout=DATABASE_CONNECT_TIMEOUT
+                    )
+                except CONNECTION_ERRORS as e:
+                    read_breaker.record_failure()
+                    logging.warning(f"読み取りレプリカに接続できないため、プライマリから読み込みます: {e}")
+        if _read_pool is None or _read_pool.is_closing():
+            # レプリカに繋がらないときはプライマリで読む（ロックを離してから取りに行く）
+            return await get_pool()
+    return _ReplicaPool(_read_pool, read_breaker)
+
+async def close_pool():
+    """共有の接続プールを閉じる（スクリプトの終了時など）"""
+    global _pool, _read_pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+    if _read_pool is not None:
+        await _read_pool.close()
+        _read_pool = None
 # #################################
 
 
@@ -51,6 +259,17 @@ async def init_db():
             INSERT INTO settings (key, value) VALUES ('scan_completed', 'false')
             ON CONFLICT (key) DO NOTHING;
         ''')
+        # 過去ログ走査（バックフィル）の進み具合をチャンネルごとに記録するテーブル
+        await connection.execute('''
+            CREATE TABLE IF NOT EXISTS scan_cursors (
+                channel_id BIGINT PRIMARY KEY,
+                last_message_id BIGINT,
+                stop_message_id BIGINT NOT NULL,
+                scanned_messages BIGINT NOT NULL DEFAULT 0,
+                completed BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+            );
+        ''')
     
 
 async def is_scan_completed():
@@ -66,7 +285,57 @@ async def mark_scan_as_completed():
         await connection.execute("UPDATE settings SET value = 'true' WHERE key = 'scan_completed'")
     
 
+async def get_scan_cursor(channel_id):
+    """チャンネルの走査位置を取得する（未着手ならNone）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        return await connection.fetchrow(
+            "SELECT last_message_id, stop_message_id, scanned_messages, completed FROM scan_cursors WHERE channel_id = $1",
+            channel_id
+        )
+
+async def start_scan_cursor(channel_id, stop_message_id):
+    """走査を始める（すでに記録があればそちらを優先して返す）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        await connection.execute('''
+            INSERT INTO scan_cursors (channel_id, stop_message_id) VALUES ($1, $2)
+            ON CONFLICT (channel_id) DO NOTHING;
+        ''', channel_id, stop_message_id)
+        return await connection.fetchrow(
+            "SELECT last_message_id, stop_message_id, scanned_messages, completed FROM scan_cursors WHERE channel_id = $1",
+            channel_id
+        )
+
+async def flush_bump_backfill(channel_id, counts, last_message_id, scanned_messages, completed=False):
+    """集計したBump回数の加算と走査位置の更新を1つのトランザクションで行う
+
+    途中で落ちても、加算済みの分と走査位置が食い違わない（再開時に二重に数えない）。
+    """
+    _note_write("bumps", *(("user", user_id) for user_id in counts))
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            if counts:
+                await connection.execute('''
+                    INSERT INTO users (user_id, bump_count)
+                    SELECT * FROM unnest($1::bigint[], $2::int[])
+                    ON CONFLICT (user_id) DO UPDATE SET bump_count = users.bump_count + EXCLUDED.bump_count;
+                ''', list(counts.keys()), list(counts.values()))
+            await connection.execute('''
+                UPDATE scan_cursors
+                SET last_message_id = $2, scanned_messages = scanned_messages + $3, completed = $4, updated_at = NOW()
+                WHERE channel_id = $1;
+            ''', channel_id, last_message_id, scanned_messages, completed)
+
+async def reset_scan_cursor(channel_id):
+    """走査位置を消して、次回は最初から走査し直す（加算済みのBump回数は戻らない）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        await connection.execute("DELETE FROM scan_cursors WHERE channel_id = $1", channel_id)
+
 async def record_bump(user_id):
+    _note_write("bumps", ("user", user_id))
     pool = await get_pool()
     async with pool.acquire() as connection:
         await connection.execute('''
@@ -78,14 +347,14 @@ async def record_bump(user_id):
     return count
 
 async def get_top_users():
-    pool = await get_pool()
+    pool = await get_read_pool("bumps")
     async with pool.acquire() as connection:
         records = await connection.fetch('SELECT user_id, bump_count FROM users ORDER BY bump_count DESC LIMIT 5')
     
     return records
 
 async def get_user_count(user_id):
-    pool = await get_pool()
+    pool = await get_read_pool(("user", user_id))
     async with pool.acquire() as connection:
         count = await connection.fetchval('SELECT bump_count FROM users WHERE user_id = $1', user_id)
     
@@ -112,7 +381,7 @@ async def clear_reminder():
     
 
 async def get_total_bumps():
-    pool = await get_pool()
+    pool = await get_read_pool("bumps")
     async with pool.acquire() as connection:
         total = await connection.fetchval('SELECT SUM(bump_count) FROM users')
     
@@ -135,6 +404,19 @@ async def init_intro_bot_db():
         ''')
     
 
+# 自己紹介の読み込みキャッシュ（書き込みは save_intro だけなので、そこで破棄する）
+# 別プロセスからの書き込みにも追従できるよう、一定時間で読み直す
+INTRO_CACHE_SIZE = 5000
+INTRO_CACHE_TTL_SECONDS = 600
+_intro_cache = OrderedDict()  # user_id -> (有効期限, レコード または None)
+
+def invalidate_intro_cache(user_id=None):
+    """自己紹介のキャッシュを破棄する（user_id 省略時は全件）"""
+    if user_id is None:
+        _intro_cache.clear()
+    else:
+        _intro_cache.pop(user_id, None)
+
 async def save_intro(user_id, channel_id, message_id):
     """ユーザーの自己紹介IDを保存または更新する"""
     pool = await get_pool()
@@ -143,18 +425,55 @@ async def save_intro(user_id, channel_id, message_id):
             INSERT INTO introductions (user_id, channel_id, message_id) VALUES ($1, $2, $3)
             ON CONFLICT (user_id) DO UPDATE SET channel_id = $2, message_id = $3;
         ''', user_id, channel_id, message_id)
+    _note_write(("intro", user_id))
+    invalidate_intro_cache(user_id)
     
 
 async def get_intro_ids(user_id):
     """指定したユーザーの自己紹介IDセットを取得する"""
-    pool = await get_pool()
+    # channel_id と message_id の2つだけを返す（user_id を含むのは get_intro_ids_many のレコードだけ）
+    record = (await get_intro_ids_many([user_id])).get(user_id)
+    if record is None:
+        return None  # 存在しない場合はNoneが返る
+    return record['channel_id'], record['message_id']
+
+
+async def get_intro_ids_many(user_ids):
+    """複数ユーザーの自己紹介IDセットを user_id -> レコード の辞書で返す（自己紹介がないユーザーは含まない）
+
+    キャッシュにないユーザーの分だけを1回のクエリでまとめて取得する。
+    """
+    now = time.monotonic()
+    found = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = _intro_cache.get(user_id)
+        if cached and cached[0] > now:
+            _intro_cache.move_to_end(user_id)
+            if cached[1] is not None:
+                found[user_id] = cached[1]
+        else:
+            missing.append(user_id)
+    if not missing:
+        return found
+
+    pool = await get_read_pool(*(("intro", user_id) for user_id in missing))
     async with pool.acquire() as connection:
-        # channel_id と message_id の両方を返す
-        record = await connection.fetchrow(
-            "SELECT channel_id, message_id FROM introductions WHERE user_id = $1", user_id
+        records = await connection.fetch(
+            "SELECT user_id, channel_id, message_id FROM introductions WHERE user_id = ANY($1::bigint[])", missing
         )
-    
-    return record # 存在しない場合はNoneが返る
+    fetched = {record['user_id']: record for record in records}
+    expires_at = now + INTRO_CACHE_TTL_SECONDS
+    for user_id in missing:
+        record = fetched.get(user_id)
+        # 自己紹介がないことも覚えておき、同じユーザーを何度も問い合わせないようにする
+        _intro_cache[user_id] = (expires_at, record)
+        _intro_cache.move_to_end(user_id)
+        if record is not None:
+            found[user_id] = record
+    while len(_intro_cache) > INTRO_CACHE_SIZE:
+        _intro_cache.popitem(last=False)
+    return found
 
 
 # --- 守護神ボット用のデータベース関数 ---
@@ -163,110 +482,738 @@ async def init_shugoshin_db():
     """守護神ボット用のテーブルを初期化（Supabaseローカル環境）"""
     pool = await get_pool()
     async with pool.acquire() as connection:
-        # 通報データを保存するメインテーブル
+        # テーブルと索引を1回の往復でまとめて作成する
         await connection.execute('''
+            -- 通報データを保存するメインテーブル
             CREATE TABLE IF NOT EXISTS reports (
                 report_id SERIAL PRIMARY KEY, guild_id BIGINT, message_id BIGINT,
                 target_user_id BIGINT, violated_rule TEXT, details TEXT,
                 message_link TEXT, urgency TEXT, status TEXT DEFAULT '未対応',
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
             );
-        ''')
-        # サーバー別の設定を保存するテーブル
-        await connection.execute('''
+            -- サーバー別の設定を保存するテーブル
             CREATE TABLE IF NOT EXISTS guild_settings (
                 guild_id BIGINT PRIMARY KEY,
                 report_channel_id BIGINT,
                 urgent_role_id BIGINT
             );
-        ''')
-        # 通報のクールダウン機能用テーブル
-        await connection.execute('''
+            -- 複数サーバー対応：報告ボタン・警告・管理者用チャンネルとルールリンクをサーバーごとに保存
+            ALTER TABLE guild_settings
+                ADD COLUMN IF NOT EXISTS report_button_channel_id BIGINT,
+                ADD COLUMN IF NOT EXISTS warning_channel_id BIGINT,
+                ADD COLUMN IF NOT EXISTS admin_only_channel_id BIGINT,
+                ADD COLUMN IF NOT EXISTS rule_announcement_link TEXT;
+            -- 報告メッセージを送信したチャンネル（ステータス変更時の埋め込み編集に使用）
+            ALTER TABLE reports ADD COLUMN IF NOT EXISTS channel_id BIGINT;
+            -- 同じ出来事への重複報告をまとめるための指紋と、まとめた報告者の数
+            ALTER TABLE reports
+                ADD COLUMN IF NOT EXISTS fingerprint TEXT,
+                ADD COLUMN IF NOT EXISTS reporter_count INTEGER NOT NULL DEFAULT 1;
+            CREATE INDEX IF NOT EXISTS reports_fingerprint_idx ON reports (fingerprint, created_at DESC)
+                WHERE fingerprint IS NOT NULL;
+            -- 報告の状態変化を追記していくイベントログ（更新・削除はしない）
+            -- event_type: created / status_changed / warning_issued / message_linked / duplicate_merged
+            CREATE TABLE IF NOT EXISTS report_events (
+                event_id BIGSERIAL PRIMARY KEY,
+                report_id INTEGER NOT NULL,
+                guild_id BIGINT,
+                target_user_id BIGINT,
+                event_type TEXT NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}',
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS report_events_report_id_idx ON report_events (report_id, event_id);
+            -- 同一対象への複数報告（自動警告など）を数えるための索引
+            CREATE INDEX IF NOT EXISTS report_events_target_idx ON report_events (guild_id, target_user_id, created_at)
+                WHERE event_type = 'created';
+            -- イベントログから作る集計（ステータスごとの件数）。イベントと同じトランザクションで更新する
+            CREATE TABLE IF NOT EXISTS report_status_counts (
+                guild_id BIGINT NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, status)
+            );
+            -- 報告ボタンの設置場所（複数プロセスからの二重送信を防ぐため、作成・移動中は claimed_until までロック）
+            CREATE TABLE IF NOT EXISTS report_buttons (
+                guild_id BIGINT PRIMARY KEY,
+                channel_id BIGINT,
+                message_id BIGINT,
+                claimed_by TEXT,
+                claimed_until TIMESTAMP WITH TIME ZONE
+            );
+            -- 1日の報告数（日本時間の日付ごと）。古い日付の行は定期的に削除する
+            CREATE TABLE IF NOT EXISTS report_daily_counts (
+                user_id BIGINT NOT NULL,
+                day DATE NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            );
+            -- 通報のクールダウン機能用テーブル
             CREATE TABLE IF NOT EXISTS report_cooldowns (
                 user_id BIGINT PRIMARY KEY,
                 last_report_at TIMESTAMP WITH TIME ZONE NOT NULL
             );
+            -- 報告ウィザードの途中経過（再起動をまたいで入力を続けられるように保存する）
+            CREATE TABLE IF NOT EXISTS report_drafts (
+                guild_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                target_user_id BIGINT,
+                violated_rule TEXT,
+                urgency TEXT,
+                issue_warning BOOLEAN NOT NULL DEFAULT FALSE,
+                details TEXT,
+                message_link TEXT,
+                updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (guild_id, user_id)
+            );
         ''')
+        # 全文検索用の列と索引（報告が多いと初回の列追加に時間がかかる）
+        # 'simple' 設定の全文検索は空白区切りの語に、トライグラムは空白で区切られない日本語の部分一致に使う
+        await connection.execute('''
+            ALTER TABLE reports
+                ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+                    COALESCE(violated_rule, '') || ' ' || COALESCE(details, '') || ' ' || COALESCE(message_link, '')
+                ) STORED,
+                ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR GENERATED ALWAYS AS (
+                    to_tsvector('simple', COALESCE(violated_rule, '') || ' ' || COALESCE(details, '') || ' ' || COALESCE(message_link, ''))
+                ) STORED;
+            CREATE INDEX IF NOT EXISTS reports_guild_report_idx ON reports (guild_id, report_id DESC);
+            CREATE INDEX IF NOT EXISTS reports_search_tsv_idx ON reports USING GIN (search_tsv);
+        ''')
+        # 部分一致の索引：pg_bigm があれば1文字・2文字の語も含めてそれで引く。
+        # なければ3文字以上は pg_trgm で引き、2文字以下はサーバー内の報告を ILIKE で絞り込む
+        # （以前の版で作った1文字・2文字の断片の列は、表と索引が大きくなるだけなので消す。列の削除は表を書き換えない）
+        await connection.execute('''
+            DROP INDEX IF EXISTS reports_search_grams_idx;
+            ALTER TABLE reports DROP COLUMN IF EXISTS search_grams;
+            DROP FUNCTION IF EXISTS report_search_grams(text);
+        ''')
+        global _substring_search
+        try:
+            async with connection.transaction():
+                await connection.execute('''
+                    CREATE EXTENSION IF NOT EXISTS pg_bigm;
+                    CREATE INDEX IF NOT EXISTS reports_search_bigm_idx ON reports USING GIN (lower(search_text) gin_bigm_ops);
+                ''')
+            _substring_search = "bigm"
+        except asyncpg.PostgresError as e:
+            logging.info(f"pg_bigm を利用できないため、2文字以下の語はサーバー単位の ILIKE で部分一致を検索します: {e}")
+            try:
+                async with connection.transaction():
+                    await connection.execute('''
+                        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                        CREATE INDEX IF NOT EXISTS reports_search_trgm_idx ON reports USING GIN (search_text gin_trgm_ops);
+                    ''')
+                _substring_search = "trgm"
+            except asyncpg.PostgresError as e:
+                _substring_search = "guild"
+                logging.warning(f"pg_trgm を利用できないため、部分一致はすべてサーバー単位の ILIKE で検索します: {e}")
+        # 既存の報告があるのに集計が空なら（イベントログ導入前のデータ）、ログと集計を作り直す
+        needs_rebuild = await connection.fetchval('''
+            SELECT EXISTS (SELECT 1 FROM reports) AND NOT EXISTS (SELECT 1 FROM report_status_counts)
+        ''')
+    if needs_rebuild:
+        await rebuild_report_projection()
     
 
-async def setup_guild(guild_id, report_channel_id, urgent_role_id):
+# サーバー設定のキャッシュ（guild_id -> (有効期限, レコード)）
+# 報告のたびにDBへ問い合わせないよう、一定時間メモリ上に保持する
+GUILD_SETTINGS_TTL_SECONDS = 300
+GUILD_SETTINGS_COLUMNS = (
+    "report_channel_id, urgent_role_id, report_button_channel_id, "
+    "warning_channel_id, admin_only_channel_id, rule_announcement_link"
+)
+_guild_settings_cache = {}
+
+def invalidate_guild_settings(guild_id=None):
+    """サーバー設定のキャッシュを破棄する（guild_id 省略時は全件）"""
+    if guild_id is None:
+        _guild_settings_cache.clear()
+    else:
+        _guild_settings_cache.pop(guild_id, None)
+
+async def setup_guild(guild_id, report_channel_id, urgent_role_id, report_button_channel_id=None,
+                      warning_channel_id=None, admin_only_channel_id=None, rule_announcement_link=None):
+    """サーバー設定を保存する（チャンネル系の項目は None のとき既存の値を残す）"""
     pool = await get_pool()
     async with pool.acquire() as connection:
         await connection.execute('''
-            INSERT INTO guild_settings (guild_id, report_channel_id, urgent_role_id)
-            VALUES ($1, $2, $3)
+            INSERT INTO guild_settings (guild_id, report_channel_id, urgent_role_id, report_button_channel_id,
+                                        warning_channel_id, admin_only_channel_id, rule_announcement_link)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
             ON CONFLICT (guild_id) DO UPDATE
-            SET report_channel_id = $2, urgent_role_id = $3;
-        ''', guild_id, report_channel_id, urgent_role_id)
+            SET report_channel_id = $2, urgent_role_id = $3,
+                report_button_channel_id = COALESCE($4, guild_settings.report_button_channel_id),
+                warning_channel_id = COALESCE($5, guild_settings.warning_channel_id),
+                admin_only_channel_id = COALESCE($6, guild_settings.admin_only_channel_id),
+                rule_announcement_link = COALESCE($7, guild_settings.rule_announcement_link);
+        ''', guild_id, report_channel_id, urgent_role_id, report_button_channel_id,
+            warning_channel_id, admin_only_channel_id, rule_announcement_link)
+    invalidate_guild_settings(guild_id)
     
 
 async def get_guild_settings(guild_id):
+    cached = _guild_settings_cache.get(guild_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            settings = await connection.fetchrow(
+                f"SELECT {GUILD_SETTINGS_COLUMNS} FROM guild_settings WHERE guild_id = $1",
+                guild_id
+            )
+    except DatabaseUnavailable:
+        # DBに繋がらない間は、期限切れでも最後に読んだ設定を使う
+        if cached:
+            return cached[1]
+        raise
+    # 未設定（None）の結果もキャッシュして、設定のないサーバーで毎回問い合わせないようにする
+    _guild_settings_cache[guild_id] = (time.monotonic() + GUILD_SETTINGS_TTL_SECONDS, settings)
+    return settings
+
+async def prefetch_guild_settings(guild_ids):
+    """複数サーバーの設定を1回のクエリでまとめてキャッシュに読み込む"""
+    guild_ids = list(guild_ids)
+    if not guild_ids:
+        return {}
     pool = await get_pool()
     async with pool.acquire() as connection:
-        settings = await connection.fetchrow(
-            "SELECT report_channel_id, urgent_role_id FROM guild_settings WHERE guild_id = $1",
-            guild_id
+        records = await connection.fetch(
+            f"SELECT guild_id, {GUILD_SETTINGS_COLUMNS} FROM guild_settings WHERE guild_id = ANY($1::bigint[])",
+            guild_ids
         )
+    found = {record['guild_id']: record for record in records}
+    expires_at = time.monotonic() + GUILD_SETTINGS_TTL_SECONDS
+    for guild_id in guild_ids:
+        _guild_settings_cache[guild_id] = (expires_at, found.get(guild_id))
+    return found
+
+async def claim_report_button(guild_id, lease_seconds=60):
+    """報告ボタンの作成・移動権を取得する。他のプロセスが作業中なら None を返す"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        record = await connection.fetchrow('''
+            INSERT INTO report_buttons (guild_id, claimed_by, claimed_until)
+            VALUES ($1, $2, CURRENT_TIMESTAMP + $3 * INTERVAL '1 second')
+            ON CONFLICT (guild_id) DO UPDATE
+            SET claimed_by = $2, claimed_until = EXCLUDED.claimed_until
+            WHERE report_buttons.claimed_until IS NULL
+               OR report_buttons.claimed_until < CURRENT_TIMESTAMP
+               OR report_buttons.claimed_by = $2
+            RETURNING channel_id, message_id;
+        ''', guild_id, INSTANCE_ID, lease_seconds)
     
-    return settings
+    return record
+
+async def release_report_button(guild_id, channel_id=None, message_id=None):
+    """報告ボタンの作成・移動権を手放す（channel_id/message_id を渡すと設置場所も更新）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        await connection.execute('''
+            UPDATE report_buttons
+            SET channel_id = COALESCE($3, channel_id), message_id = COALESCE($4, message_id),
+                claimed_by = NULL, claimed_until = NULL
+            WHERE guild_id = $1 AND claimed_by = $2;
+        ''', guild_id, INSTANCE_ID, channel_id, message_id)
+    
+
+# 今日の報告数のメモリ上のカウンター（(user_id, 日付) -> 件数）
+# 上限に達したユーザーはDBに問い合わせずに断る
+_daily_report_counts = {}
+_daily_report_counts_day = None
+
+def _remember_daily_count(user_id, day, count):
+    global _daily_report_counts_day
+    if day != _daily_report_counts_day:
+        # 日付が変わったら前日までの分を捨てる
+        _daily_report_counts.clear()
+        _daily_report_counts_day = day
+    _daily_report_counts[(user_id, day)] = max(_daily_report_counts.get((user_id, day), 0), count)
+
+async def check_report_limits(user_id, cooldown_seconds, daily_limit=0):
+    """クールダウンと1日の報告数上限をまとめて確認し、問題なければ両方を記録する
+
+    戻り値は (クールダウンの残り秒数, 1日の上限に達しているか)。DBとの往復はクールダウンだけのときと同じ2回。
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    day = now.astimezone(JST).date()
+    if daily_limit and _daily_report_counts.get((user_id, day), 0) >= daily_limit:
+        return 0, True
 
-async def check_cooldown(user_id, cooldown_seconds):
     pool = await get_pool()
     async with pool.acquire() as connection:
         async with connection.transaction():
-            record = await connection.fetchrow(
-                "SELECT last_report_at FROM report_cooldowns WHERE user_id = $1", user_id
-            )
-            now = datetime.datetime.now(datetime.timezone.utc)
-            if record:
+            record = await connection.fetchrow('''
+                SELECT c.last_report_at, d.count AS daily_count
+                FROM (SELECT $1::bigint AS user_id) AS u
+                LEFT JOIN report_cooldowns c ON c.user_id = u.user_id
+                LEFT JOIN report_daily_counts d ON d.user_id = u.user_id AND d.day = $2
+            ''', user_id, day)
+            daily_count = record['daily_count'] or 0
+            _remember_daily_count(user_id, day, daily_count)
+            if record['last_report_at']:
                 time_since_last = now - record['last_report_at']
                 if time_since_last.total_seconds() < cooldown_seconds:
-                    return cooldown_seconds - time_since_last.total_seconds()
-            await connection.execute('''
+                    return cooldown_seconds - time_since_last.total_seconds(), False
+            if daily_limit and daily_count >= daily_limit:
+                return 0, True
+            new_count = await connection.fetchval('''
+                WITH cooldown AS (
+                    INSERT INTO report_cooldowns (user_id, last_report_at) VALUES ($1, $2)
+                    ON CONFLICT (user_id) DO UPDATE SET last_report_at = $2
+                )
+                INSERT INTO report_daily_counts (user_id, day, count) VALUES ($1, $3, 1)
+                ON CONFLICT (user_id, day) DO UPDATE SET count = report_daily_counts.count + 1
+                RETURNING count;
+            ''', user_id, now, day)
+            _remember_daily_count(user_id, day, new_count)
+            return 0, False
+
+async def apply_spooled_cooldown(user_id, reported_at):
+    """DBに繋がらない間に受け付けた報告のクールダウンと報告数を、後から反映する"""
+    day = reported_at.astimezone(JST).date()
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        new_count = await connection.fetchval('''
+            WITH cooldown AS (
                 INSERT INTO report_cooldowns (user_id, last_report_at) VALUES ($1, $2)
-                ON CONFLICT (user_id) DO UPDATE SET last_report_at = $2;
-            ''', user_id, now)
-            return 0
+                ON CONFLICT (user_id) DO UPDATE SET last_report_at = GREATEST(report_cooldowns.last_report_at, $2)
+            )
+            INSERT INTO report_daily_counts (user_id, day, count) VALUES ($1, $3, 1)
+            ON CONFLICT (user_id, day) DO UPDATE SET count = report_daily_counts.count + 1
+            RETURNING count;
+        ''', user_id, reported_at, day)
+    _remember_daily_count(user_id, day, new_count)
+
+async def check_cooldown(user_id, cooldown_seconds):
+    remaining, _ = await check_report_limits(user_id, cooldown_seconds)
+    return remaining
+
+async def prune_report_daily_counts(keep_days=2):
+    """古い日付の報告数を削除する"""
+    pool = await get_pool()
+    cutoff = datetime.datetime.now(JST).date() - datetime.timedelta(days=keep_days)
+    async with pool.acquire() as connection:
+        await connection.execute("DELETE FROM report_daily_counts WHERE day < $1", cutoff)
     
 
-async def create_report(guild_id, target_user_id, violated_rule, details, message_link, urgency):
+# --- 報告ウィザードの途中経過 ---
+# 入力中の報告は (サーバーID, ユーザーID) ごとに1件だけ持ち、書き込みは常にDBへ通す。
+# 直近に使われたものだけをメモリに残し、それ以外（再起動後など）はDBから読み直す。
+REPORT_DRAFT_TTL_SECONDS = 60 * 60  # 最後の操作からこの秒数が過ぎた途中経過は無効
+REPORT_DRAFT_CACHE_SIZE = 1000
+REPORT_DRAFT_FIELDS = ("target_user_id", "violated_rule", "urgency", "issue_warning", "details", "message_link")
+_report_draft_cache = OrderedDict()  # (guild_id, user_id) -> (保存時刻, 各項目のタプル)
+
+def _cache_report_draft(key, saved_at, values):
+    _report_draft_cache[key] = (saved_at, values)
+    _report_draft_cache.move_to_end(key)
+    while len(_report_draft_cache) > REPORT_DRAFT_CACHE_SIZE:
+        _report_draft_cache.popitem(last=False)
+
+async def save_report_draft(guild_id, user_id, **values):
+    """途中経過を保存する（values は REPORT_DRAFT_FIELDS の項目）"""
+    row = tuple(values.get(field, False if field == "issue_warning" else None) for field in REPORT_DRAFT_FIELDS)
+    _cache_report_draft((guild_id, user_id), time.time(), row)
+    try:
+        pool = await get_pool()
+    except DatabaseUnavailable:
+        # DBに繋がらない間はメモリ上だけに持つ（再起動すると失われる）
+        return
+    async with pool.acquire() as connection:
+        await connection.execute('''
+            INSERT INTO report_drafts (guild_id, user_id, target_user_id, violated_rule, urgency, issue_warning, details, message_link, updated_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, NOW())
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                target_user_id = $3, violated_rule = $4, urgency = $5, issue_warning = $6,
+                details = $7, message_link = $8, updated_at = NOW();
+        ''', guild_id, user_id, *row)
+
+async def get_report_draft(guild_id, user_id):
+    """途中経過を項目名 -> 値の辞書で返す（ない・期限切れの場合は None）"""
+    key = (guild_id, user_id)
+    cached = _report_draft_cache.get(key)
+    if cached and cached[0] > time.time() - REPORT_DRAFT_TTL_SECONDS:
+        _report_draft_cache.move_to_end(key)
+        return dict(zip(REPORT_DRAFT_FIELDS, cached[1]))
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        record = await connection.fetchrow('''
+            SELECT target_user_id, violated_rule, urgency, issue_warning, details, message_link,
+                   EXTRACT(EPOCH FROM updated_at) AS saved_at
+            FROM report_drafts
+            WHERE guild_id = $1 AND user_id = $2 AND updated_at > NOW() - make_interval(secs => $3)
+        ''', guild_id, user_id, REPORT_DRAFT_TTL_SECONDS)
+    if not record:
+        _report_draft_cache.pop(key, None)
+        return None
+    values = tuple(record[field] for field in REPORT_DRAFT_FIELDS)
+    _cache_report_draft(key, float(record['saved_at']), values)
+    return dict(zip(REPORT_DRAFT_FIELDS, values))
+
+async def delete_report_draft(guild_id, user_id):
+    """途中経過を削除する（送信・キャンセル時）"""
+    _report_draft_cache.pop((guild_id, user_id), None)
+    try:
+        pool = await get_pool()
+    except DatabaseUnavailable:
+        return  # DBに残った分は期限切れで消える
+    async with pool.acquire() as connection:
+        await connection.execute("DELETE FROM report_drafts WHERE guild_id = $1 AND user_id = $2", guild_id, user_id)
+
+async def prune_report_drafts():
+    """期限切れの途中経過を削除する"""
+    cutoff = time.time() - REPORT_DRAFT_TTL_SECONDS
+    for key in [key for key, (saved_at, _) in _report_draft_cache.items() if saved_at <= cutoff]:
+        del _report_draft_cache[key]
     pool = await get_pool()
     async with pool.acquire() as connection:
-        report_id = await connection.fetchval(
-            '''INSERT INTO reports (guild_id, target_user_id, violated_rule, details, message_link, urgency) 
-               VALUES ($1, $2, $3, $4, $5, $6) RETURNING report_id''',
-            guild_id, target_user_id, violated_rule, details, message_link, urgency
+        await connection.execute(
+            "DELETE FROM report_drafts WHERE updated_at <= NOW() - make_interval(secs => $1)", REPORT_DRAFT_TTL_SECONDS
         )
+
+async def _append_report_events(connection, events):
+    """イベントログに追記する（events: (report_id, guild_id, target_user_id, event_type, payload) のリスト）"""
+    if not events:
+        return
+    report_ids, guild_ids, target_user_ids, event_types, payloads = zip(*events)
+    # 報告への書き込みはすべてここを通るので、読み込みの振り分け用にまとめて記録する
+    _note_write("reports", *(("guild", guild_id) for guild_id in set(guild_ids) if guild_id is not None))
+    await connection.execute('''
+        INSERT INTO report_events (report_id, guild_id, target_user_id, event_type, payload)
+        SELECT * FROM unnest($1::int[], $2::bigint[], $3::bigint[], $4::text[], $5::jsonb[]);
+    ''', list(report_ids), list(guild_ids), list(target_user_ids), list(event_types),
+        [json.dumps(payload, ensure_ascii=False) for payload in payloads])
+
+async def _apply_status_counts(connection, deltas):
+    """ステータス別件数の集計を差分で更新する（deltas: (guild_id, status, 増減) のリスト）"""
+    deltas = [delta for delta in deltas if delta[0] is not None]
+    if not deltas:
+        return
+    guild_ids, statuses, amounts = zip(*deltas)
+    await connection.execute('''
+        INSERT INTO report_status_counts (guild_id, status, count)
+        SELECT guild_id, status, SUM(delta)
+        FROM unnest($1::bigint[], $2::text[], $3::int[]) AS d(guild_id, status, delta)
+        GROUP BY guild_id, status
+        ON CONFLICT (guild_id, status) DO UPDATE SET count = report_status_counts.count + EXCLUDED.count;
+    ''', list(guild_ids), list(statuses), list(amounts))
+
+# --- 重複報告のまとめ ---
+# 同じサーバー・同じ対象者・同じルール・同じメッセージリンクの報告は同じ出来事とみなし、
+# DUPLICATE_REPORT_WINDOW_SECONDS 以内の未解決の報告があれば新しく作らずにそちらの報告者数を増やす。
+# メッセージリンクのない報告は内容で見分けられないので、まとめない。
+# 新しい報告の方が重い（緊急度が高い・まだ発行していない警告を求めている）ときは、緊急ロールの通知や警告が
+# 埋もれないよう、まとめずに別の報告として登録する（以降の同じ報告はそちらにまとまる）。
+DUPLICATE_REPORT_WINDOW_SECONDS = 30 * 60
+MERGEABLE_REPORT_STATUSES = ('未対応', '対応中')
+URGENCY_LEVELS = ('低', '中', '高')  # 緊急度（後ろほど高い）
+
+def urgency_rank(urgency):
+    return URGENCY_LEVELS.index(urgency) if urgency in URGENCY_LEVELS else 0
+
+def report_fingerprint(guild_id, target_user_id, violated_rule, message_link):
+    """重複報告を見分けるための指紋（メッセージリンクがなければ None）"""
+    link = (message_link or "").strip()
+    if not link:
+        return None
+    # 同じメッセージでもクライアントによってリンクのホスト名が違うのでそろえる
+    for host in ("ptb.discord.com", "canary.discord.com", "discordapp.com"):
+        link = link.replace(f"://{host}/", "://discord.com/")
+    key = f"{guild_id}\n{target_user_id}\n{violated_rule}\n{link.rstrip('/')}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+async def reserve_report_id():
+    """報告IDを先に採番しておく（報告ウィザードの入力中に埋め込みを用意するため。使われなかったIDは欠番になる）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        report_id = await connection.fetchval("SELECT nextval(pg_get_serial_sequence('reports', 'report_id'))")
     
     return report_id
 
-async def update_report_message_id(report_id, message_id):
+async def _insert_report(connection, guild_id, target_user_id, violated_rule, details, message_link, urgency,
+                         created_at, fingerprint, report_id=None):
+    record = await connection.fetchrow('''
+        INSERT INTO reports (report_id, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at, fingerprint)
+        VALUES (COALESCE($9, nextval(pg_get_serial_sequence('reports', 'report_id'))), $1, $2, $3, $4, $5, $6, COALESCE($7, NOW()), $8)
+        RETURNING report_id, status, reporter_count, message_id, channel_id
+    ''', guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at, fingerprint, report_id)
+    await _append_report_events(connection, [(
+        record['report_id'], guild_id, target_user_id, 'created',
+        {'status': record['status'], 'violated_rule': violated_rule, 'urgency': urgency}
+    )])
+    await _apply_status_counts(connection, [(guild_id, record['status'], 1)])
+    return record
+
+async def create_report(guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at=None,
+                        report_id=None):
+    """報告を登録する
+
+    created_at はスプールから後で登録するときの元の受付時刻、report_id は reserve_report_id で採番済みのID。
+    """
+    fingerprint = report_fingerprint(guild_id, target_user_id, violated_rule, message_link)
     pool = await get_pool()
     async with pool.acquire() as connection:
-        await connection.execute(
-            "UPDATE reports SET message_id = $1 WHERE report_id = $2",
-            message_id, report_id
-        )
+        async with connection.transaction():
+            record = await _insert_report(
+                connection, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at,
+                fingerprint, report_id
+            )
+    
+    return record['report_id']
+
+async def create_or_merge_report(guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at=None,
+                                 report_id=None, issue_warning=False):
+    """報告を登録する。直近に同じ指紋の未解決の報告があり、新しい報告より軽くなければ、新しく作らずにそちらへまとめる
+
+    戻り値は report_id / reporter_count / message_id / channel_id を持つレコード（reporter_count が2以上ならまとめた）。
+    まとめた場合、採番済みの report_id は使われない。
+    """
+    fingerprint = report_fingerprint(guild_id, target_user_id, violated_rule, message_link)
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            if fingerprint:
+                # 同じ出来事の報告が同時に届いても1件にまとまるよう、指紋ごとのロックを取ってから探す
+                lock_key = int.from_bytes(bytes.fromhex(fingerprint[:16]), "big", signed=True)
+                await connection.execute("SELECT pg_advisory_xact_lock($1)", lock_key)
+                record = await connection.fetchrow('''
+                    UPDATE reports SET reporter_count = reporter_count + 1
+                    WHERE report_id = (
+                        SELECT report_id FROM reports
+                        WHERE fingerprint = $1 AND status = ANY($2::text[])
+                          AND created_at > COALESCE($3, NOW()) - $4 * INTERVAL '1 second'
+                        ORDER BY created_at DESC
+                        LIMIT 1
+                    )
+                      AND COALESCE(array_position($5::text[], urgency) - 1, 0) >= $6
+                      AND (NOT $7 OR EXISTS (
+                          SELECT 1 FROM report_events AS e
+                          WHERE e.report_id = reports.report_id AND e.event_type = 'warning_issued'
+                      ))
+                    RETURNING report_id, reporter_count, message_id, channel_id
+                ''', fingerprint, list(MERGEABLE_REPORT_STATUSES), created_at, DUPLICATE_REPORT_WINDOW_SECONDS,
+                    list(URGENCY_LEVELS), urgency_rank(urgency), bool(issue_warning))
+                if record:
+                    await _append_report_events(connection, [(
+                        record['report_id'], guild_id, target_user_id, 'duplicate_merged',
+                        {'reporter_count': record['reporter_count'], 'urgency': urgency, 'details': details}
+                    )])
+                    return record
+            return await _insert_report(
+                connection, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at,
+                fingerprint, report_id
+            )
+
+async def update_report_message_id(report_id, message_id, channel_id=None):
+    """報告メッセージを記録し、その時点の報告者数を返す（送信中にまとめられた重複報告も数えた値）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            record = await connection.fetchrow(
+                "UPDATE reports SET message_id = $1, channel_id = COALESCE($3, channel_id) WHERE report_id = $2 "
+                "RETURNING guild_id, target_user_id, channel_id, reporter_count",
+                message_id, report_id, channel_id
+            )
+            if record:
+                await _append_report_events(connection, [(
+                    report_id, record['guild_id'], record['target_user_id'], 'message_linked',
+                    {'message_id': message_id, 'channel_id': record['channel_id']}
+                )])
+
+    return record['reporter_count'] if record else None
+
+async def record_warning_issued(report_id):
+    """報告に対して警告を発行したことをイベントログに記録する"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            record = await connection.fetchrow(
+                "SELECT guild_id, target_user_id FROM reports WHERE report_id = $1", report_id
+            )
+            if record:
+                await _append_report_events(connection, [(
+                    report_id, record['guild_id'], record['target_user_id'], 'warning_issued', {}
+                )])
     
 
+async def _change_status(connection, report_ids, new_status, guild_id=None):
+    """ステータス変更・イベント追記・集計更新を同じトランザクション内で行う"""
+    records = await connection.fetch('''
+        UPDATE reports AS r SET status = $1
+        FROM (
+            SELECT report_id, status AS old_status FROM reports
+            WHERE report_id = ANY($2::int[]) AND ($3::bigint IS NULL OR guild_id = $3)
+            FOR UPDATE
+        ) AS old
+        WHERE r.report_id = old.report_id
+        RETURNING r.report_id, r.guild_id, r.target_user_id, r.message_id, r.channel_id, old.old_status;
+    ''', new_status, list(report_ids), guild_id)
+    changed = [record for record in records if record['old_status'] != new_status]
+    await _append_report_events(connection, [
+        (record['report_id'], record['guild_id'], record['target_user_id'], 'status_changed',
+         {'status': new_status, 'previous_status': record['old_status']})
+        for record in changed
+    ])
+    deltas = []
+    for record in changed:
+        deltas.append((record['guild_id'], record['old_status'], -1))
+        deltas.append((record['guild_id'], new_status, 1))
+    await _apply_status_counts(connection, deltas)
+    return records
+
 async def update_report_status(report_id, new_status):
     pool = await get_pool()
     async with pool.acquire() as connection:
-        await connection.execute(
-            "UPDATE reports SET status = $1 WHERE report_id = $2",
-            new_status, report_id
-        )
+        async with connection.transaction():
+            await _change_status(connection, [report_id], new_status)
     
 
-async def get_report(report_id):
+async def update_reports_status(report_ids, new_status, guild_id):
+    """複数の報告のステータスを1つのSQLでまとめて変更し、更新できた報告のメッセージ情報を返す"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            records = await _change_status(connection, report_ids, new_status, guild_id)
+    
+    return records
+
+async def get_report_events(after_event_id=0, limit=1000):
+    """イベントログを event_id 順に読み出す（集計を差分で更新する処理が続きから読むため）"""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        records = await connection.fetch('''
+            SELECT event_id, report_id, guild_id, target_user_id, event_type, payload, created_at
+            FROM report_events WHERE event_id > $1 ORDER BY event_id LIMIT $2
+        ''', after_event_id, limit)
+    
+    return records
+
+async def count_recent_reports_for_target(guild_id, target_user_id, hours=24):
+    """指定した時間内に同じ対象者へ寄せられた報告の件数（自動警告の判定用）"""
+    pool = await get_read_pool(("guild", guild_id))
+    async with pool.acquire() as connection:
+        count = await connection.fetchval('''
+            SELECT COUNT(*) FROM report_events
+            WHERE event_type = 'created' AND guild_id = $1 AND target_user_id = $2
+              AND created_at > CURRENT_TIMESTAMP - $3 * INTERVAL '1 hour'
+        ''', guild_id, target_user_id, hours)
+    
+    return count
+
+async def rebuild_report_projection():
+    """イベントログから集計を作り直す（ログのない既存の報告には created イベントを補う）"""
     pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute('''
+                INSERT INTO report_events (report_id, guild_id, target_user_id, event_type, payload, created_at)
+                SELECT r.report_id, r.guild_id, r.target_user_id, 'created',
+                       jsonb_build_object('status', r.status, 'violated_rule', r.violated_rule, 'urgency', r.urgency),
+                       r.created_at
+                FROM reports r
+                WHERE NOT EXISTS (SELECT 1 FROM report_events e WHERE e.report_id = r.report_id);
+            ''')
+            await connection.execute("DELETE FROM report_status_counts")
+            await connection.execute('''
+                INSERT INTO report_status_counts (guild_id, status, count)
+                SELECT guild_id, status, COUNT(*)
+                FROM (
+                    SELECT DISTINCT ON (report_id) report_id, guild_id, payload->>'status' AS status
+                    FROM report_events
+                    WHERE event_type IN ('created', 'status_changed')
+                    ORDER BY report_id, event_id DESC
+                ) AS latest
+                WHERE guild_id IS NOT NULL AND status IS NOT NULL
+                GROUP BY guild_id, status;
+            ''')
+    
+
+async def get_report(report_id):
+    pool = await get_read_pool("reports")
     async with pool.acquire() as connection:
         record = await connection.fetchrow("SELECT * FROM reports WHERE report_id = $1", report_id)
     
     return record
 
+# 部分一致に使える索引（init_shugoshin_db で決まる）
+#   bigm:  pg_bigm（長さによらずこれを使う）
+#   trgm:  3文字以上は pg_trgm、2文字以下はサーバー単位の ILIKE（トライグラムは3文字未満の語に効かない）
+#   guild: 長さによらずサーバー単位の ILIKE
+# サーバー単位の ILIKE は reports_guild_report_idx でそのサーバーの報告を新しい順にたどり、1ページ分見つかれば止まる
+_substring_search = "trgm"
+SHORT_QUERY_LENGTH = 2  # pg_trgm では引けない語の最大の長さ
+REPORT_SEARCH_PAGE_SIZE = 10
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _substring_condition(query):
+    """部分一致の条件と、その $3 に渡す値"""
+    pattern = f"%{_escape_like(query)}%"
+    if _substring_search == "bigm":
+        return "OR lower(search_text) LIKE lower($3)", pattern
+    if _substring_search == "trgm" and len(query) > SHORT_QUERY_LENGTH:
+        return "OR search_text ILIKE $3", pattern
+    # トライグラムの索引を使わせず（3文字未満では全件を読むことになる）、guild_id の索引で絞った中を調べる
+    return "OR search_text || '' ILIKE $3", pattern
+
+async def search_reports(guild_id, query, before_report_id=None, limit=REPORT_SEARCH_PAGE_SIZE):
+    """報告の詳細・違反ルール・メッセージリンクを検索する（サーバー単位、report_id の降順で続きを取得）"""
+    pool = await get_read_pool(("guild", guild_id))
+    sql = '''
+        SELECT report_id, target_user_id, violated_rule, urgency, status, created_at,
+               LEFT(details, 120) AS details_snippet, message_link
+        FROM reports
+        WHERE guild_id = $1
+          AND (search_tsv @@ plainto_tsquery('simple', $2) {substring})
+          AND ($4::int IS NULL OR report_id < $4)
+        ORDER BY report_id DESC
+        LIMIT $5
+    '''
+    substring, pattern = _substring_condition(query)
+    async with pool.acquire() as connection:
+        records = await connection.fetch(
+            sql.format(substring=substring), guild_id, query, pattern, before_report_id, limit
+        )
+    
+    return records
+
+REPORT_EXPORT_COLUMNS = (
+    "report_id", "guild_id", "created_at", "target_user_id", "violated_rule", "urgency",
+    "status", "details", "message_link", "message_id", "channel_id"
+)
+
+async def iter_reports(guild_id, since=None, until=None, status=None, batch_size=500):
+    """サーバーの報告を batch_size 件ずつ report_id の順に読み出す（全件をメモリに載せない）
+
+    1回分を読んだら接続をプールに返してから行を渡す。呼び出し側が途中で Discord へのアップロードを
+    待っても、接続やトランザクション（古いスナップショット）を持ち続けない。
+    """
+    query = f'''
+        SELECT {", ".join(REPORT_EXPORT_COLUMNS)} FROM reports
+        WHERE guild_id = $1
+          AND ($2::timestamptz IS NULL OR created_at >= $2)
+          AND ($3::timestamptz IS NULL OR created_at < $3)
+          AND ($4::text IS NULL OR status = $4)
+          AND report_id > $5
+        ORDER BY report_id
+        LIMIT $6
+    '''
+    last_report_id = 0
+    while True:
+        pool = await get_read_pool(("guild", guild_id))
+        async with pool.acquire() as connection:
+            records = await connection.fetch(query, guild_id, since, until, status, last_report_id, batch_size)
+        for record in records:
+            yield record
+        if len(records) < batch_size:
+            return
+        last_report_id = records[-1]['report_id']
+
 async def list_reports(status_filter=None):
-    pool = await get_pool()
+    pool = await get_read_pool("reports")
     query = "SELECT report_id, target_user_id, status FROM reports"
     params = []
     if status_filter and status_filter != 'all':
@@ -278,13 +1225,220 @@ async def list_reports(status_filter=None):
     
     return records
 
-async def get_report_stats():
-    pool = await get_pool()
+async def get_report_stats(guild_id=None):
+    """ステータス別の報告件数（reports を全件走査せず、イベントログの集計から読む）"""
+    pool = await get_read_pool(("guild", guild_id) if guild_id is not None else "reports")
     async with pool.acquire() as connection:
         stats = await connection.fetch('''
-            SELECT status, COUNT(*) as count 
-            FROM reports 
+            SELECT status, SUM(count)::int as count 
+            FROM report_status_counts 
+            WHERE $1::bigint IS NULL OR guild_id = $1
             GROUP BY status
-        ''')
+            HAVING SUM(count) <> 0  -- 差分の更新で0件になったステータスは、作り直した集計と同じく含めない
+        ''', guild_id)
     
     return {row['status']: row['count'] for row in stats}
+
+
+# --- 複数レプリカ用のリーダー選出 ---
+# Postgres のアドバイザリロックを専用接続で保持している間だけリーダーとみなす。
+# リーダーのプロセスが落ちると接続が切れてロックが自動で解放されるので、
+# 待機中のレプリカが retry_interval 以内に引き継ぐ。
+class LeaderElection:
+    """シングルトンで動かしたいバックグラウンド処理のためのリーダー選出
+
+    on_follower は、最初にロックを取りに行って他のレプリカが持っていたときに1回だけ呼ばれる。
+    """
+    def __init__(self, name, on_elected=None, renew_interval=10, retry_interval=5, on_follower=None):
+        self.name = name
+        # ロック名から64bitのロックキーを作る
+        self.lock_key = int.from_bytes(hashlib.sha256(name.encode("utf-8")).digest()[:8], "big", signed=True)
+        self.on_elected = on_elected
+        self.on_follower = on_follower
+        self.renew_interval = renew_interval
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._connection = None
+        self._elected_task = None
+        self._leader_event = asyncio.Event()
+
+    async def wait_until_leader(self):
+        await self._leader_event.wait()
+
+    async def _try_acquire(self):
+        connection = await asyncpg.connect(
+            DATABASE_URL, statement_cache_size=0,
+            # リーダーが異常終了したときにサーバー側が早く切断を検知するための設定
+            server_settings={'tcp_keepalives_idle': '10', 'tcp_keepalives_interval': '5', 'tcp_keepalives_count': '3'}
+        )
+        try:
+            acquired = await connection.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_key)
+        except Exception:
+            await connection.close()
+            raise
+        if not acquired:
+            await connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    async def _renew(self):
+        """ロックを保持している接続が生きているか確認する（リース更新）"""
+        try:
+            await asyncio.wait_for(self._connection.fetchval("SELECT 1"), timeout=self.renew_interval)
+            return True
+        except Exception as e:
+            logging.warning(f"リーダーロック '{self.name}' の更新に失敗: {e}")
+            return False
+
+    def _become_leader(self):
+        self.is_leader = True
+        self._leader_event.set()
+        logging.info(f"👑 リーダーに選出されました: {self.name} ({INSTANCE_ID})")
+        if self.on_elected:
+            self._elected_task = asyncio.create_task(self.on_elected())
+
+    async def _step_down(self):
+        if self.is_leader:
+            logging.warning(f"リーダーではなくなりました: {self.name} ({INSTANCE_ID})")
+        self.is_leader = False
+        self._leader_event.clear()
+        # 二重実行を防ぐため、リーダーとして始めた処理は止める
+        if self._elected_task and not self._elected_task.done():
+            self._elected_task.cancel()
+        self._elected_task = None
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            try:
+                await connection.close(timeout=5)
+            except Exception:
+                connection.terminate()
+
+    async def run(self):
+        """リーダー選出のループ（stop() されるまで動き続ける）"""
+        try:
+            while True:
+                if self.is_leader:
+                    if not await self._renew():
+                        await self._step_down()
+                        continue
+                    await asyncio.sleep(self.renew_interval)
+                else:
+                    try:
+                        if await self._try_acquire():
+                            self._become_leader()
+                            continue
+                        if self.on_follower:
+                            on_follower, self.on_follower = self.on_follower, None
+                            on_follower()
+                    except Exception as e:
+                        logging.warning(f"リーダーロック '{self.name}' の取得に失敗: {e}")
+                    await asyncio.sleep(self.retry_interval)
+        finally:
+            await self._step_down()
+
+
+# --- 過去データの一括取り込み ---
+# CSV/JSONL から読み込んだ行を COPY で一時テーブルに流し込み、
+# 1回の INSERT ... ON CONFLICT でまとめて本番テーブルに反映する。
+IMPORT_SPECS = {
+    'reports': {
+        'columns': ('report_id', 'guild_id', 'target_user_id', 'violated_rule', 'details', 'message_link',
+                    'urgency', 'status', 'created_at', 'message_id', 'channel_id'),
+        'staging': '''
+            report_id INTEGER, guild_id BIGINT, target_user_id BIGINT, violated_rule TEXT, details TEXT,
+            message_link TEXT, urgency TEXT, status TEXT, created_at TIMESTAMP WITH TIME ZONE,
+            message_id BIGINT, channel_id BIGINT
+        ''',
+        # 新しいIDを振る前に、連番を既存・取り込み分の最大のIDより先に進めておく
+        # （後から進めると、振ったIDが同じファイルの明示的なIDとぶつかって取り込まれない）。
+        # 採番済みでまだ登録していないID（reserve_report_id）を再び振らないよう、連番は戻さない
+        'prepare': '''
+            SELECT setval(pg_get_serial_sequence('reports', 'report_id'), max_id)
+            FROM (
+                SELECT GREATEST(
+                    (SELECT MAX(report_id) FROM reports),
+                    (SELECT MAX(report_id) FROM staging_import),
+                    pg_sequence_last_value(pg_get_serial_sequence('reports', 'report_id')::regclass),
+                    0
+                ) AS max_id
+            ) AS ids
+            WHERE max_id > 0;
+        ''',
+        # report_id がある行はそのIDで取り込み（既にあれば何もしない）、ない行には新しいIDを振る。
+        # 同じファイルを2回取り込んでも増えないよう、report_id のない行は日時・サーバー・対象・ルールが同じ報告が
+        # 既にあれば取り込まない（等号だけで比べて、reports を1回読むハッシュ結合にする）。
+        # report_id も created_at もない行は、次に取り込んだときに同じ報告か見分けられないので取り込まない
+        'merge': '''
+            INSERT INTO reports (report_id, guild_id, target_user_id, violated_rule, details, message_link,
+                                 urgency, status, created_at, message_id, channel_id)
+            SELECT report_id, guild_id, target_user_id, violated_rule, details, message_link, urgency,
+                   COALESCE(status, '未対応'), COALESCE(created_at, CURRENT_TIMESTAMP), message_id, channel_id
+            FROM staging_import
+            WHERE report_id IS NOT NULL
+            UNION ALL
+            SELECT nextval(pg_get_serial_sequence('reports', 'report_id'))::int,
+                   guild_id, target_user_id, violated_rule, details, message_link, urgency,
+                   COALESCE(status, '未対応'), created_at, message_id, channel_id
+            FROM staging_import AS s
+            WHERE s.report_id IS NULL AND s.created_at IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM reports AS r
+                  WHERE r.created_at = s.created_at
+                    AND COALESCE(r.guild_id, 0) = COALESCE(s.guild_id, 0)
+                    AND COALESCE(r.target_user_id, 0) = COALESCE(s.target_user_id, 0)
+                    AND COALESCE(r.violated_rule, '') = COALESCE(s.violated_rule, '')
+              )
+            ON CONFLICT (report_id) DO NOTHING;
+        ''',
+        'skipped': "同じ報告（同じ report_id、または report_id がなく日時・サーバー・対象・ルールが同じもの）が既にあるか、"
+                   "report_id も created_at もないため取り込みませんでした",
+    },
+    'users': {
+        'columns': ('user_id', 'bump_count'),
+        'staging': 'user_id BIGINT NOT NULL, bump_count INTEGER NOT NULL',
+        # 同じファイルを2回取り込んでも数が倍にならないよう、大きい方の値を採用する
+        'merge': '''
+            INSERT INTO users (user_id, bump_count)
+            SELECT user_id, SUM(bump_count) FROM staging_import GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET bump_count = EXCLUDED.bump_count
+            WHERE users.bump_count < EXCLUDED.bump_count;
+        ''',
+        'skipped': "同じユーザーの行を1行にまとめたか、既に同じか大きい回数が記録されていました",
+    },
+    'introductions': {
+        'columns': ('user_id', 'channel_id', 'message_id'),
+        'staging': 'user_id BIGINT NOT NULL, channel_id BIGINT NOT NULL, message_id BIGINT NOT NULL',
+        # 同じユーザーが複数行ある場合はメッセージIDが新しいものを採用する
+        'merge': '''
+            INSERT INTO introductions (user_id, channel_id, message_id)
+            SELECT DISTINCT ON (user_id) user_id, channel_id, message_id
+            FROM staging_import ORDER BY user_id, message_id DESC
+            ON CONFLICT (user_id) DO UPDATE SET channel_id = EXCLUDED.channel_id, message_id = EXCLUDED.message_id
+            WHERE (introductions.channel_id, introductions.message_id) IS DISTINCT FROM (EXCLUDED.channel_id, EXCLUDED.message_id);
+        ''',
+        'skipped': "同じユーザーの行は新しいメッセージの1行だけを反映し、既に同じ内容のものは変更しませんでした",
+    },
+}
+
+async def bulk_import(kind, batches):
+    """batches（行タプルのリストの列）を一括で取り込み、(読み込んだ行数, 反映した行数) を返す"""
+    spec = IMPORT_SPECS[kind]
+    pool = await get_pool()
+    loaded = 0
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute(f"CREATE TEMP TABLE staging_import ({spec['staging']}) ON COMMIT DROP")
+            async for batch in batches:
+                await connection.copy_records_to_table('staging_import', records=batch, columns=spec['columns'])
+                loaded += len(batch)
+            if 'prepare' in spec:
+                await connection.execute(spec['prepare'])
+            status = await connection.execute(spec['merge'])
+    if kind == 'reports':
+        # 取り込んだ報告の created イベントを補い、集計を作り直す
+        await rebuild_report_projection()
+    elif kind == 'introductions':
+        invalidate_intro_cache()
+    merged = int(status.split()[-1]) if status else 0
+    return loaded, merged
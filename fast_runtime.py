@@ -0,0 +1,38 @@
+import os
+import asyncio
+import logging
+
+import discord
+
+# --- 高速ランタイム（任意） ---
+# ACCELERATED_RUNTIME=1 のとき、イベントループを uvloop に切り替える（requirements.txt で入る）。
+# パッケージがなければ警告を出して標準の asyncio のまま動かす。
+# Gateway・HTTP の JSON の読み書きは、discord.py が orjson を見つければ自分で使う（discord.py[speed] で入る）ので、
+# ここでは何もせず、使われているかどうかだけを確認する。
+ACCELERATED_RUNTIME = os.getenv("ACCELERATED_RUNTIME", "0") == "1"
+
+# 実際に使っている実装（/metrics で確認できるように）
+runtime_info = {"event_loop": "asyncio", "json": "orjson" if discord.utils.HAS_ORJSON else "json"}
+
+
+def install_event_loop():
+    """uvloop をイベントループのポリシーにする（client.run より前に呼ぶこと）"""
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("uvloop がインストールされていないため、標準の asyncio で動かします")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    runtime_info["event_loop"] = "uvloop"
+    return True
+
+
+def install():
+    """ACCELERATED_RUNTIME が有効なら uvloop を使うようにする"""
+    if not ACCELERATED_RUNTIME:
+        return runtime_info
+    install_event_loop()
+    if not discord.utils.HAS_ORJSON:
+        logging.warning("orjson がインストールされていないため、JSON は標準の json で読み書きします")
+    logging.info("高速ランタイム: event_loop=%s, json=%s", runtime_info["event_loop"], runtime_info["json"])
+    return runtime_info
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク・テスト用の Gateway のデータ（test_memory_profile.py / test_fast_runtime.py で共有）
+Discordには接続せず、Gatewayから届くのと同じ形のペイロードを作る。
+"""
+
+import asyncio
+
+GUILD_ID = 1300291307314610316
+CHANNEL_ID = 1399405974841852116
+CHUNK_SIZE = 1000  # GUILD_MEMBERS_CHUNK 1回あたりのメンバー数（Discordと同じ）
+
+
+def user_payload(user_id):
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0",
+            "global_name": f"ユーザー{user_id}", "avatar": None}
+
+
+def member_payload(user_id, with_user=True):
+    member = {"roles": [], "nick": None, "joined_at": "2024-01-01T00:00:00+00:00",
+              "deaf": False, "mute": False, "flags": 0}
+    if with_user:
+        member["user"] = user_payload(user_id)
+    return member
+
+
+def guild_payload(member_count, large=True):
+    """GUILD_CREATE のペイロード（チャンネル1つ・メンバーなし）"""
+    return {
+        "id": str(GUILD_ID), "name": "bench", "member_count": member_count, "large": large,
+        "roles": [{"id": str(GUILD_ID), "name": "@everyone", "permissions": "0", "position": 0,
+                   "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(CHANNEL_ID), "type": 0, "name": "general", "position": 0,
+                      "permission_overwrites": []}],
+        "emojis": [], "stickers": [], "members": [], "presences": [], "voice_states": [],
+    }
+
+
+class FakeGateway:
+    """メンバーの要求（REQUEST_GUILD_MEMBERS）に GUILD_MEMBERS_CHUNK で答える Gateway の代わり
+
+    ConnectionState._get_websocket をこれに差し替えると、discord.py の起動時のメンバー取得や
+    guild.query_members() がこちらに要求を送り、応答は parse_guild_members_chunk に渡される。
+    どのメンバーをキャッシュするかは discord.py 自身が決める。
+    """
+
+    def __init__(self, state, member_count):
+        self.state = state
+        self.member_count = member_count
+        self.requests = []
+        self._responses = []
+
+    def __call__(self, guild_id=None, *, shard_id=None):
+        return self
+
+    async def request_chunks(self, guild_id, query=None, *, limit, user_ids=None, presences=False, nonce=None):
+        self.requests.append({"query": query, "limit": limit, "nonce": nonce})
+        user_ids = [user_id for user_id in range(1, self.member_count + 1)
+                    if not query or f"user{user_id}".startswith(query)]
+        if limit:
+            user_ids = user_ids[:limit]
+        self._responses.append(asyncio.create_task(self._respond(guild_id, user_ids, nonce)))
+
+    async def _respond(self, guild_id, user_ids, nonce):
+        chunks = [user_ids[i:i + CHUNK_SIZE] for i in range(0, len(user_ids), CHUNK_SIZE)] or [[]]
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(0)
+            self.state.parse_guild_members_chunk({
+                "guild_id": str(guild_id), "members": [member_payload(user_id) for user_id in chunk],
+                "chunk_index": index, "chunk_count": len(chunks), "nonce": nonce,
+            })
+
+    async def drain(self):
+        """送った応答がすべて処理されるまで待つ"""
+        await asyncio.sleep(0)
+        while self._responses:
+            await self._responses.pop(0)
+        await asyncio.sleep(0)
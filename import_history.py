@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+過去データの一括取り込みツール（サーバー移行用）
+CSV（1行目がヘッダー）または JSONL から reports / users / introductions を読み込み、
+COPY で一時テーブルに流し込んでから1回の UPSERT で反映する（Postgres 専用。STORAGE_BACKEND=sqlite では使えない）
+
+使い方:
+    python import_history.py reports reports.csv
+    python import_history.py users bump_counts.jsonl --batch-size 20000
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import sys
+import time
+
+from dotenv import load_dotenv
+import database as db
+
+# 列ごとの型変換（ここにない列は文字列のまま）
+INT_COLUMNS = {'report_id', 'guild_id', 'target_user_id', 'message_id', 'channel_id', 'user_id', 'bump_count'}
+TIMESTAMP_COLUMNS = {'created_at'}
+
+
+def convert(column, value):
+    if value is None or value == '':
+        return None
+    if column in INT_COLUMNS:
+        return int(value)
+    if column in TIMESTAMP_COLUMNS:
+        parsed = datetime.datetime.fromisoformat(str(value))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed
+    return str(value)
+
+
+def read_rows(path):
+    """ファイルを1行ずつ辞書として読む"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.jsonl') or path.endswith('.ndjson'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+async def read_batches(path, columns, batch_size):
+    """COPY に渡せる形（列順のタプル）にしてバッチごとに返す"""
+    batch = []
+    for row in read_rows(path):
+        batch.append(tuple(convert(column, row.get(column)) for column in columns))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+            await asyncio.sleep(0)
+    if batch:
+        yield batch
+
+
+async def import_history(kind, path, batch_size):
+    # 取り込み先のテーブルが無ければ作る
+    if kind == 'users':
+        await db.init_db()
+    elif kind == 'introductions':
+        await db.init_intro_bot_db()
+    else:
+        await db.init_shugoshin_db()
+
+    columns = db.IMPORT_SPECS[kind]['columns']
+    started = time.perf_counter()
+    loaded, merged = await db.bulk_import(kind, read_batches(path, columns, batch_size))
+    elapsed = time.perf_counter() - started
+    rate = loaded / elapsed if elapsed > 0 else 0
+    print(f"✅ {kind}: {loaded} 行を読み込み、{merged} 行を反映しました（{elapsed:.2f}秒, {rate:,.0f} 行/秒）")
+    if loaded > merged:
+        print(f"⚠️  {loaded - merged} 行は反映されていません: {db.IMPORT_SPECS[kind]['skipped']}")
+    return loaded, merged
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="過去データを一括で取り込みます")
+    parser.add_argument('kind', choices=sorted(db.IMPORT_SPECS), help="取り込み先")
+    parser.add_argument('path', help="CSV（ヘッダー付き）または JSONL ファイル")
+    parser.add_argument('--batch-size', type=int, default=10000, help="COPY 1回あたりの行数")
+    args = parser.parse_args()
+
+    load_dotenv()
+    try:
+        await import_history(args.kind, args.path, args.batch_size)
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        print(f"❌ 取り込みに失敗しました: {e}")
+        sys.exit(1)
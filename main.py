@@ -1,87 +1,335 @@
-import discord
-from discord import app_commands, ui
+import startup_profile
+with startup_profile.timed_import("discord"):
+    import discord
+    from discord import app_commands, ui
 import os
+import asyncio
+import hashlib
+import json
 import threading
 import logging
 import datetime
-from dotenv import load_dotenv
-from flask import Flask
-import database as db
+import time
+from collections import OrderedDict, deque
+with startup_profile.timed_import("dotenv"):
+    from dotenv import load_dotenv
+import memory_profile
+import fast_runtime
+with startup_profile.timed_import("database"):
+    import storage
+    db = storage.load_backend()  # STORAGE_BACKEND で Postgres / SQLite を切り替える
+import report_export
+import structured_logging
+from admission import AdmissionController, admission_controlled
+from send_queue import SendQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from report_spool import ReportSpool
 
 # --- 初期設定 ---
 load_dotenv()  # 環境変数（.env）からSupabaseデータベース接続情報を読み込み
-logging.basicConfig(level=logging.INFO)
+structured_logging.setup_logging()  # ログはキュー経由でバックグラウンドのスレッドから出力する
 
 # --- 定数 ---
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 COOLDOWN_MINUTES = 5 # クールダウン時間（分）
-REPORT_BUTTON_CHANNEL_ID = 1399405974841852116  # ボタン式報告専用チャンネルID（変更したい場合はここを修正）
+DAILY_REPORT_LIMIT = 10 # 1人あたりの1日の報告数上限（日本時間の0時にリセット、0で無制限）
+# 以下の4つは guild_settings に値がないときの既定値（/setup でサーバーごとに上書きできる）
+# チャンネルは guild.get_channel で引くため、別サーバーのチャンネルが使われることはない
+REPORT_BUTTON_CHANNEL_ID = 1399405974841852116  # ボタン式報告専用チャンネルID
 WARNING_CHANNEL_ID = 1399405974841852116  # 警告発行時の報告先チャンネルID
 ADMIN_ONLY_CHANNEL_ID = 1388167902808637580  # 管理者のみ報告時のチャンネルID
 RULE_ANNOUNCEMENT_LINK = "https://discord.com/channels/1300291307314610316/1377465336076566578"  # ルールアナウンスチャンネルのリンク
+BUTTON_SETUP_CONCURRENCY = 5  # 起動時に同時に報告ボタンを確認するサーバー数
+COMMAND_TREE_HASH_FILE = os.getenv("COMMAND_TREE_HASH_FILE", ".command_tree_hash")  # 前回同期したコマンド定義のハッシュ保存先
+
+# 報告フローの流入制御（1秒あたりの受付数・バースト・同時処理数の上限）
+ADMISSION_GLOBAL_RATE = 20
+ADMISSION_GLOBAL_BURST = 40
+ADMISSION_GUILD_RATE = 5
+ADMISSION_GUILD_BURST = 10
+ADMISSION_MAX_IN_FLIGHT = 50
+
+# シャード設定（SHARD_COUNT を指定すると AutoShardedClient で起動する）
+# SHARD_IDS はこのプロセスが担当するシャード番号のカンマ区切り（省略時は全シャード）
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+if SHARD_IDS and not SHARD_COUNT:
+    # シャード数がないと全サーバーを1つの接続で受け持つうえ、シャード0を持たないプロセスはコマンドを同期しない
+    raise ValueError("SHARD_IDS を指定する場合は SHARD_COUNT も指定してください")
 
 # --- Discord Botの準備 ---
 intents = discord.Intents.default()
 intents.members = True  # サーバーメンバー情報の取得に必要
 intents.guilds = True   # ギルド情報の取得に必要
-client = discord.Client(intents=intents)
-tree = app_commands.CommandTree(client)
+# メッセージ・メンバーのキャッシュと起動時のメンバー取得は MEMORY_PROFILE で切り替える
+client_options = memory_profile.client_options(intents)
+if SHARD_COUNT:
+    client = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **client_options)
+else:
+    client = discord.Client(intents=intents, **client_options)
+
+class ShugoshinCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # コマンド処理中のログにインタラクションIDを付ける
+        structured_logging.bind_interaction(interaction)
+        return True
+
+tree = ShugoshinCommandTree(client)
+admission_controller = AdmissionController(
+    ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST, ADMISSION_GUILD_RATE, ADMISSION_GUILD_BURST, ADMISSION_MAX_IN_FLIGHT
+)
+send_queue = SendQueue()  # チャンネルごとにレート制限の手前で送信を調整する
+report_spool = ReportSpool()  # DBに繋がらない間に受け付けた報告を一時保存する
+spool_replay_task = None  # setup_hook で起動するスプール再送タスク
+startup_task = None  # setup_hook で起動する初期化タスク
+leader_task = None   # setup_hook で起動するリーダー選出タスク
+db_ready_event = asyncio.Event()  # DBのテーブル作成が終わったら set される
 
 # --- スリープ対策Webサーバー ---
-app = Flask(__name__)
-@app.route('/')
-def home(): return "Shugoshin Bot is watching over you."
-@app.route('/health')
-def health_check(): return "OK"
+# Flask はWebサーバー用スレッドの中で初めてインポートする（Botの起動を遅らせないため）
+def create_app():
+    with startup_profile.timed_import("flask"):
+        from flask import Flask
+    app = Flask(__name__)
+    @app.route('/')
+    def home(): return "Shugoshin Bot is watching over you."
+    @app.route('/health')
+    def health_check(): return "OK"
+    @app.route('/metrics')
+    def metrics(): return {
+        "admission": admission_controller.metrics(),
+        "send_queue": send_queue.metrics(),
+        "database": {"breaker_open": db.breaker.is_open},
+        "runtime": fast_runtime.runtime_info,
+        "report_submit": submit_latency_metrics(),
+    }
+    @app.route('/debug/memory')
+    def debug_memory():
+        # キャッシュはイベントループのスレッドで読む（Webサーバーのスレッドから直接触らない）
+        async def snapshot():
+            return memory_profile.memory_snapshot(client)
+        return asyncio.run_coroutine_threadsafe(snapshot(), client.loop).result(timeout=5)
+    return app
+
+def __getattr__(name):
+    # `gunicorn main:app` など、従来どおり main.app を参照する場合のための互換用
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def run_flask():
     port = int(os.getenv("PORT", 8080))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 
 # --- Botのイベント ---
 @client.event
-async def on_ready():
-    # Supabaseローカル環境で守護神ボット用テーブルを初期化
-    await db.init_shugoshin_db()
-    
+async def setup_hook():
+    """起動時に1回だけ実行される初期化処理（再接続時の on_ready では再実行されない）"""
     # 永続ビューを追加（ボット再起動後もボタンが動作するように）
     client.add_view(ReportStartView())
-    
-    await tree.sync()
+    # 報告ウィザードの各ステップも永続ビューとして1つずつ登録し、途中経過はDBから読み直す
+    for view_cls in REPORT_WIZARD_VIEWS:
+        client.add_view(view_cls())
+
+    # コマンド定義が変わったときだけ tree.sync() を実行（グローバル同期のレート制限対策）
+    # グローバルコマンドは全シャード共通なので、シャード0を担当するプロセスだけが同期する
+    if owns_shard(0):
+        await sync_command_tree_if_changed()
+
+    # DB初期化とリーダー選出（報告ボタンの確認はリーダーだけが行う）を並行して実行
+    # タスクの参照を保持してGCを防ぐ
+    global startup_task, leader_task, spool_replay_task
+    startup_task = asyncio.create_task(run_startup_tasks())
+    leader_task = asyncio.create_task(leader_election.run())
+    # スプールはプロセスごとのファイルなので、リーダーに関係なく各プロセスが再送する
+    spool_replay_task = asyncio.create_task(run_spool_replay())
+
+@client.event
+async def on_ready():
+    startup_profile.mark("gateway_ready")
     logging.info(f"✅ 守護神ボットが起動しました: {client.user}")
-    
-    # 報告用ボタンをチャンネルに送信
+
+STARTUP_RETRY_MAX_SECONDS = 300  # DB初期化を再試行する間隔の上限（秒）
+
+async def run_startup_tasks():
+    """DB初期化（全レプリカで実行）
+
+    失敗しても成功するまで間隔を延ばしながら再試行する（db_ready_event が set されないと、
+    報告ボタンの確認・再設置がこのプロセスでは二度と行われないため）。
+    """
+    delay = 5
+    while True:
+        try:
+            await db.init_shugoshin_db()
+            db_ready_event.set()
+            startup_profile.mark("db_ready")
+            return
+        except Exception as e:
+            logging.error(f"起動処理でエラー（{delay}秒後に再試行します）: {e}", exc_info=True)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+
+MAINTENANCE_INTERVAL_SECONDS = 6 * 60 * 60  # 定期メンテナンスの間隔（秒）
+
+async def run_singleton_tasks():
+    """リーダーに選ばれたレプリカだけが実行するバックグラウンド処理"""
+    await asyncio.gather(client.wait_until_ready(), db_ready_event.wait())
     await setup_report_button()
+    startup_profile.mark("button_verified")
+
+    # 定期メンテナンス（リーダーでなくなるとキャンセルされる）
+    while True:
+        try:
+            await db.prune_report_daily_counts()
+            await db.prune_report_drafts()
+        except Exception as e:
+            logging.error(f"定期メンテナンスでエラー: {e}", exc_info=True)
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+# 同じシャードを担当するレプリカ同士でリーダーを1つ選ぶ
+# （シャードが違えば担当サーバーも違うので、それぞれにリーダーが必要）
+leader_election = db.LeaderElection(
+    f"shugoshin:singleton:{SHARD_COUNT or 1}:{','.join(map(str, SHARD_IDS or []))}",
+    on_elected=run_singleton_tasks,
+    # リーダー以外は報告ボタンを確認しないので、選出の結果が出た時点で起動プロファイルを書き出せるようにする
+    on_follower=lambda: startup_profile.mark("follower_settled")
+)
+
+def owns_shard(shard_id):
+    """このプロセスが指定したシャードを担当しているか"""
+    return SHARD_IDS is None or shard_id in SHARD_IDS
+
+def compute_command_tree_hash():
+    """現在のコマンド定義からハッシュ値を計算する"""
+    payload = [command.to_dict() for command in tree.get_commands()]
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+async def sync_command_tree_if_changed():
+    """前回同期したハッシュと異なる場合のみコマンドツリーを同期する"""
+    current_hash = f"{client.application_id}:{compute_command_tree_hash()}"
+    try:
+        with open(COMMAND_TREE_HASH_FILE, encoding="utf-8") as f:
+            cached_hash = f.read().strip()
+    except OSError:
+        cached_hash = None
+
+    if cached_hash == current_hash:
+        logging.info("コマンド定義に変更がないため tree.sync() をスキップしました")
+        return
+
+    try:
+        await tree.sync()
+    except discord.HTTPException as e:
+        logging.error(f"コマンドツリーの同期に失敗: {e}")
+        return
+    logging.info("コマンドツリーを同期しました")
+    try:
+        with open(COMMAND_TREE_HASH_FILE, "w", encoding="utf-8") as f:
+            f.write(current_hash)
+    except OSError as e:
+        logging.warning(f"コマンドツリーのハッシュを保存できませんでした: {e}")
+
+def urgency_priority(urgency):
+    """緊急度「高」の報告は送信キューで先に送る"""
+    return PRIORITY_HIGH if urgency == "高" else PRIORITY_NORMAL
+
+class GuildReportConfig:
+    """サーバーごとの報告フロー設定"""
+    def __init__(self, settings):
+        def pick(column, default):
+            value = settings.get(column) if settings else None
+            return value if value else default
+        self.report_button_channel_id = pick('report_button_channel_id', REPORT_BUTTON_CHANNEL_ID)
+        self.warning_channel_id = pick('warning_channel_id', WARNING_CHANNEL_ID)
+        self.admin_only_channel_id = pick('admin_only_channel_id', ADMIN_ONLY_CHANNEL_ID)
+        self.rule_announcement_link = pick('rule_announcement_link', RULE_ANNOUNCEMENT_LINK)
+
+async def get_report_config(guild_id):
+    """サーバー設定（キャッシュ済み）から報告フロー設定を組み立てる"""
+    try:
+        return GuildReportConfig(await db.get_guild_settings(guild_id))
+    except db.DatabaseUnavailable:
+        # 一度も読めていないサーバーは既定値で続ける（DB障害中でも報告を受け付けるため）
+        return GuildReportConfig(None)
+
+async def check_report_limits(user_id):
+    """クールダウンと1日の上限を確認する（DBに繋がらない間はスプールの記録で判断する）"""
+    try:
+        return await db.check_report_limits(user_id, COOLDOWN_MINUTES * 60, DAILY_REPORT_LIMIT)
+    except db.DatabaseUnavailable:
+        today = datetime.datetime.now(db.JST).replace(hour=0, minute=0, second=0, microsecond=0)
+        return await report_spool.check_report_limits(
+            user_id, COOLDOWN_MINUTES * 60, DAILY_REPORT_LIMIT, today.timestamp()
+        )
 
 async def setup_report_button():
-    """報告用ボタンを特定のチャンネルに設置する"""
+    """参加している全サーバーで報告用ボタンの設置を確認する"""
+    guilds = list(client.guilds)
     try:
-        channel = client.get_channel(REPORT_BUTTON_CHANNEL_ID)
+        # 設定を1回のクエリでまとめて読み込み、以降はキャッシュから参照する
+        await db.prefetch_guild_settings(guild.id for guild in guilds)
+    except Exception as e:
+        logging.error(f"サーバー設定の一括取得に失敗: {e}", exc_info=True)
+
+    semaphore = asyncio.Semaphore(BUTTON_SETUP_CONCURRENCY)
+    async def _setup(guild):
+        async with semaphore:
+            await setup_report_button_for_guild(guild)
+    await asyncio.gather(*(_setup(guild) for guild in guilds))
+
+async def find_report_button_message(channel, message_id=None, history_limit=50):
+    """既存の報告ボタンメッセージを探す（保存済みのIDがあれば履歴を読まずに直接取得）"""
+    if message_id:
+        try:
+            return await channel.fetch_message(message_id)
+        except discord.NotFound:
+            pass
+    async for message in channel.history(limit=history_limit):
+        if message.author == client.user and message.embeds:
+            embed = message.embeds[0]
+            if embed.title and "報告システム" in embed.title:
+                return message
+    return None
+
+async def setup_report_button_for_guild(guild):
+    """報告用ボタンをサーバーの報告ボタン用チャンネルに設置する"""
+    try:
+        config = await get_report_config(guild.id)
+        channel = guild.get_channel(config.report_button_channel_id)
         if not channel:
-            logging.error(f"チャンネルID {REPORT_BUTTON_CHANNEL_ID} が見つかりません")
+            logging.debug("サーバー %s には報告ボタン用チャンネル %s がありません", guild.id, config.report_button_channel_id)
             return
             
-        logging.info(f"チャンネル '{channel.name}' (ID: {channel.id}) への報告ボタン設置を試行中...")
+        logging.info("チャンネル '%s' (ID: %s) への報告ボタン設置を試行中...", channel.name, channel.id)
         
         # ボットの権限チェック
-        permissions = channel.permissions_for(channel.guild.me)
+        permissions = channel.permissions_for(guild.me)
         if not permissions.send_messages:
             logging.error(f"チャンネル '{channel.name}' にメッセージ送信権限がありません")
             return
-            
-        # 既存のボタンメッセージを探す（新しいメッセージを無限に作らないように）
-        async for message in channel.history(limit=50):
-            if message.author == client.user and message.embeds:
-                embed = message.embeds[0]
-                if embed.title and "報告システム" in embed.title:
-                    # 既存の報告ボタンメッセージがあるので、新しく作らない
-                    logging.info(f"既存の報告ボタンが見つかりました (メッセージID: {message.id})")
-                    return
-        
-        # 新しい報告ボタンメッセージを作成
-        await create_new_report_button(channel)
+
+        # 他のプロセスが同じサーバーのボタンを作業中なら何もしない（二重送信防止）
+        claim = await db.claim_report_button(guild.id)
+        if claim is None:
+            logging.info("サーバー %s の報告ボタンは別のプロセスが処理中のためスキップします", guild.id)
+            return
+
+        message = None
+        try:
+            # 既存のボタンメッセージを探す（新しいメッセージを無限に作らないように）
+            stored_id = claim['message_id'] if claim['channel_id'] == channel.id else None
+            message = await find_report_button_message(channel, stored_id)
+            if message:
+                # 既存の報告ボタンメッセージがあるので、新しく作らない
+                logging.info("既存の報告ボタンが見つかりました (メッセージID: %s)", message.id)
+            else:
+                # 新しい報告ボタンメッセージを作成
+                message = await create_new_report_button(channel)
+        finally:
+            await db.release_report_button(guild.id, channel.id if message else None, message.id if message else None)
         
     except discord.Forbidden:
-        logging.error(f"チャンネルID {REPORT_BUTTON_CHANNEL_ID} にメッセージを送信する権限がありません")
+        logging.error(f"サーバー {guild.id} の報告ボタン用チャンネルにメッセージを送信する権限がありません")
     except Exception as e:
         logging.error(f"報告ボタンの設置に失敗: {e}", exc_info=True)
 
@@ -100,37 +348,121 @@ async def create_new_report_button(channel):
     embed.set_footer(text="報告は完全に匿名で処理されます")
     
     view = ReportStartView()
-    sent_message = await channel.send(embed=embed, view=view)
-    logging.info(f"報告用ボタンを設置しました (メッセージID: {sent_message.id})")
+    sent_message = await send_queue.send(channel, embed=embed, view=view, priority=PRIORITY_LOW)
+    logging.info("報告用ボタンを設置しました (メッセージID: %s)", sent_message.id)
     return sent_message
 
-async def refresh_report_button():
+async def refresh_report_button(guild):
     """報告ボタンを最新位置に移動する（古いボタンを削除して新しいボタンを作成）"""
     try:
-        channel = client.get_channel(REPORT_BUTTON_CHANNEL_ID)
+        config = await get_report_config(guild.id)
+        channel = guild.get_channel(config.report_button_channel_id)
         if not channel:
             return
-            
-        # 古いボタンメッセージを削除
-        async for message in channel.history(limit=100):
-            if message.author == client.user and message.embeds:
-                embed = message.embeds[0]
-                if embed.title and "報告システム" in embed.title:
-                    try:
-                        await message.delete()
-                        logging.info(f"古い報告ボタンを削除しました (ID: {message.id})")
-                    except discord.NotFound:
-                        pass  # 既に削除されている場合
-                    except discord.Forbidden:
-                        logging.error("報告ボタンの削除権限がありません")
-                    break
-        
-        # 新しいボタンメッセージを作成
-        await create_new_report_button(channel)
+
+        # 別のプロセスが移動中なら任せる（ボタンが2つできないように）
+        claim = await db.claim_report_button(guild.id)
+        if claim is None:
+            return
+
+        new_message = None
+        try:
+            # 古いボタンメッセージを削除
+            stored_id = claim['message_id'] if claim['channel_id'] == channel.id else None
+            old_message = await find_report_button_message(channel, stored_id, history_limit=100)
+            if old_message:
+                try:
+                    await send_queue.delete(old_message)
+                    logging.info("古い報告ボタンを削除しました (ID: %s)", old_message.id, extra={"sampled": True})
+                except discord.NotFound:
+                    pass  # 既に削除されている場合
+                except discord.Forbidden:
+                    logging.error("報告ボタンの削除権限がありません")
+
+            # 新しいボタンメッセージを作成
+            new_message = await create_new_report_button(channel)
+        finally:
+            await db.release_report_button(guild.id, channel.id if new_message else None, new_message.id if new_message else None)
         
     except Exception as e:
         logging.error(f"報告ボタンの更新に失敗: {e}", exc_info=True)
 
+# --- ユーザー情報の解決（キャッシュ付き） ---
+# サーバーのメンバーキャッシュ → discord.py のユーザーキャッシュ → 取得済みユーザーのLRUキャッシュ
+# の順に探し、どこにもないときだけ fetch_user（REST API）を呼ぶ
+USER_CACHE_SIZE = 1000          # 取得済みユーザーを保持する最大件数
+USER_CACHE_TTL_SECONDS = 600    # 取得済みユーザーを保持する時間（秒）
+USER_FETCH_CONCURRENCY = 5      # まとめて解決するときに同時に呼ぶ fetch_user の数
+_user_cache = OrderedDict()     # user_id -> (有効期限, User)
+_user_fetches = {}              # user_id -> 取得中の Task（同じユーザーの同時取得をまとめる）
+
+async def resolve_user(user_id, guild=None):
+    """ユーザーIDから User/Member を取得する（見つからない場合は discord.NotFound）"""
+    member = guild.get_member(user_id) if guild else None
+    if member:
+        return member
+    user = client.get_user(user_id)
+    if user:
+        return user
+
+    cached = _user_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        _user_cache.move_to_end(user_id)
+        return cached[1]
+
+    task = _user_fetches.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(client.fetch_user(user_id))
+        _user_fetches[user_id] = task
+        task.add_done_callback(lambda _: _user_fetches.pop(user_id, None))
+    user = await asyncio.shield(task)
+
+    _user_cache[user_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+    _user_cache.move_to_end(user_id)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+    return user
+
+MEMBER_QUERY_LIMIT = 100  # メンバーキャッシュが揃っていないときに Gateway で名前検索する最大件数（Discordの上限）
+
+async def search_member_candidates(guild, search_term):
+    """名前検索の候補となるメンバー
+
+    起動時にメンバーを取得していない（MEMORY_PROFILE が balanced / lean の）ときは、
+    Gateway の前方一致検索の結果をキャッシュに入れずに使う。
+    """
+    if guild.chunked:
+        return guild.members
+    try:
+        queried = await guild.query_members(query=search_term, limit=MEMBER_QUERY_LIMIT, cache=False)
+    except asyncio.TimeoutError:
+        logging.warning("メンバー検索がタイムアウトしました: guild=%s", guild.id)
+        queried = []
+    members = {member.id: member for member in guild.members}
+    members.update((member.id, member) for member in queried)
+    return list(members.values())
+
+async def resolve_member(guild, user_id):
+    """サーバーのメンバーを取得する（メンバーでなければ None）"""
+    member = guild.get_member(user_id)
+    if member or guild.chunked:
+        return member
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+
+async def resolve_users(user_ids, guild=None):
+    """複数のユーザーIDをまとめて解決する（見つからないユーザーは None）"""
+    semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
+    async def _resolve(user_id):
+        async with semaphore:
+            try:
+                return user_id, await resolve_user(user_id, guild)
+            except discord.NotFound:
+                return user_id, None
+    return dict(await asyncio.gather(*(_resolve(user_id) for user_id in set(user_ids))))
+
 # --- 確認ボタン付きView ---
 class ConfirmWarningView(ui.View):
     def __init__(self, *, interaction: discord.Interaction):
@@ -166,14 +498,25 @@ class ReportStartView(ui.View):
     def __init__(self):
         super().__init__(timeout=None)  # 永続化
 
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        structured_logging.bind_interaction(interaction)
+        return True
+
     @ui.button(label="📝 報告を開始する", style=discord.ButtonStyle.primary, emoji="🛡️", custom_id="report_start_button")
+    @admission_controlled(admission_controller)
     async def start_report(self, interaction: discord.Interaction, button: ui.Button):
         # 最初に即座に応答して、その後でクールダウンチェックを行う
         await interaction.response.defer(ephemeral=True)
         
         try:
-            # クールダウンチェック
-            remaining_time = await db.check_cooldown(interaction.user.id, COOLDOWN_MINUTES * 60)
+            # クールダウンと1日の上限をまとめてチェック
+            remaining_time, quota_exceeded = await check_report_limits(interaction.user.id)
+            if quota_exceeded:
+                await interaction.followup.send(
+                    f"📅 今日の報告は上限（{DAILY_REPORT_LIMIT}件）に達しました。明日また報告してください。",
+                    ephemeral=True
+                )
+                return
             if remaining_time > 0:
                 await interaction.followup.send(
                     f"⏰ クールダウン中です。あと `{int(remaining_time // 60)}分 {int(remaining_time % 60)}秒` 待ってください。", 
@@ -181,9 +524,10 @@ class ReportStartView(ui.View):
                 )
                 return
             
-            # 報告データを初期化
-            report_data = ReportData()
-            view = TargetUserSelectView(report_data)
+            # 報告データを初期化（同じサーバーで入力途中のものがあれば最初からやり直す）
+            report_data = ReportData(interaction.guild_id, interaction.user.id)
+            await report_data.save()
+            view = TargetUserSelectView.for_message()
             
             embed = discord.Embed(
                 title="👤 報告対象者の選択",
@@ -195,7 +539,7 @@ class ReportStartView(ui.View):
                 value="セレクトメニューに目的のユーザーが表示されない場合は、「🔍 ユーザーを検索」ボタンをご利用ください。",
                 inline=False
             )
-            embed.set_footer(text="ステップ 1/5 | 5分でタイムアウトします")
+            embed.set_footer(text=f"ステップ 1/5 | {db.REPORT_DRAFT_TTL_SECONDS // 60}分間操作がないと入力内容は破棄されます")
             
             await interaction.followup.send(embed=embed, view=view, ephemeral=True)
             
@@ -204,34 +548,101 @@ class ReportStartView(ui.View):
             await interaction.followup.send("❌ 報告システムでエラーが発生しました。しばらく待ってから再試行してください。", ephemeral=True)
 
 class ReportData:
-    """報告データを保持するクラス"""
+    """報告データ（ウィザードの途中経過）を保持するクラス
+
+    Viewには持たせず、(サーバーID, ユーザーID) ごとに report_drafts へ保存しておき、
+    操作のたびに load_report_draft() で読み直す（再起動をまたいでも入力を続けられる）。
+    """
+    __slots__ = ("guild_id", "user_id", "target_user_id", "violated_rule", "urgency",
+                 "issue_warning", "details", "message_link")
+
+    def __init__(self, guild_id, user_id, target_user_id=None, violated_rule=None, urgency=None,
+                 issue_warning=False, details=None, message_link=None):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.target_user_id = target_user_id
+        self.violated_rule = violated_rule
+        self.urgency = urgency
+        self.issue_warning = issue_warning
+        self.details = details
+        self.message_link = message_link
+
+    @property
+    def target_mention(self):
+        return f"<@{self.target_user_id}>"
+
+    async def save(self):
+        await db.save_report_draft(
+            self.guild_id, self.user_id, **{field: getattr(self, field) for field in db.REPORT_DRAFT_FIELDS}
+        )
+
+    async def discard(self):
+        await db.delete_report_draft(self.guild_id, self.user_id)
+
+async def load_report_draft(interaction: discord.Interaction):
+    """操作したユーザーの途中経過を読み直す（期限切れの場合はその旨を返信して None を返す）"""
+    values = await db.get_report_draft(interaction.guild_id, interaction.user.id)
+    if values is not None:
+        return ReportData(interaction.guild_id, interaction.user.id, **values)
+    message = "⌛ 報告の入力期限が切れました。もう一度「📝 報告を開始する」ボタンから報告してください。"
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.edit_message(content=message, embed=None, view=None)
+    return None
+
+class ReportWizardView(ui.View):
+    """報告ウィザードの各ステップのViewの共通部分
+
+    途中経過は ReportData として保存しているので、View自体は状態を持たない。
+    setup_hook で各クラスを1つずつ永続ビューとして登録し、操作はそれが受け取る。
+    """
     def __init__(self):
-        self.target_user = None
-        self.violated_rule = None
-        self.urgency = None
-        self.issue_warning = False
-        self.details = None
-        self.message_link = None
-
-class TargetUserSelectView(ui.View):
-    """対象ユーザー選択用のView"""
-    def __init__(self, report_data: ReportData):
-        super().__init__(timeout=300)  # 5分に延長
-        self.report_data = report_data
+        super().__init__(timeout=None)
+        memory_profile.track_view(self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        structured_logging.bind_interaction(interaction)
+        return True
+
+    @classmethod
+    def for_message(cls):
+        """メッセージに付ける表示用のView（ビューストアに溜まらないよう、停止した状態で返す）"""
+        view = cls()
+        view.stop()
+        return view
 
+    async def cancel(self, interaction: discord.Interaction):
+        """報告をキャンセルする"""
+        embed = discord.Embed(
+            title="❌ 報告をキャンセルしました",
+            description="報告はキャンセルされました。",
+            color=discord.Color.red()
+        )
+        await interaction.response.edit_message(embed=embed, view=None)
+        drop_prefetched_report(interaction.guild_id, interaction.user.id)
+        await db.delete_report_draft(interaction.guild_id, interaction.user.id)
+
+class TargetUserSelectView(ReportWizardView):
+    """対象ユーザー選択用のView"""
     @ui.select(
         cls=ui.UserSelect,
         placeholder="報告対象のユーザーを選択してください",
         min_values=1,
-        max_values=1
+        max_values=1,
+        custom_id="report_wizard:target_user"
     )
     async def select_user(self, interaction: discord.Interaction, select: ui.UserSelect):
         """ユーザー選択時の処理"""
+        report_data = await load_report_draft(interaction)
+        if report_data is None:
+            return
         selected_user = select.values[0]
-        self.report_data.target_user = selected_user
+        report_data.target_user_id = selected_user.id
+        await report_data.save()
         
         # 次のステップへ
-        view = RuleSelectView(self.report_data)
+        view = RuleSelectView.for_message()
         embed = discord.Embed(
             title="📜 違反ルールの選択",
             description=f"**報告対象者:** {selected_user.mention}\n\n違反したルールを選択してください:",
@@ -241,17 +652,20 @@ class TargetUserSelectView(ui.View):
         
         await interaction.response.edit_message(embed=embed, view=view)
 
-    @ui.button(label="🔍 ユーザーを検索", style=discord.ButtonStyle.secondary)
+    @ui.button(label="🔍 ユーザーを検索", style=discord.ButtonStyle.secondary, custom_id="report_wizard:target_search")
     async def input_user_manually(self, interaction: discord.Interaction, button: ui.Button):
-        """手動でユーザーIDやメンションを入力する場合"""
-        modal = UserInputModal(self.report_data)
+        """手動でユーザーIDやメンションを入力する場合（途中経過は送信時に読み直す）"""
+        modal = UserInputModal()
         await interaction.response.send_modal(modal)
 
 class UserInputModal(ui.Modal):
     """ユーザー入力用のモーダル"""
-    def __init__(self, report_data: ReportData):
+    def __init__(self):
         super().__init__(title="ユーザー検索")
-        self.report_data = report_data
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        structured_logging.bind_interaction(interaction)
+        return True
 
     user_input = ui.TextInput(
         label="報告対象者",
@@ -275,7 +689,7 @@ class UserInputModal(ui.Modal):
                     user_id_str = user_id_str[1:]
                 try:
                     user_id = int(user_id_str)
-                    target_user = await interaction.client.fetch_user(user_id)
+                    target_user = await resolve_user(user_id, interaction.guild)
                 except (ValueError, discord.NotFound):
                     pass
             
@@ -283,7 +697,7 @@ class UserInputModal(ui.Modal):
             elif user_input_text.isdigit():
                 try:
                     user_id = int(user_input_text)
-                    target_user = await interaction.client.fetch_user(user_id)
+                    target_user = await resolve_user(user_id, interaction.guild)
                 except discord.NotFound:
                     pass
             
@@ -299,7 +713,8 @@ class UserInputModal(ui.Modal):
                 partial_matches = []    # 部分一致
                 
                 # サーバーメンバーから検索
-                for member in guild.members:
+                members = await search_member_candidates(guild, search_term)
+                for member in members:
                     # ボット除外
                     if member.bot:
                         continue
@@ -335,13 +750,21 @@ class UserInputModal(ui.Modal):
                     target_user = partial_matches[0]
                 
                 # デバッグ情報をログに出力
-                logging.info(f"ユーザー検索: '{user_input_text}' -> 完全一致:{len(exact_matches)}件, 前方一致:{len(startswith_matches)}件, 部分一致:{len(partial_matches)}件")
+                logging.info(
+                    "ユーザー検索: '%s' -> 完全一致:%d件, 前方一致:%d件, 部分一致:%d件",
+                    user_input_text, len(exact_matches), len(startswith_matches), len(partial_matches),
+                    extra={"sampled": True}
+                )
             
             if target_user:
-                self.report_data.target_user = target_user
+                report_data = await load_report_draft(interaction)
+                if report_data is None:
+                    return
+                report_data.target_user_id = target_user.id
+                await report_data.save()
                 
                 # 次のステップへ
-                view = RuleSelectView(self.report_data)
+                view = RuleSelectView.for_message()
                 embed = discord.Embed(
                     title="📜 違反ルールの選択",
                     description=f"**報告対象者:** {target_user.mention}\n\n違反したルールを選択してください:",
@@ -354,7 +777,7 @@ class UserInputModal(ui.Modal):
                 # 検索に失敗した場合の詳細診断情報
                 guild = interaction.guild
                 member_count = guild.member_count  # Discord公式メンバー数
-                member_list = [member for member in guild.members]  # 実際に取得できたメンバー
+                member_list = members  # 実際に取得できたメンバー（キャッシュしていないときは検索結果）
                 member_list_count = len(member_list)
                 
                 # Intent設定の確認
@@ -401,8 +824,10 @@ class UserInputModal(ui.Modal):
                 error_message += f"• 実際に取得できた数: {member_list_count}人\n"
                 error_message += f"• Intent設定: {intents_status}\n\n"
                 
-                # メンバー数が異常に少ない場合の警告
-                if member_list_count == 1:
+                # メンバー数が異常に少ない場合の警告（メンバーをキャッシュしない設定では検索結果の件数なので判定しない）
+                if not client_options["chunk_guilds_at_startup"] and client.intents.members:
+                    error_message += "ℹ️ メンバーはキャッシュせず、名前の前方一致でDiscordに問い合わせて検索しています。\n\n"
+                elif member_list_count == 1:
                     error_message += "⚠️ **メンバー情報取得エラー**\n"
                     error_message += "Discord Developer Portalで以下を確認してください：\n"
                     error_message += "1. SERVER MEMBERS INTENTが有効か\n"
@@ -428,14 +853,11 @@ class UserInputModal(ui.Modal):
             logging.error(f"ユーザー検索エラー: {e}", exc_info=True)
             await interaction.followup.send(f"❌ ユーザー検索中にエラーが発生しました: {e}", ephemeral=True)
 
-class RuleSelectView(ui.View):
+class RuleSelectView(ReportWizardView):
     """ルール選択用のView"""
-    def __init__(self, report_data: ReportData):
-        super().__init__(timeout=300)  # 5分に延長
-        self.report_data = report_data
-
     @ui.select(
         placeholder="違反したルールを選択してください",
+        custom_id="report_wizard:rule",
         options=[
             discord.SelectOption(
                 label="そのいち：ひとのいやがること・傷つくことはしない",
@@ -464,37 +886,32 @@ class RuleSelectView(ui.View):
         ]
     )
     async def rule_select(self, interaction: discord.Interaction, select: ui.Select):
-        self.report_data.violated_rule = select.values[0]
+        report_data = await load_report_draft(interaction)
+        if report_data is None:
+            return
+        report_data.violated_rule = select.values[0]
+        await report_data.save()
         
         # 次のステップへ
-        view = UrgencySelectView(self.report_data)
+        view = UrgencySelectView.for_message()
         embed = discord.Embed(
             title="🔥 緊急度の選択",
-            description=f"**報告対象者:** {self.report_data.target_user.mention}\n**違反ルール:** {self.report_data.violated_rule}\n\n緊急度を選択してください:",
+            description=f"**報告対象者:** {report_data.target_mention}\n**違反ルール:** {report_data.violated_rule}\n\n緊急度を選択してください:",
             color=discord.Color.orange()
         )
         embed.set_footer(text="ステップ 3/5")
         
         await interaction.response.edit_message(embed=embed, view=view)
 
-    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1)
+    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1, custom_id="report_wizard:rule_cancel")
     async def cancel_report(self, interaction: discord.Interaction, button: ui.Button):
-        """報告をキャンセルする"""
-        embed = discord.Embed(
-            title="❌ 報告をキャンセルしました",
-            description="報告はキャンセルされました。",
-            color=discord.Color.red()
-        )
-        await interaction.response.edit_message(embed=embed, view=None)
+        await self.cancel(interaction)
 
-class UrgencySelectView(ui.View):
+class UrgencySelectView(ReportWizardView):
     """緊急度選択用のView"""
-    def __init__(self, report_data: ReportData):
-        super().__init__(timeout=300)  # 5分に延長
-        self.report_data = report_data
-
     @ui.select(
         placeholder="緊急度を選択してください",
+        custom_id="report_wizard:urgency",
         options=[
             discord.SelectOption(
                 label="低：通常の違反報告",
@@ -517,13 +934,17 @@ class UrgencySelectView(ui.View):
         ]
     )
     async def urgency_select(self, interaction: discord.Interaction, select: ui.Select):
-        self.report_data.urgency = select.values[0]
+        report_data = await load_report_draft(interaction)
+        if report_data is None:
+            return
+        report_data.urgency = select.values[0]
+        await report_data.save()
         
         # 次のステップへ
-        view = WarningSelectView(self.report_data)
+        view = WarningSelectView.for_message()
         embed = discord.Embed(
             title="⚠️ 警告発行の選択",
-            description=f"**報告対象者:** {self.report_data.target_user.mention}\n**違反ルール:** {self.report_data.violated_rule}\n**緊急度:** {self.report_data.urgency}\n\n対象者に警告を発行しますか？",
+            description=f"**報告対象者:** {report_data.target_mention}\n**違反ルール:** {report_data.violated_rule}\n**緊急度:** {report_data.urgency}\n\n対象者に警告を発行しますか？",
             color=discord.Color.orange()
         )
         embed.add_field(
@@ -535,52 +956,42 @@ class UrgencySelectView(ui.View):
         
         await interaction.response.edit_message(embed=embed, view=view)
 
-    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1)
+    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1, custom_id="report_wizard:urgency_cancel")
     async def cancel_report(self, interaction: discord.Interaction, button: ui.Button):
-        """報告をキャンセルする"""
-        embed = discord.Embed(
-            title="❌ 報告をキャンセルしました",
-            description="報告はキャンセルされました。",
-            color=discord.Color.red()
-        )
-        await interaction.response.edit_message(embed=embed, view=None)
+        await self.cancel(interaction)
 
-class WarningSelectView(ui.View):
+class WarningSelectView(ReportWizardView):
     """警告発行選択用のView"""
-    def __init__(self, report_data: ReportData):
-        super().__init__(timeout=300)  # 5分に延長
-        self.report_data = report_data
-
-    @ui.button(label="はい、警告を発行する", style=discord.ButtonStyle.danger, emoji="⚠️")
+    @ui.button(label="はい、警告を発行する", style=discord.ButtonStyle.danger, emoji="⚠️", custom_id="report_wizard:warn_yes")
     async def issue_warning(self, interaction: discord.Interaction, button: ui.Button):
-        self.report_data.issue_warning = True
-        await self._proceed_to_details(interaction)
+        await self._proceed_to_details(interaction, True)
 
-    @ui.button(label="いいえ、管理者にのみ報告", style=discord.ButtonStyle.secondary, emoji="🤐")
+    @ui.button(label="いいえ、管理者にのみ報告", style=discord.ButtonStyle.secondary, emoji="🤐", custom_id="report_wizard:warn_no")
     async def no_warning(self, interaction: discord.Interaction, button: ui.Button):
-        self.report_data.issue_warning = False
-        await self._proceed_to_details(interaction)
+        await self._proceed_to_details(interaction, False)
 
-    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1)
+    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1, custom_id="report_wizard:warning_cancel")
     async def cancel_report(self, interaction: discord.Interaction, button: ui.Button):
-        """報告をキャンセルする"""
-        embed = discord.Embed(
-            title="❌ 報告をキャンセルしました",
-            description="報告はキャンセルされました。",
-            color=discord.Color.red()
-        )
-        await interaction.response.edit_message(embed=embed, view=None)
+        await self.cancel(interaction)
 
-    async def _proceed_to_details(self, interaction: discord.Interaction):
+    async def _proceed_to_details(self, interaction: discord.Interaction, issue_warning):
         """詳細入力ステップへ進む"""
-        modal = DetailsInputModal(self.report_data)
+        report_data = await load_report_draft(interaction)
+        if report_data is None:
+            return
+        report_data.issue_warning = issue_warning
+        await report_data.save()
+        modal = DetailsInputModal()
         await interaction.response.send_modal(modal)
 
 class DetailsInputModal(ui.Modal):
     """詳細情報入力用のモーダル"""
-    def __init__(self, report_data: ReportData):
+    def __init__(self):
         super().__init__(title="報告の詳細情報")
-        self.report_data = report_data
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        structured_logging.bind_interaction(interaction)
+        return True
 
     details = ui.TextInput(
         label="詳しい状況（任意）",
@@ -598,133 +1009,516 @@ class DetailsInputModal(ui.Modal):
     )
 
     async def on_submit(self, interaction: discord.Interaction):
-        self.report_data.details = self.details.value if self.details.value else None
-        self.report_data.message_link = self.message_link.value if self.message_link.value else None
+        report_data = await load_report_draft(interaction)
+        if report_data is None:
+            return
+        report_data.details = self.details.value if self.details.value else None
+        report_data.message_link = self.message_link.value if self.message_link.value else None
         
         # 「その他」を選んだ場合、詳細が必須
-        if self.report_data.violated_rule == "その他" and not self.report_data.details:
+        if report_data.violated_rule == "その他" and not report_data.details:
             await interaction.response.send_message(
                 "❌ 「その他」のルール違反を選んだ場合、詳細な状況の入力が必要です。", 
                 ephemeral=True
             )
             return
+        await report_data.save()
         
         # 最終確認ステップへ
-        view = FinalConfirmView(self.report_data)
+        view = FinalConfirmView.for_message()
         embed = discord.Embed(
             title="✅ 最終確認",
             description="以下の内容で報告を送信します。よろしいですか？",
             color=discord.Color.green()
         )
-        embed.add_field(name="👤 報告対象者", value=self.report_data.target_user.mention, inline=False)
-        embed.add_field(name="📜 違反ルール", value=self.report_data.violated_rule, inline=False)
-        embed.add_field(name="🔥 緊急度", value=self.report_data.urgency, inline=False)
-        embed.add_field(name="⚠️ 警告発行", value="はい" if self.report_data.issue_warning else "いいえ", inline=False)
-        if self.report_data.details:
-            embed.add_field(name="📝 詳細", value=self.report_data.details[:500] + ("..." if len(self.report_data.details) > 500 else ""), inline=False)
-        if self.report_data.message_link:
-            embed.add_field(name="🔗 証拠リンク", value=self.report_data.message_link, inline=False)
+        embed.add_field(name="👤 報告対象者", value=report_data.target_mention, inline=False)
+        embed.add_field(name="📜 違反ルール", value=report_data.violated_rule, inline=False)
+        embed.add_field(name="🔥 緊急度", value=report_data.urgency, inline=False)
+        embed.add_field(name="⚠️ 警告発行", value="はい" if report_data.issue_warning else "いいえ", inline=False)
+        if report_data.details:
+            embed.add_field(name="📝 詳細", value=report_data.details[:500] + ("..." if len(report_data.details) > 500 else ""), inline=False)
+        if report_data.message_link:
+            embed.add_field(name="🔗 証拠リンク", value=report_data.message_link, inline=False)
         embed.set_footer(text="ステップ 5/5 | この報告は匿名で送信されます")
         
         await interaction.response.edit_message(embed=embed, view=view)
+        # 最終確認を読んでいる間に、報告先・報告ID・送信する埋め込みを用意しておく
+        prefetch_button_report(interaction.guild, report_data)
 
-class FinalConfirmView(ui.View):
+class FinalConfirmView(ReportWizardView):
     """最終確認用のView"""
-    def __init__(self, report_data: ReportData):
-        super().__init__(timeout=300)  # 5分に延長
-        self.report_data = report_data
-
-    @ui.button(label="📤 報告を送信する", style=discord.ButtonStyle.success, emoji="✅")
+    @ui.button(label="📤 報告を送信する", style=discord.ButtonStyle.success, emoji="✅", custom_id="report_wizard:submit")
+    @admission_controlled(admission_controller)
     async def submit_report(self, interaction: discord.Interaction, button: ui.Button):
-        await interaction.response.defer(ephemeral=True)
-        
+        await submit_button_report(interaction)
+
+    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1, custom_id="report_wizard:submit_cancel")
+    async def cancel_report(self, interaction: discord.Interaction, button: ui.Button):
+        await self.cancel(interaction)
+
+REPORT_WIZARD_VIEWS = (TargetUserSelectView, RuleSelectView, UrgencySelectView, WarningSelectView, FinalConfirmView)
+
+def report_destination(guild, config, issue_warning):
+    """ボタン式報告の報告先チャンネル（警告発行の有無で分岐）"""
+    return guild.get_channel(config.warning_channel_id if issue_warning else config.admin_only_channel_id)
+
+# --- 報告ウィザードの先読み ---
+# 利用者が詳細を入力して最終確認を読んでいる間に、送信時に必要なもの（報告先チャンネル・報告ID・報告の埋め込み）を
+# 用意しておき、送信ボタンでは登録と送信だけを行う。先読みはこのプロセスのメモリにだけ持つので、
+# 別のプロセスが送信を受けた・先読みが終わっていない・内容が変わった場合は、送信時にその場で用意する。
+REPORT_PREFETCH_CACHE_SIZE = 1000   # 先読みを保持する最大件数（入力途中で離れた利用者の分は古い順に捨てる）
+SUBMIT_LATENCY_SAMPLES = 200        # 送信にかかった時間を集計する直近の件数
+_report_prefetch = OrderedDict()    # (guild_id, user_id) -> 先読みの Task
+_submit_latencies = {"prefetched": deque(maxlen=SUBMIT_LATENCY_SAMPLES), "serial": deque(maxlen=SUBMIT_LATENCY_SAMPLES)}
+
+class PreparedReport:
+    """送信前に用意したボタン式報告"""
+    __slots__ = ("values", "config", "channel", "report_id", "content", "embed")
+
+    def __init__(self, values, config, channel, report_id, content, embed):
+        self.values = values
+        self.config = config
+        self.channel = channel
+        self.report_id = report_id
+        self.content = content
+        self.embed = embed
+
+def _draft_values(report_data):
+    return tuple(getattr(report_data, field) for field in db.REPORT_DRAFT_FIELDS)
+
+async def prepare_button_report(guild, report_data, report_id=None):
+    """報告先チャンネルを決め、報告IDを採番して埋め込みを作る（report_id を渡すとそのIDで作り直す）"""
+    config = await get_report_config(guild.id)
+    channel = report_destination(guild, config, report_data.issue_warning)
+    if report_id is None:
+        report_id = await db.reserve_report_id()
+    content, embed = render_button_report(config, report_id, report_data)
+    return PreparedReport(_draft_values(report_data), config, channel, report_id, content, embed)
+
+def _discard_prefetch(task):
+    """使わない先読みを捨てる（終わっていれば失敗をログに残すだけ、途中なら止める）"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is not None:
+        logging.warning("使われなかった報告の先読みが失敗していました: %s", task.exception())
+
+def prefetch_button_report(guild, report_data):
+    """最終確認の表示と同時に、送信に必要なものをバックグラウンドで用意し始める"""
+    key = (guild.id, report_data.user_id)
+    previous = _report_prefetch.pop(key, None)
+    if previous is not None:
+        _discard_prefetch(previous)
+    _report_prefetch[key] = asyncio.create_task(prepare_button_report(guild, report_data))
+    while len(_report_prefetch) > REPORT_PREFETCH_CACHE_SIZE:
+        _, oldest = _report_prefetch.popitem(last=False)
+        _discard_prefetch(oldest)
+
+def drop_prefetched_report(guild_id, user_id):
+    task = _report_prefetch.pop((guild_id, user_id), None)
+    if task is not None:
+        _discard_prefetch(task)
+
+async def take_prefetched_report(guild, report_data):
+    """先読みした報告を受け取る（なければその場で用意する）。戻り値は (PreparedReport, 先読みを使えたか)"""
+    task = _report_prefetch.pop((guild.id, report_data.user_id), None)
+    if task is not None:
         try:
-            # 報告チャンネルを警告発行の有無で分岐
-            if self.report_data.issue_warning:
-                report_channel = client.get_channel(WARNING_CHANNEL_ID)
-            else:
-                report_channel = client.get_channel(ADMIN_ONLY_CHANNEL_ID)
-            
-            if not report_channel:
+            prepared = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise  # 止められたのは送信の処理の方
+            prepared = None
+        except Exception as e:
+            # 先読みの失敗は送信の失敗にしない（DB障害ならこの後その場で用意するときにスプールへ回る）
+            logging.warning("報告の先読みに失敗したため、その場で用意します: %s", e)
+            prepared = None
+        if prepared is not None:
+            if prepared.values == _draft_values(report_data):
+                return prepared, True
+            # 先読みの後に内容が変わった（別のプロセスで入力し直したなど）：採番済みのIDで作り直す
+            return await prepare_button_report(guild, report_data, prepared.report_id), False
+    return await prepare_button_report(guild, report_data), False
+
+def submit_latency_metrics():
+    """報告の送信にかかった時間（先読みを使えた場合とその場で用意した場合、直近の件数の中央値と95パーセンタイル）"""
+    metrics = {}
+    for path, samples in _submit_latencies.items():
+        ordered = sorted(samples)
+        metrics[path] = {
+            "count": len(ordered),
+            "p50_ms": round(ordered[len(ordered) // 2], 1) if ordered else None,
+            "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 1) if ordered else None,
+        }
+    return metrics
+
+async def submit_button_report(interaction: discord.Interaction):
+    """ボタン式報告の送信（最終確認の「送信する」ボタン）"""
+    started_at = time.monotonic()
+    await interaction.response.defer(ephemeral=True)
+    prefetched = False
+
+    try:
+        report_data = await load_report_draft(interaction)
+        if report_data is None:
+            return
+
+        try:
+            prepared, prefetched = await take_prefetched_report(interaction.guild, report_data)
+            if not prepared.channel:
                 await interaction.followup.send("❌ 報告先チャンネルが見つかりません。管理者に連絡してください。", ephemeral=True)
                 return
+            record = await db.create_or_merge_report(
+                interaction.guild.id,
+                report_data.target_user_id,
+                report_data.violated_rule,
+                report_data.details,
+                report_data.message_link,
+                report_data.urgency,
+                report_id=prepared.report_id,
+                issue_warning=report_data.issue_warning
+            )
+        except db.DatabaseUnavailable:
+            # DBが戻ったら登録・送信し直す（報告者には受付済みとして返す）
+            await spool_report("button", interaction.guild.id, report_data)
+            await report_data.discard()
+            await interaction.followup.send(SPOOLED_REPORT_MESSAGE, ephemeral=True)
+            return
 
-            report_id = await db.create_report(
-                interaction.guild.id, 
-                self.report_data.target_user.id, 
-                self.report_data.violated_rule, 
-                self.report_data.details, 
-                self.report_data.message_link, 
-                self.report_data.urgency
+        if record['reporter_count'] > 1:
+            # 同じ出来事で、元の報告より重くない報告：用意した埋め込みは使わず、元の報告の報告者数だけ更新する
+            await asyncio.gather(
+                report_data.discard(),
+                show_reporter_count(interaction.guild, record),
+                interaction.followup.send(DUPLICATE_REPORT_MESSAGE, ephemeral=True),
             )
-            
-            # 埋め込みの色と絵文字を設定
-            embed_color = discord.Color.greyple()
-            title_prefix = "📝"
-            content = None
-
-            if self.report_data.urgency == "中":
-                embed_color = discord.Color.orange()
-                title_prefix = "⚠️"
-            elif self.report_data.urgency == "高":
-                embed_color = discord.Color.red()
-                title_prefix = "🚨"
-                # 緊急時のロールメンションは設定から取得（将来的に設定可能にする場合のため）
-                # content = f"@everyone 緊急の報告です！"  # 必要に応じてコメントアウト解除
-            
-            # 報告種別を表示に追加
-            report_type = "警告付き報告" if self.report_data.issue_warning else "管理者のみ報告"
-            
-            embed = discord.Embed(title=f"{title_prefix} 新規の匿名報告 (ID: {report_id})", color=embed_color)
-            embed.add_field(name="👤 報告対象者", value=f"{self.report_data.target_user.mention} ({self.report_data.target_user.id})", inline=False)
-            embed.add_field(name="📜 違反したルール", value=self.report_data.violated_rule, inline=False)
-            embed.add_field(name="🔥 緊急度", value=self.report_data.urgency, inline=False)
-            embed.add_field(name="📋 報告種別", value=report_type, inline=False)
-            if self.report_data.details: 
-                embed.add_field(name="📝 詳細", value=self.report_data.details, inline=False)
-            if self.report_data.message_link: 
-                embed.add_field(name="🔗 関連メッセージ", value=self.report_data.message_link, inline=False)
-            embed.add_field(name="📊 ステータス", value="未対応", inline=False)
-            embed.set_footer(text="この報告は匿名で送信されました（ボタン式報告）")
-
-            sent_message = await report_channel.send(content=content, embed=embed)
-            await db.update_report_message_id(report_id, sent_message.id)
-
-            # 警告を発行する場合（警告チャンネルでのみ実行）
-            if self.report_data.issue_warning:
-                warning_message = (
-                    f"{self.report_data.target_user.mention}\n\n"
-                    f"⚠️ **サーバー管理者からのお知らせです** ⚠️\n"
-                    f"━━━━━━━━━━━━━━━━━━━━━━\n"
-                    f"あなたの行動について、サーバーのルールに関する報告が寄せられました。\n\n"
-                    f"**該当ルール:** [✅ルール](<{RULE_ANNOUNCEMENT_LINK}>)\n\n"
-                    f"みんなが楽しく過ごせるよう、今一度ルールの確認をお願いいたします。\n"
-                    f"ご不明な点があれば、このチャンネルで返信するか、管理者にDMを送ってください。\n"
-                    f"━━━━━━━━━━━━━━━━━━━━━━"
-                )
-                await report_channel.send(warning_message)
+            return
 
-            final_message = "✅ 報告を送信しました。ご協力ありがとうございます。"
-            if self.report_data.issue_warning:
-                final_message = "✅ 報告と警告発行を完了しました。ご協力ありがとうございます。"
+        # 報告は作成済みなので途中経過は消す（二重送信の防止も兼ねる）。送信とは互いに待たない
+        sent_message, _ = await asyncio.gather(
+            send_queue.send(
+                prepared.channel, content=prepared.content, embed=prepared.embed,
+                priority=urgency_priority(report_data.urgency)
+            ),
+            report_data.discard(),
+        )
 
-            await interaction.followup.send(final_message, ephemeral=True)
-            
-            # 報告送信後に報告ボタンを最新位置に移動
-            await refresh_report_button()
+        final_message = "✅ 報告を送信しました。ご協力ありがとうございます。"
+        if report_data.issue_warning:
+            final_message = "✅ 報告と警告発行を完了しました。ご協力ありがとうございます。"
 
-        except Exception as e:
-            logging.error(f"ボタン式報告処理中にエラー: {e}", exc_info=True)
-            await interaction.followup.send(f"❌ 報告の送信中にエラーが発生しました: {e}", ephemeral=True)
+        # メッセージIDの記録・報告者への返信・報告ボタンの移動（報告メッセージの後に置く）は同時に行う
+        await asyncio.gather(
+            record_report_message(prepared.report_id, sent_message, report_data.issue_warning),
+            interaction.followup.send(final_message, ephemeral=True),
+            refresh_report_button(interaction.guild),
+        )
 
-    @ui.button(label="❌ キャンセル", style=discord.ButtonStyle.danger, row=1)
-    async def cancel_report(self, interaction: discord.Interaction, button: ui.Button):
-        embed = discord.Embed(
-            title="❌ 報告をキャンセルしました",
-            description="報告はキャンセルされました。",
-            color=discord.Color.red()
+    except Exception as e:
+        logging.error(f"ボタン式報告処理中にエラー: {e}", exc_info=True)
+        await interaction.followup.send(f"❌ 報告の送信中にエラーが発生しました: {e}", ephemeral=True)
+    finally:
+        elapsed_ms = (time.monotonic() - started_at) * 1000
+        _submit_latencies["prefetched" if prefetched else "serial"].append(elapsed_ms)
+        logging.info(
+            "ボタン式報告の送信処理 (先読み: %s)", "あり" if prefetched else "なし",
+            extra={"duration_ms": round(elapsed_ms, 2), "sampled": True}
         )
-        await interaction.response.edit_message(embed=embed, view=None)
+
+def render_button_report(config, report_id, report_data):
+    """ボタン式報告のメッセージ（本文, 埋め込み）を作る"""
+    # 埋め込みの色と絵文字を設定
+    embed_color = discord.Color.greyple()
+    title_prefix = "📝"
+    content = None
+
+    if report_data.urgency == "中":
+        embed_color = discord.Color.orange()
+        title_prefix = "⚠️"
+    elif report_data.urgency == "高":
+        embed_color = discord.Color.red()
+        title_prefix = "🚨"
+        # 緊急時のロールメンションは設定から取得（将来的に設定可能にする場合のため）
+        # content = f"@everyone 緊急の報告です！"  # 必要に応じてコメントアウト解除
+
+    # 報告種別を表示に追加
+    report_type = "警告付き報告" if report_data.issue_warning else "管理者のみ報告"
+
+    embed = discord.Embed(title=f"{title_prefix} 新規の匿名報告 (ID: {report_id})", color=embed_color)
+    embed.add_field(name="👤 報告対象者", value=f"{report_data.target_mention} ({report_data.target_user_id})", inline=False)
+    embed.add_field(name="📜 違反したルール", value=report_data.violated_rule, inline=False)
+    embed.add_field(name="🔥 緊急度", value=report_data.urgency, inline=False)
+    embed.add_field(name="📋 報告種別", value=report_type, inline=False)
+    if report_data.details: 
+        embed.add_field(name="📝 詳細", value=report_data.details, inline=False)
+    if report_data.message_link: 
+        embed.add_field(name="🔗 関連メッセージ", value=report_data.message_link, inline=False)
+    embed.add_field(name="📊 ステータス", value="未対応", inline=False)
+    embed.set_footer(text="この報告は匿名で送信されました（ボタン式報告）")
+
+    # 警告を発行する場合（報告先は警告チャンネルなので、報告の埋め込みと1つのメッセージにまとめて送る）
+    if report_data.issue_warning:
+        warning_message = (
+            f"{report_data.target_mention}\n\n"
+            f"⚠️ **サーバー管理者からのお知らせです** ⚠️\n"
+            f"━━━━━━━━━━━━━━━━━━━━━━\n"
+            f"あなたの行動について、サーバーのルールに関する報告が寄せられました。\n\n"
+            f"**該当ルール:** [✅ルール](<{config.rule_announcement_link}>)\n\n"
+            f"みんなが楽しく過ごせるよう、今一度ルールの確認をお願いいたします。\n"
+            f"ご不明な点があれば、このチャンネルで返信するか、管理者にDMを送ってください。\n"
+            f"━━━━━━━━━━━━━━━━━━━━━━"
+        )
+        content = f"{content}\n\n{warning_message}" if content else warning_message
+    return content, embed
+
+async def link_report_message(report_id, sent_message):
+    """送信した報告メッセージを記録する（送信中にまとめられた重複報告があれば、その報告者数を表示する）"""
+    reporter_count = await db.update_report_message_id(report_id, sent_message.id, sent_message.channel.id)
+    if reporter_count and reporter_count > 1:
+        await set_reporter_count(report_id, sent_message, reporter_count)
+
+async def record_report_message(report_id, sent_message, issue_warning):
+    """送信した報告メッセージを記録する（警告付きなら警告の発行もイベントログに残す）"""
+    await link_report_message(report_id, sent_message)
+    if issue_warning:
+        await db.record_warning_issued(report_id)
+
+async def post_button_report(report_channel, config, report_id, report_data):
+    """登録済みのボタン式報告を報告先チャンネルに送り、メッセージIDを記録する"""
+    content, embed = render_button_report(config, report_id, report_data)
+    sent_message = await send_queue.send(
+        report_channel, content=content, embed=embed, priority=urgency_priority(report_data.urgency)
+    )
+    await record_report_message(report_id, sent_message, report_data.issue_warning)
+    return sent_message
+
+async def post_command_report(guild, settings, report_id, target_user_id, violated_rule, urgency, details, message_link):
+    """登録済みの /syugoshin の報告を報告チャンネルに送り、メッセージIDを記録する"""
+    report_channel = guild.get_channel(settings['report_channel_id'])
+
+    embed_color = discord.Color.greyple()
+    title_prefix = "📝"
+    content = None
+
+    if urgency == "中":
+        embed_color = discord.Color.orange()
+        title_prefix = "⚠️"
+    elif urgency == "高":
+        embed_color = discord.Color.red()
+        title_prefix = "🚨"
+        if settings.get('urgent_role_id'):
+            role = guild.get_role(settings['urgent_role_id'])
+            if role: content = f"{role.mention} 緊急の報告です！"
+
+    embed = discord.Embed(title=f"{title_prefix} 新規の匿名報告 (ID: {report_id})", color=embed_color)
+    embed.add_field(name="👤 報告対象者", value=f"<@{target_user_id}> ({target_user_id})", inline=False)
+    embed.add_field(name="📜 違反したルール", value=violated_rule, inline=False)
+    embed.add_field(name="🔥 緊急度", value=urgency, inline=False)
+    if details: embed.add_field(name="📝 詳細", value=details, inline=False)
+    if message_link: embed.add_field(name="🔗 関連メッセージ", value=message_link, inline=False)
+    embed.add_field(name="📊 ステータス", value="未対応", inline=False)
+    embed.set_footer(text="この報告は匿名で送信されました。")
+
+    sent_message = await send_queue.send(report_channel, content=content, embed=embed, priority=urgency_priority(urgency))
+    await link_report_message(report_id, sent_message)
+    return sent_message
+
+DUPLICATE_REPORT_MESSAGE = "✅ 報告を受け付けました。同じ内容の報告がすでに届いているため、その報告にまとめて管理者に伝えました。"
+REPORTER_COUNT_FIELD = "👥 報告者数"
+
+async def show_reporter_count(guild, record):
+    """重複報告をまとめたとき、元の報告メッセージの埋め込みに報告者数を表示する"""
+    if not record['message_id'] or not record['channel_id']:
+        # 元の報告がまだ送信中（またはスプールの再送待ち）。メッセージIDを記録するときに件数を読み直して表示する
+        return
+    try:
+        channel = guild.get_channel(record['channel_id'])
+        if not channel:
+            raise LookupError("報告チャンネルが見つかりません")
+        message = await channel.fetch_message(record['message_id'])
+    except Exception as e:
+        logging.warning("報告ID %s の報告者数の更新に失敗: %s", record['report_id'], e)
+        return
+    await set_reporter_count(record['report_id'], message, record['reporter_count'])
+
+async def set_reporter_count(report_id, message, count):
+    """報告メッセージの埋め込みの報告者数を更新する（ステータスの前に表示する）"""
+    try:
+        embed = message.embeds[0]
+        for i, field in enumerate(embed.fields):
+            if field.name == REPORTER_COUNT_FIELD:
+                # 同時にまとめられた場合に、古い件数で上書きしない
+                count = max(count, int(field.value.rstrip("人") or 0))
+                embed.set_field_at(i, name=REPORTER_COUNT_FIELD, value=f"{count}人", inline=False)
+                break
+        else:
+            status_index = next((i for i, field in enumerate(embed.fields) if field.name == "📊 ステータス"), len(embed.fields))
+            embed.insert_field_at(status_index, name=REPORTER_COUNT_FIELD, value=f"{count}人", inline=False)
+        await message.edit(embed=embed)
+    except Exception as e:
+        logging.warning("報告ID %s の報告者数の更新に失敗: %s", report_id, e)
+
+# --- DB障害中に受け付けた報告の再送 ---
+SPOOLED_REPORT_MESSAGE = "✅ 報告を受け付けました。現在データベースに接続できないため、復旧後に管理者へ届けられます。"
+SPOOL_REPLAY_INTERVAL_SECONDS = 10  # スプールを確認する間隔（秒）
+
+async def spool_report(source, guild_id, report_data):
+    """登録できなかった報告をスプールに書く（source は "button" か "command"）"""
+    payload = {"source": source, "guild_id": guild_id}
+    payload.update({field: getattr(report_data, field) for field in db.REPORT_DRAFT_FIELDS})
+    seq = await report_spool.append("report", payload)
+    logging.warning("DBに接続できないため報告をスプールに保存しました (スプール番号: %s)", seq)
+
+async def replay_spooled_report(payload, created_at):
+    """スプールの報告を登録し、登録できたら報告先チャンネルへ送る関数を返す"""
+    report_data = ReportData(payload["guild_id"], None, **{field: payload[field] for field in db.REPORT_DRAFT_FIELDS})
+    record = await db.create_or_merge_report(
+        report_data.guild_id, report_data.target_user_id, report_data.violated_rule,
+        report_data.details, report_data.message_link, report_data.urgency,
+        created_at=datetime.datetime.fromtimestamp(created_at, datetime.timezone.utc),
+        issue_warning=report_data.issue_warning
+    )
+    report_id = record['report_id']
+
+    async def post():
+        guild = client.get_guild(report_data.guild_id)
+        if guild is None:
+            logging.warning("スプールから登録した報告 %s のサーバーが見つからないため、送信を見送りました", report_id)
+            return
+        if record['reporter_count'] > 1:
+            await show_reporter_count(guild, record)
+            return
+        if payload["source"] == "command":
+            settings = await db.get_guild_settings(guild.id)
+            if not settings or not settings.get('report_channel_id'):
+                logging.warning("スプールから登録した報告 %s の報告チャンネルが設定されていません", report_id)
+                return
+            await post_command_report(
+                guild, settings, report_id, report_data.target_user_id, report_data.violated_rule,
+                report_data.urgency, report_data.details, report_data.message_link
+            )
+            return
+        config = await get_report_config(guild.id)
+        report_channel = report_destination(guild, config, report_data.issue_warning)
+        if report_channel is None:
+            logging.warning("スプールから登録した報告 %s の報告先チャンネルが見つかりません", report_id)
+            return
+        await post_button_report(report_channel, config, report_id, report_data)
+    return post
+
+async def replay_spool():
+    """スプールの記録を受け付けた順に反映する（DBに繋がらなくなったらそこで止める）"""
+    replayed = 0
+    while True:
+        entries = await report_spool.pending()
+        if not entries:
+            break
+        for seq, kind, payload, created_at in entries:
+            try:
+                if kind == "cooldown":
+                    await db.apply_spooled_cooldown(
+                        payload.get("user_id"), datetime.datetime.fromtimestamp(created_at, datetime.timezone.utc)
+                    )
+                    post = None
+                else:
+                    post = await replay_spooled_report(payload, created_at)
+            except db.DatabaseUnavailable:
+                return replayed
+            except Exception as e:
+                logging.error(f"スプールの再送に失敗 (スプール番号: {seq}): {e}", exc_info=True)
+                await report_spool.record_failure(seq)
+                continue
+            # DBに登録できた時点でスプールから消す（送信に失敗しても報告は残っている）
+            await report_spool.remove(seq)
+            replayed += 1
+            if post is not None:
+                try:
+                    await post()
+                except Exception as e:
+                    logging.error(f"スプールから登録した報告の送信に失敗: {e}", exc_info=True)
+    return replayed
+
+async def run_spool_replay():
+    """DBが使えるときにスプールを定期的に確認して再送する"""
+    await client.wait_until_ready()
+    while True:
+        try:
+            if not db.breaker.is_open and await report_spool.count():
+                replayed = await replay_spool()
+                if replayed:
+                    logging.info("スプールの記録を %d 件反映しました", replayed)
+        except Exception as e:
+            logging.error(f"スプールの再送処理でエラー: {e}", exc_info=True)
+        await asyncio.sleep(SPOOL_REPLAY_INTERVAL_SECONDS)
+
+# --- 報告ステータスの一括変更 ---
+REPORT_STATUS_COLORS = {"対応中": discord.Color.yellow(), "解決済み": discord.Color.green(), "却下": discord.Color.greyple()}
+BULK_STATUS_MAX_REPORTS = 100     # 1回の一括変更で扱える報告の最大数
+EMBED_EDIT_CONCURRENCY = 3        # 同時に編集する埋め込みの数（レート制限に余裕を持たせる）
+PROGRESS_UPDATE_INTERVAL = 2.0    # 進捗メッセージを更新する間隔（秒）
+
+def parse_report_ids(text):
+    """「1, 2, 5-8」のような文字列を報告IDのリストにする"""
+    report_ids = []
+    for part in text.replace("、", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+            if abs(end - start) >= BULK_STATUS_MAX_REPORTS:
+                raise ValueError("範囲が広すぎます")
+            report_ids.extend(range(min(start, end), max(start, end) + 1))
+        else:
+            report_ids.append(int(part))
+    return sorted(set(report_ids))
+
+async def edit_report_embeds(guild, records, new_status, on_progress=None):
+    """報告メッセージの埋め込みのステータス表示を、同時実行数を絞ったキューで順に更新する"""
+    config = await get_report_config(guild.id)
+    settings = await db.get_guild_settings(guild.id)
+    fallback_channel_id = (settings.get('report_channel_id') if settings else None) or config.admin_only_channel_id
+
+    queue = asyncio.Queue()
+    for record in records:
+        queue.put_nowait(record)
+    failed = []
+    done = 0
+
+    async def _worker():
+        nonlocal done
+        while True:
+            try:
+                record = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                if not record['message_id']:
+                    raise LookupError("メッセージIDが記録されていません")
+                channel = guild.get_channel(record['channel_id'] or fallback_channel_id)
+                if not channel:
+                    raise LookupError("報告チャンネルが見つかりません")
+                # 429 が返った場合は discord.py が Retry-After だけ待ってから再送する
+                message = await channel.fetch_message(record['message_id'])
+                embed = message.embeds[0]
+                embed.color = REPORT_STATUS_COLORS.get(new_status, embed.color)
+                for i, field in enumerate(embed.fields):
+                    if field.name == "📊 ステータス":
+                        embed.set_field_at(i, name="📊 ステータス", value=new_status, inline=False)
+                        break
+                await message.edit(embed=embed)
+            except Exception as e:
+                logging.warning("報告ID %s の埋め込み更新に失敗: %s", record['report_id'], e)
+                failed.append(record['report_id'])
+            done += 1
+            if on_progress:
+                # 進捗表示の失敗（進捗メッセージの編集エラーなど）で残りの更新を止めない
+                try:
+                    await on_progress(done, len(records))
+                except Exception as e:
+                    logging.warning("埋め込み更新の進捗表示に失敗: %s", e)
+
+    await asyncio.gather(*(_worker() for _ in range(EMBED_EDIT_CONCURRENCY)))
+    return failed
 
 # --- スラッシュコマンド ---
 
@@ -750,6 +1544,7 @@ class FinalConfirmView(ui.View):
         app_commands.Choice(name="高：即座の対応が必要", value="高"),
     ],
 )
+@admission_controlled(admission_controller)
 async def report(
     interaction: discord.Interaction,
     user: discord.User,
@@ -760,56 +1555,57 @@ async def report(
 ):
     await interaction.response.defer(ephemeral=True)
 
-    settings = await db.get_guild_settings(interaction.guild.id)
-    if not settings or not settings.get('report_channel_id'):
+    try:
+        settings = await db.get_guild_settings(interaction.guild.id)
+        settings_loaded = True
+    except db.DatabaseUnavailable:
+        # 一度も読めていないサーバー：設定を確かめずに受け付け、下の登録でスプールに回す（送信先は再送時に読み直す）
+        settings, settings_loaded = None, False
+    if settings_loaded and (not settings or not settings.get('report_channel_id')):
         await interaction.followup.send("ボットの初期設定が完了していません。管理者が`/setup`で設定してください。", ephemeral=True)
         return
 
-    remaining_time = await db.check_cooldown(interaction.user.id, COOLDOWN_MINUTES * 60)
+    remaining_time, quota_exceeded = await check_report_limits(interaction.user.id)
+    if quota_exceeded:
+        await interaction.followup.send(f"今日の報告は上限（{DAILY_REPORT_LIMIT}件）に達しました。明日また報告してください。", ephemeral=True)
+        return
     if remaining_time > 0:
         await interaction.followup.send(f"クールダウン中です。あと `{int(remaining_time // 60)}分 {int(remaining_time % 60)}秒` 待ってください。", ephemeral=True)
         return
 
     
     try:
-        report_id = await db.create_report(
-            interaction.guild.id, user.id, rule.value, info, message_link, speed.value
+        try:
+            record = await db.create_or_merge_report(
+                interaction.guild.id, user.id, rule.value, info, message_link, speed.value
+            )
+        except db.DatabaseUnavailable:
+            report_data = ReportData(
+                interaction.guild.id, interaction.user.id, target_user_id=user.id, violated_rule=rule.value,
+                urgency=speed.value, details=info, message_link=message_link
+            )
+            await spool_report("command", interaction.guild.id, report_data)
+            await interaction.followup.send(SPOOLED_REPORT_MESSAGE, ephemeral=True)
+            return
+
+        if record['reporter_count'] > 1:
+            await show_reporter_count(interaction.guild, record)
+            await interaction.followup.send(DUPLICATE_REPORT_MESSAGE, ephemeral=True)
+            return
+
+        if settings is None:
+            # 設定を読めなかった直後にDBが戻った
+            settings = await db.get_guild_settings(interaction.guild.id)
+        await post_command_report(
+            interaction.guild, settings, record['report_id'], user.id, rule.value, speed.value, info, message_link
         )
-        
-        report_channel = client.get_channel(settings['report_channel_id'])
-        
-        embed_color = discord.Color.greyple()
-        title_prefix = "📝"
-        content = None
-
-        if speed.value == "中":
-            embed_color = discord.Color.orange()
-            title_prefix = "⚠️"
-        elif speed.value == "高":
-            embed_color = discord.Color.red()
-            title_prefix = "🚨"
-            if settings.get('urgent_role_id'):
-                role = interaction.guild.get_role(settings['urgent_role_id'])
-                if role: content = f"{role.mention} 緊急の報告です！"
-        
-        embed = discord.Embed(title=f"{title_prefix} 新規の匿名報告 (ID: {report_id})", color=embed_color)
-        embed.add_field(name="👤 報告対象者", value=f"{user.mention} ({user.id})", inline=False)
-        embed.add_field(name="📜 違反したルール", value=rule.value, inline=False)
-        embed.add_field(name="🔥 緊急度", value=speed.value, inline=False)
-        if info: embed.add_field(name="📝 詳細", value=info, inline=False)
-        if message_link: embed.add_field(name="🔗 関連メッセージ", value=message_link, inline=False)
-        embed.add_field(name="📊 ステータス", value="未対応", inline=False)
-        embed.set_footer(text="この報告は匿名で送信されました。")
-
-        sent_message = await report_channel.send(content=content, embed=embed)
-        await db.update_report_message_id(report_id, sent_message.id)
 
         final_message = "通報を受け付けました。ご協力ありがとうございます。"
 
         await interaction.followup.send(final_message, ephemeral=True)
         
         # 報告送信後に報告ボタンを最新位置に移動
-        await refresh_report_button()
+        await refresh_report_button(interaction.guild)
 
     except Exception as e:
         logging.error(f"通報処理中にエラー: {e}", exc_info=True)
@@ -824,11 +1620,11 @@ async def whois(interaction: discord.Interaction, user_id: str):
     await interaction.response.defer(ephemeral=True)
     try:
         uid = int(user_id)
-        # ユーザー情報（グローバル）
-        user = await client.fetch_user(uid)
+        # ユーザー情報（メンバーキャッシュにいればREST APIを呼ばない）
+        user = await resolve_user(uid, interaction.guild)
 
         # サーバー内のMember情報（ニックネーム等）
-        member = interaction.guild.get_member(uid)
+        member = await resolve_member(interaction.guild, uid)
         nickname = member.nick if member and member.nick else "（なし）"
         joined = member.joined_at.strftime("%Y-%m-%d %H:%M") if member and member.joined_at else "不明"
 
@@ -862,6 +1658,259 @@ async def whois_error(interaction: discord.Interaction, error: app_commands.AppC
     else:
         await interaction.response.send_message(f"エラーが発生しました: {error}", ephemeral=True)
 
+# ★★★★★★★ 管理者専用：サーバーごとの報告設定 ★★★★★★★
+@tree.command(name="setup", description="【管理者用】このサーバーの報告チャンネルやルールリンクを設定します。")
+@app_commands.describe(
+    report_button_channel="報告ボタンを設置するチャンネル",
+    warning_channel="警告付き報告の送信先チャンネル（対象者へのメンションもここに送られます）",
+    admin_only_channel="管理者のみ報告の送信先チャンネル",
+    rule_link="ルールアナウンスチャンネルのリンク（任意）",
+    urgent_role="緊急度「高」の際にメンションするロール（任意）"
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def setup(
+    interaction: discord.Interaction,
+    report_button_channel: discord.TextChannel,
+    warning_channel: discord.TextChannel,
+    admin_only_channel: discord.TextChannel,
+    rule_link: str = None,
+    urgent_role: discord.Role = None
+):
+    await interaction.response.defer(ephemeral=True)
+
+    # ボットがメッセージを送信する権限があるかチェック
+    for channel in (report_button_channel, warning_channel, admin_only_channel):
+        if not channel.permissions_for(interaction.guild.me).send_messages:
+            await interaction.followup.send(f"❌ {channel.mention} にメッセージを送信する権限がありません。", ephemeral=True)
+            return
+
+    try:
+        # /syugoshin は report_channel_id を参照するため、管理者のみ報告チャンネルを兼ねる
+        await db.setup_guild(
+            interaction.guild.id,
+            admin_only_channel.id,
+            urgent_role.id if urgent_role else None,
+            report_button_channel_id=report_button_channel.id,
+            warning_channel_id=warning_channel.id,
+            admin_only_channel_id=admin_only_channel.id,
+            rule_announcement_link=rule_link
+        )
+        await setup_report_button_for_guild(interaction.guild)
+
+        await interaction.followup.send(
+            f"✅ 報告設定を保存しました。\n"
+            f"**報告ボタン:** {report_button_channel.mention}\n"
+            f"**警告付き報告:** {warning_channel.mention}\n"
+            f"**管理者のみ報告:** {admin_only_channel.mention}\n"
+            f"**ルールリンク:** {rule_link or '変更なし'}\n"
+            f"**緊急メンション用ロール:** {urgent_role.mention if urgent_role else '未設定'}",
+            ephemeral=True
+        )
+        logging.info(f"報告設定を保存: サーバー={interaction.guild.id}, ボタン={report_button_channel.id}, 警告={warning_channel.id}, 管理者のみ={admin_only_channel.id}")
+
+    except Exception as e:
+        logging.error(f"報告設定の保存エラー: {e}", exc_info=True)
+        await interaction.followup.send(f"❌ 報告設定の保存に失敗しました: {e}", ephemeral=True)
+
+@setup.error
+async def setup_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.MissingPermissions):
+        await interaction.response.send_message("このコマンドはサーバーの**管理者のみ**が実行できます。", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"エラーが発生しました: {error}", ephemeral=True)
+
+# ★★★★★★★ 管理者専用：報告ステータスの一括変更 ★★★★★★★
+@tree.command(name="bulkstatus", description="【管理者用】複数の報告のステータスをまとめて変更します。")
+@app_commands.describe(report_ids="報告IDをカンマ区切りや範囲で指定（例: 12, 15, 20-25）", new_status="新しいステータス")
+@app_commands.choices(new_status=[app_commands.Choice(name="対応中", value="対応中"), app_commands.Choice(name="解決済み", value="解決済み"), app_commands.Choice(name="却下", value="却下"),])
+@app_commands.checks.has_permissions(administrator=True)
+async def bulkstatus(interaction: discord.Interaction, report_ids: str, new_status: app_commands.Choice[str]):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        ids = parse_report_ids(report_ids)
+    except ValueError:
+        await interaction.followup.send(f"❌ 報告IDは「12, 15, 20-25」のように数字で指定してください（最大 {BULK_STATUS_MAX_REPORTS} 件）。", ephemeral=True)
+        return
+    if not ids:
+        await interaction.followup.send("❌ 報告IDを指定してください。", ephemeral=True)
+        return
+    if len(ids) > BULK_STATUS_MAX_REPORTS:
+        await interaction.followup.send(f"❌ 一度に変更できるのは {BULK_STATUS_MAX_REPORTS} 件までです。", ephemeral=True)
+        return
+
+    try:
+        # DBはまとめて1回で更新し、埋め込みの編集だけを順に進める
+        records = await db.update_reports_status(ids, new_status.value, interaction.guild.id)
+        progress_message = await interaction.followup.send(
+            f"⏳ {len(records)} 件のステータスを「{new_status.value}」に変更しました。埋め込みを更新中... (0/{len(records)})",
+            ephemeral=True, wait=True
+        )
+
+        last_update = time.monotonic()
+        async def _on_progress(done, total):
+            nonlocal last_update
+            if done < total and time.monotonic() - last_update < PROGRESS_UPDATE_INTERVAL:
+                return
+            last_update = time.monotonic()
+            await progress_message.edit(content=f"⏳ 埋め込みを更新中... ({done}/{total})")
+
+        failed = await edit_report_embeds(interaction.guild, records, new_status.value, _on_progress)
+
+        updated_ids = {record['report_id'] for record in records}
+        missing = [report_id for report_id in ids if report_id not in updated_ids]
+        summary = f"✅ {len(records)} 件の報告のステータスを「{new_status.value}」に変更しました。"
+        if missing:
+            summary += f"\n⚠️ 見つからなかった報告ID: {', '.join(map(str, missing))}"
+        if failed:
+            summary += f"\n⚠️ 埋め込みを更新できなかった報告ID: {', '.join(map(str, sorted(failed)))}"
+        await progress_message.edit(content=summary)
+
+    except Exception as e:
+        logging.error(f"/bulkstatus エラー: {e}", exc_info=True)
+        await interaction.followup.send(f"❌ ステータスの一括変更中にエラーが発生しました: {e}", ephemeral=True)
+
+@bulkstatus.error
+async def bulkstatus_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.MissingPermissions):
+        await interaction.response.send_message("このコマンドはサーバーの**管理者のみ**が実行できます。", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"エラーが発生しました: {error}", ephemeral=True)
+
+# ★★★★★★★ 管理者専用：報告の検索 ★★★★★★★
+class ReportSearchView(ui.View):
+    """検索結果の続きを表示するボタン"""
+    def __init__(self, *, query: str, before_report_id: int, page: int):
+        super().__init__(timeout=300)
+        self.query = query
+        self.before_report_id = before_report_id
+        self.page = page
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        structured_logging.bind_interaction(interaction)
+        return True
+
+    @ui.button(label="次のページ ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        embed, view = await build_report_search_page(interaction.guild, self.query, self.before_report_id, self.page + 1)
+        await interaction.edit_original_response(embed=embed, view=view)
+
+async def build_report_search_page(guild, query, before_report_id=None, page=1):
+    """検索結果の1ページ分の埋め込みと、続きがある場合のボタンを作る"""
+    # 続きがあるかどうかを知るため、1件多く取得する
+    records = await db.search_reports(guild.id, query, before_report_id, db.REPORT_SEARCH_PAGE_SIZE + 1)
+    has_more = len(records) > db.REPORT_SEARCH_PAGE_SIZE
+    records = records[:db.REPORT_SEARCH_PAGE_SIZE]
+
+    embed = discord.Embed(title=f"🔍 報告の検索結果: {query}", color=discord.Color.blue())
+    if not records:
+        embed.description = "該当する報告はありません。" if page == 1 else "これ以上の結果はありません。"
+        return embed, None
+
+    users = await resolve_users((record['target_user_id'] for record in records), guild)
+    for record in records:
+        target_user = users.get(record['target_user_id'])
+        target_name = target_user.name if target_user else "不明なユーザー"
+        value = f"対象: {target_name} | 緊急度: {record['urgency']} | ステータス: `{record['status']}`\n{record['violated_rule']}"
+        if record['details_snippet']:
+            value += f"\n> {record['details_snippet']}"
+        if record['message_link']:
+            value += f"\n{record['message_link']}"
+        created_at = record['created_at'].strftime("%Y-%m-%d %H:%M") if record['created_at'] else "不明"
+        embed.add_field(name=f"ID: {record['report_id']} ({created_at})", value=value[:1024], inline=False)
+    embed.set_footer(text=f"ページ {page}")
+
+    view = ReportSearchView(query=query, before_report_id=records[-1]['report_id'], page=page) if has_more else None
+    return embed, view
+
+@tree.command(name="search", description="【管理者用】報告の内容（詳細・ルール・リンク）を検索します。")
+@app_commands.describe(query="検索したい言葉（日本語の一部分でも検索できます）")
+@app_commands.checks.has_permissions(administrator=True)
+async def search(interaction: discord.Interaction, query: str):
+    await interaction.response.defer(ephemeral=True)
+    query = query.strip()
+    if not query:
+        await interaction.followup.send("❌ 検索する言葉を入力してください。", ephemeral=True)
+        return
+    try:
+        embed, view = await build_report_search_page(interaction.guild, query)
+        if view:
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+        else:
+            await interaction.followup.send(embed=embed, ephemeral=True)
+    except Exception as e:
+        logging.error(f"/search エラー: {e}", exc_info=True)
+        await interaction.followup.send(f"❌ 報告の検索中にエラーが発生しました: {e}", ephemeral=True)
+
+@search.error
+async def search_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.MissingPermissions):
+        await interaction.response.send_message("このコマンドはサーバーの**管理者のみ**が実行できます。", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"エラーが発生しました: {error}", ephemeral=True)
+
+# ★★★★★★★ 管理者専用：報告データのエクスポート ★★★★★★★
+JST = db.JST
+
+def parse_date(text):
+    """「YYYY-MM-DD」を日本時間のその日の0時として解釈する"""
+    return datetime.datetime.strptime(text.strip(), "%Y-%m-%d").replace(tzinfo=JST)
+
+@tree.command(name="export", description="【管理者用】このサーバーの報告データをファイルで書き出します。")
+@app_commands.describe(
+    format="ファイル形式",
+    since="この日以降の報告（YYYY-MM-DD、任意）",
+    until="この日までの報告（YYYY-MM-DD、任意）",
+    status="ステータスで絞り込み（任意）"
+)
+@app_commands.choices(
+    format=[app_commands.Choice(name="CSV", value="csv"), app_commands.Choice(name="JSON Lines", value="jsonl")],
+    status=[app_commands.Choice(name="未対応", value="未対応"), app_commands.Choice(name="対応中", value="対応中"), app_commands.Choice(name="解決済み", value="解決済み"), app_commands.Choice(name="却下", value="却下"),]
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def export(
+    interaction: discord.Interaction,
+    format: app_commands.Choice[str],
+    since: str = None,
+    until: str = None,
+    status: app_commands.Choice[str] = None
+):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        since_at = parse_date(since) if since else None
+        # until はその日を含めるため、翌日0時より前を対象にする
+        until_at = parse_date(until) + datetime.timedelta(days=1) if until else None
+    except ValueError:
+        await interaction.followup.send("❌ 日付は「2025-01-31」の形式で入力してください。", ephemeral=True)
+        return
+
+    try:
+        async def _send_chunk(filename, fileobj):
+            await interaction.followup.send(file=discord.File(fileobj, filename=filename), ephemeral=True)
+
+        base_filename = f"reports_{interaction.guild.id}_{datetime.datetime.now(JST).strftime('%Y%m%d%H%M')}"
+        rows, files = await report_export.export_records(
+            db.iter_reports(interaction.guild.id, since_at, until_at, status.value if status else None),
+            format.value, db.REPORT_EXPORT_COLUMNS, interaction.guild.filesize_limit,
+            base_filename, _send_chunk
+        )
+        if rows == 0:
+            await interaction.followup.send("該当する報告はありません。", ephemeral=True)
+        else:
+            await interaction.followup.send(f"✅ {rows} 件の報告を {files} 個のファイルに書き出しました。", ephemeral=True)
+        logging.info(f"報告をエクスポート: サーバー={interaction.guild.id}, 件数={rows}, ファイル数={files}")
+
+    except Exception as e:
+        logging.error(f"/export エラー: {e}", exc_info=True)
+        await interaction.followup.send(f"❌ エクスポート中にエラーが発生しました: {e}", ephemeral=True)
+
+@export.error
+async def export_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.MissingPermissions):
+        await interaction.response.send_message("このコマンドはサーバーの**管理者のみ**が実行できます。", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"エラーが発生しました: {error}", ephemeral=True)
+
 # (/kanrinin グループ - 管理者用報告管理コマンド) - 一時的に非表示
 # report_manage_group = app_commands.Group(name="kanrinin", description="報告を管理します。")
 
@@ -904,12 +1953,11 @@ async def whois_error(interaction: discord.Interaction, error: app_commands.AppC
 #         return
 #     embed = discord.Embed(title=f"📜 報告リスト ({filter.name if filter else '最新'})", color=discord.Color.blue())
 #     description = ""
+#     # 対象ユーザーはまとめて解決する（キャッシュにいないユーザーだけ並行して fetch_user）
+#     users = await resolve_users((report['target_user_id'] for report in reports), interaction.guild)
 #     for report in reports:
-#         try:
-#             target_user = await client.fetch_user(report['target_user_id'])
-#             user_name = target_user.name
-#         except discord.NotFound:
-#             user_name = "不明なユーザー"
+#         target_user = users.get(report['target_user_id'])
+#         user_name = target_user.name if target_user else "不明なユーザー"
 #         description += f"**ID: {report['report_id']}** | 対象: {user_name} | ステータス: `{report['status']}`\n"
 #     embed.description = description
 #     await interaction.followup.send(embed=embed, ephemeral=True)
@@ -917,7 +1965,7 @@ async def whois_error(interaction: discord.Interaction, error: app_commands.AppC
 # @report_manage_group.command(name="stats", description="報告の統計情報を表示します。")
 # async def stats(interaction: discord.Interaction):
 #     await interaction.response.defer(ephemeral=True)
-#     stats_data = await db.get_report_stats()
+#     stats_data = await db.get_report_stats(interaction.guild.id)
 #     total = sum(stats_data.values())
 #     embed = discord.Embed(title="📈 報告統計", description=f"総報告数: **{total}** 件", color=discord.Color.purple())
 #     unhandled = stats_data.get('未対応', 0)
@@ -1045,7 +2093,10 @@ def main():
     # tree.add_command(report_manage_group)  # 一時的に非表示
     flask_thread = threading.Thread(target=run_flask)
     flask_thread.start()
-    client.run(TOKEN)
+    fast_runtime.install()  # ACCELERATED_RUNTIME=1 なら uvloop / orjson を使う（イベントループを作る前に行う）
+    # discord.py 自身のログもルートロガー（キュー経由）に流す。既定のハンドラーを付けると
+    # イベントループのスレッドで同期的に書き出され、ルートにも伝わって二重に出力される
+    client.run(TOKEN, log_handler=None)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import weakref
+import resource
+from collections import Counter
+
+import discord
+
+# --- discord.py のキャッシュ設定（メモリ予算） ---
+# MEMORY_PROFILE で、メッセージキャッシュ・メンバーキャッシュ・起動時のメンバー一括取得（チャンク）の組み合わせを選ぶ。
+#   full:     従来どおり。メッセージを最大1000件保持し、起動時に全メンバーを取得してすべてキャッシュする
+#   balanced: メッセージは保持しない。起動時にはメンバーを取得せず、起動後に参加したメンバーだけキャッシュする
+#   lean:     メッセージもメンバーも保持しない。ユーザー検索・/whois は都度 Gateway / REST で問い合わせる
+# このボットはメッセージキャッシュを使わず、メンバーも検索と /whois でしか参照しないので、大きいサーバーでは lean で足りる。
+# 個別の値は DISCORD_MAX_MESSAGES（0 で無効）/ MEMBER_CACHE（all / none）/ CHUNK_GUILDS_AT_STARTUP（1 / 0）で上書きできる。
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "full").lower()
+
+PROFILES = {
+    "full":     {"max_messages": 1000, "member_cache": "all", "chunk_guilds_at_startup": True},
+    "balanced": {"max_messages": 0, "member_cache": "all", "chunk_guilds_at_startup": False},
+    "lean":     {"max_messages": 0, "member_cache": "none", "chunk_guilds_at_startup": False},
+}
+
+
+def client_options(intents, profile=None):
+    """discord.Client に渡すキャッシュ関連の引数を返す"""
+    profile = (profile or MEMORY_PROFILE).lower()
+    if profile not in PROFILES:
+        raise ValueError(f"MEMORY_PROFILE の値が不正です: {profile}（{', '.join(PROFILES)} のいずれか）")
+    settings = dict(PROFILES[profile])
+    if os.getenv("DISCORD_MAX_MESSAGES"):
+        settings["max_messages"] = int(os.getenv("DISCORD_MAX_MESSAGES"))
+    if os.getenv("MEMBER_CACHE"):
+        settings["member_cache"] = os.getenv("MEMBER_CACHE").lower()
+    if os.getenv("CHUNK_GUILDS_AT_STARTUP"):
+        settings["chunk_guilds_at_startup"] = os.getenv("CHUNK_GUILDS_AT_STARTUP") == "1"
+
+    if settings["member_cache"] == "none":
+        member_cache_flags = discord.MemberCacheFlags.none()
+    else:
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    return {
+        # discord.py は 0 以下を既定の1000件として扱うので、無効にするときは None を渡す
+        "max_messages": settings["max_messages"] or None,
+        "member_cache_flags": member_cache_flags,
+        # メンバーをキャッシュしないなら起動時に取得しても捨てるだけ
+        "chunk_guilds_at_startup": settings["chunk_guilds_at_startup"] and member_cache_flags.joined,
+    }
+
+
+def rss_bytes():
+    """現在の常駐メモリ（RSS）。/proc がない環境ではピーク値で代用する"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# ビューストアに登録しない View（メッセージに付ける表示用など）も数えられるよう、作ったときに登録しておく。
+# 弱参照なので、使い終わって解放されれば自然に数から外れる
+_tracked_views = weakref.WeakSet()
+
+
+def track_view(view):
+    """View を live_views() の集計対象にする"""
+    _tracked_views.add(view)
+    return view
+
+
+def live_views(view_store):
+    """メモリ上に残っている View / Modal の数（クラス名ごと）
+
+    ビューストアの中身と track_view() で登録した分だけを数える（ヒープ全体は走査しない）。
+    """
+    views = {id(view): view for view in _tracked_views}
+    for items in view_store._views.values():
+        for item in items.values():
+            if item.view is not None:
+                views[id(item.view)] = item.view
+    for view in (*view_store._synced_message_views.values(), *view_store._modals.values()):
+        views[id(view)] = view
+    return dict(Counter(type(view).__name__ for view in views.values()))
+
+
+def memory_snapshot(client):
+    """キャッシュの件数・RSS・View の数（イベントループのスレッドで呼ぶこと）"""
+    state = client._connection
+    view_store = state._view_store
+    guilds = client.guilds
+    return {
+        "rss_bytes": rss_bytes(),
+        "settings": {
+            "max_messages": state.max_messages,
+            "member_cache_joined": state.member_cache_flags.joined,
+            "chunk_guilds_at_startup": state._chunk_guilds,
+        },
+        "caches": {
+            "guilds": len(guilds),
+            "members": sum(len(guild._members) for guild in guilds),
+            "member_count": sum(guild.member_count or 0 for guild in guilds),
+            "users": len(state._users),
+            "messages": len(state._messages) if state._messages is not None else 0,
+            "private_channels": len(state._private_channels),
+        },
+        "views": {
+            "persistent": len(view_store.persistent_views),
+            "message_bound": len(view_store._synced_message_views),
+            "modals": len(view_store._modals),
+            "live": live_views(view_store),
+        },
+    }
@@ -0,0 +1,89 @@
+import io
+import csv
+import gzip
+import json
+import datetime
+
+# --- 報告データのエクスポート ---
+# 行を1件ずつ gzip 圧縮しながら書き出し、Discordの添付ファイル上限に近づいたら
+# そこまでのファイルを送信して次のファイルに切り替える。
+# メモリに載るのは常に送信前の1ファイル分だけ。
+
+FORMATS = ("csv", "jsonl")
+SIZE_MARGIN = 0.9  # gzip の内部バッファ分の余裕（上限の90%で切り替える）
+
+
+def _to_jsonable(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def serialize_header(fmt, columns):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(columns)
+        return buffer.getvalue().encode("utf-8")
+    return b""
+
+
+def serialize_row(fmt, columns, record):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([_to_jsonable(record[column]) for column in columns])
+        return buffer.getvalue().encode("utf-8")
+    row = {column: _to_jsonable(record[column]) for column in columns}
+    return (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class _Chunk:
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+        self.rows = 0
+
+    def write(self, data):
+        self.gzip.write(data)
+
+    def size(self):
+        return self.buffer.tell()
+
+    def finish(self):
+        self.gzip.close()
+        self.buffer.seek(0)
+        return self.buffer
+
+
+async def export_records(records, fmt, columns, max_bytes, base_filename, send_chunk):
+    """非同期イテレータの行を gzip 圧縮したファイルに分割して send_chunk(filename, fileobj) で送る
+
+    戻り値は (書き出した行数, ファイル数)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"未対応の形式です: {fmt}")
+    limit = int(max_bytes * SIZE_MARGIN)
+    header = serialize_header(fmt, columns)
+    total_rows = 0
+    part = 0
+    chunk = None
+
+    async def _flush():
+        nonlocal part
+        part += 1
+        await send_chunk(f"{base_filename}.part{part}.{fmt}.gz", chunk.finish())
+
+    async for record in records:
+        data = serialize_row(fmt, columns, record)
+        if chunk is not None and chunk.rows and chunk.size() + len(data) > limit:
+            await _flush()
+            chunk = None
+        if chunk is None:
+            chunk = _Chunk()
+            chunk.write(header)
+        chunk.write(data)
+        chunk.rows += 1
+        total_rows += 1
+
+    if chunk is not None:
+        await _flush()
+    return total_rows, part
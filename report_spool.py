@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+
+# --- DB障害中の報告の一時保存（スプール） ---
+# Postgres に繋がらない間に受け付けた報告とクールダウンの記録を、ローカルの SQLite ファイルに
+# 受け付けた順で書いておき、DBが戻ったら同じ順で登録し直す。
+# ファイルはプロセス（コンテナ）ごとに別なので、書いたプロセスが自分で再送する。
+SPOOL_PATH = os.getenv("REPORT_SPOOL_PATH", "report_spool.sqlite3")
+MAX_REPLAY_ATTEMPTS = 5  # DB以外の理由で再送に失敗し続けたものは、この回数で諦めてファイルに残す
+RETRY_BASE_SECONDS = 30  # 再送に失敗したものを次に試すまでの秒数（失敗するたびに倍にする）
+
+
+class ReportSpool:
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = asyncio.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS spool (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    user_id INTEGER,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    retry_at REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(spool)")}
+            if "retry_at" not in columns:
+                # 以前の形式のファイル
+                self._connection.execute("ALTER TABLE spool ADD COLUMN retry_at REAL NOT NULL DEFAULT 0")
+        return self._connection
+
+    async def _run(self, func, *args):
+        """SQLite の操作はイベントループを止めないよう別スレッドで1つずつ行う"""
+        async with self._lock:
+            return await asyncio.to_thread(func, self._connect(), *args)
+
+    async def append(self, kind, payload, user_id=None):
+        """記録を末尾に追加し、その通し番号を返す"""
+        def insert(connection):
+            return connection.execute(
+                "INSERT INTO spool (kind, user_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                (kind, user_id, json.dumps(payload, ensure_ascii=False), time.time())
+            ).lastrowid
+        return await self._run(insert)
+
+    async def pending(self, limit=100):
+        """再送待ちの記録を受け付けた順に (通し番号, 種類, 内容, 受付時刻) で返す（失敗して次の試行を待っているものは除く）"""
+        def select(connection):
+            rows = connection.execute(
+                "SELECT seq, kind, payload, created_at FROM spool WHERE attempts < ? AND retry_at <= ? ORDER BY seq LIMIT ?",
+                (MAX_REPLAY_ATTEMPTS, time.time(), limit)
+            ).fetchall()
+            return [(seq, kind, json.loads(payload), created_at) for seq, kind, payload, created_at in rows]
+        return await self._run(select)
+
+    async def remove(self, seq):
+        await self._run(lambda connection: connection.execute("DELETE FROM spool WHERE seq = ?", (seq,)))
+
+    async def record_failure(self, seq):
+        """再送の失敗を記録し、次に試す時刻を RETRY_BASE_SECONDS × 2^(失敗回数-1) 後にする"""
+        await self._run(lambda connection: connection.execute(
+            "UPDATE spool SET attempts = attempts + 1, retry_at = ? * (1 << attempts) + ? WHERE seq = ?",
+            (RETRY_BASE_SECONDS, time.time(), seq)
+        ))
+
+    async def count(self):
+        def select(connection):
+            return connection.execute("SELECT COUNT(*) FROM spool WHERE attempts < ?", (MAX_REPLAY_ATTEMPTS,)).fetchone()[0]
+        return await self._run(select)
+
+    async def check_report_limits(self, user_id, cooldown_seconds, daily_limit, day_started_at):
+        """DBに繋がらない間のクールダウンと1日の上限の確認（スプールに残っている分だけで判断する）
+
+        問題なければクールダウンの記録を追加する。戻り値は db.check_report_limits と同じ。
+        """
+        def check(connection):
+            now = time.time()
+            last_at, daily_count = connection.execute(
+                "SELECT MAX(created_at), COUNT(*) FILTER (WHERE created_at >= ?) FROM spool WHERE kind = 'cooldown' AND user_id = ?",
+                (day_started_at, user_id)
+            ).fetchone()
+            if last_at is not None and now - last_at < cooldown_seconds:
+                return cooldown_seconds - (now - last_at), False
+            if daily_limit and daily_count >= daily_limit:
+                return 0, True
+            connection.execute(
+                "INSERT INTO spool (kind, user_id, payload, created_at) VALUES ('cooldown', ?, ?, ?)",
+                (user_id, json.dumps({"user_id": user_id}), now)
+            )
+            return 0, False
+        return await self._run(check)
@@ -0,0 +1,91 @@
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+
+# --- Discordへの送信キュー ---
+# チャンネル（ルート）ごとに送信・削除を並べ、Discordのレート制限に当たる前に
+# 自分で間隔を空けて送る。429 を受けてから Retry-After だけ待つ（その間ほかの送信も詰まる）
+# discord.py の後追いの制御に頼らずに済むようにする。
+# 同じルートの中では優先度の高いもの（緊急度「高」の報告など）から先に送る。
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class _Route:
+    """1つのルート（例: あるチャンネルへの送信）の待ち行列と送信履歴"""
+    def __init__(self, limit, per_seconds):
+        self.limit = limit
+        self.per_seconds = per_seconds
+        self.queue = asyncio.PriorityQueue()
+        self.sent_at = deque(maxlen=limit)
+        self.worker = None
+
+    def wait_seconds(self):
+        """次に送ってよいまでの秒数（直近 limit 件が per_seconds 以内なら待つ）"""
+        if len(self.sent_at) < self.limit:
+            return 0
+        return max(0.0, self.sent_at[0] + self.per_seconds - time.monotonic())
+
+
+class SendQueue:
+    """チャンネルごとにレート制限の手前で送信を調整するキュー"""
+    # Discordのメッセージ送信の上限（1チャンネルあたり5秒に5件）に合わせた既定値
+    def __init__(self, limit=5, per_seconds=5.0, idle_seconds=30.0):
+        self.limit = limit
+        self.per_seconds = per_seconds
+        self.idle_seconds = idle_seconds
+        self._routes = {}
+        self._counter = itertools.count()
+
+    def _route(self, key):
+        route = self._routes.get(key)
+        if route is None:
+            route = self._routes[key] = _Route(self.limit, self.per_seconds)
+        if route.worker is None or route.worker.done():
+            route.worker = asyncio.create_task(self._run(key, route))
+        return route
+
+    async def _run(self, key, route):
+        while True:
+            try:
+                _, _, action, future = await asyncio.wait_for(route.queue.get(), timeout=self.idle_seconds)
+            except asyncio.TimeoutError:
+                # しばらく使われていないルートは片付ける（送信履歴は間隔の判断に必要なので空のときだけ）
+                if route.queue.empty() and route.wait_seconds() == 0:
+                    self._routes.pop(key, None)
+                    return
+                continue
+            if future.cancelled():
+                continue
+            delay = route.wait_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            route.sent_at.append(time.monotonic())
+            try:
+                future.set_result(await action())
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+
+    def _submit(self, key, action, priority):
+        future = asyncio.get_running_loop().create_future()
+        self._route(key).queue.put_nowait((priority, next(self._counter), action, future))
+        return future
+
+    async def send(self, channel, *, priority=PRIORITY_NORMAL, **kwargs):
+        """channel.send(**kwargs) をキュー経由で行い、送信したメッセージを返す"""
+        return await self._submit(("send", channel.id), lambda: channel.send(**kwargs), priority)
+
+    async def delete(self, message, *, priority=PRIORITY_LOW):
+        """message.delete() をキュー経由で行う（削除は送信とは別のレート制限）"""
+        return await self._submit(("delete", message.channel.id), message.delete, priority)
+
+    def metrics(self):
+        return {
+            "routes": len(self._routes),
+            "queued": sum(route.queue.qsize() for route in list(self._routes.values())),
+        }
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import logging
+import datetime
+from contextlib import contextmanager
+
+# --- 起動時間プロファイル ---
+# STARTUP_PROFILE=1 のとき、モジュールごとのインポート時間と
+# 起動の節目（Gateway READY / DB準備完了 / 報告ボタン確認完了）までの時間を
+# JSONレポートとして書き出す。計測自体は常に行う（コストはほぼゼロ）。
+# 報告ボタンを確認するのはリーダーだけなので、リーダーに選ばれなかったレプリカは選出の結果が出た時点までを測る。
+ENABLED = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+REPORT_PATH = os.getenv("STARTUP_PROFILE_PATH", "startup_profile.json")
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))  # main.py のインポートにかけてよい時間（ミリ秒）
+
+# レポートを書き出すために必要な節目（リーダー / それ以外のレプリカ）
+MILESTONES = ("gateway_ready", "db_ready", "button_verified")
+FOLLOWER_MILESTONES = ("gateway_ready", "db_ready", "follower_settled")
+
+_started_at = time.perf_counter()
+_import_timings = {}
+_milestones = {}
+_report_written = False
+
+
+def _elapsed_ms(since=None):
+    return round((time.perf_counter() - (since if since is not None else _started_at)) * 1000, 2)
+
+
+@contextmanager
+def timed_import(name):
+    """with ブロック内のインポートにかかった時間を記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _import_timings[name] = _elapsed_ms(start)
+
+
+def import_timings():
+    """モジュール名 -> インポート時間（ミリ秒）"""
+    return dict(_import_timings)
+
+
+def total_import_ms():
+    return round(sum(_import_timings.values()), 2)
+
+
+def mark(milestone):
+    """起動の節目を記録する（同じ節目は最初の1回だけ）"""
+    if milestone in _milestones:
+        return
+    _milestones[milestone] = _elapsed_ms()
+    if ENABLED and any(all(name in _milestones for name in required) for required in (MILESTONES, FOLLOWER_MILESTONES)):
+        write_report()
+
+
+def build_report():
+    total = total_import_ms()
+    return {
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "imports_ms": import_timings(),
+        "total_import_ms": total,
+        "import_budget_ms": IMPORT_BUDGET_MS,
+        "import_over_budget": total > IMPORT_BUDGET_MS,
+        "milestones_ms": dict(_milestones),
+    }
+
+
+def write_report():
+    """計測結果をJSONで保存する（プロセスごとに1回だけ）"""
+    global _report_written
+    if _report_written:
+        return
+    _report_written = True
+    report = build_report()
+    try:
+        with open(REPORT_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        logging.warning(f"起動プロファイルを保存できませんでした: {e}")
+        return
+    logging.info(f"起動プロファイルを保存しました: {REPORT_PATH} (インポート合計 {report['total_import_ms']}ms, 節目 {report['milestones_ms']})")
+    if report["import_over_budget"]:
+        logging.warning(f"インポート時間が予算を超えています: {report['total_import_ms']}ms > {IMPORT_BUDGET_MS}ms")
@@ -0,0 +1,49 @@
+import os
+import importlib
+
+# --- ストレージの切り替え ---
+# BUMP・自己紹介・守護神の各機能が使うDB関数を、STORAGE_BACKEND で選んだモジュールから読み込む。
+#   postgres: database.py（asyncpg + Supabase。複数レプリカ・シャード分割に対応）
+#   sqlite:   storage_sqlite.py（aiosqlite + WALのローカルファイル。1プロセスの小規模運用向け）
+# どちらも INTERFACE にある名前を同じ引数・同じ戻り値の形で提供する。
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+
+BACKENDS = {
+    "postgres": "database",
+    "sqlite": "storage_sqlite",
+}
+
+INTERFACE = (
+    # 共通
+    "DatabaseUnavailable", "LeaderElection", "breaker", "close_pool", "JST",
+    # BUMPくん
+    "init_db", "is_scan_completed", "mark_scan_as_completed",
+    "get_scan_cursor", "start_scan_cursor", "flush_bump_backfill", "reset_scan_cursor",
+    "record_bump", "get_top_users", "get_user_count", "get_total_bumps",
+    "set_reminder", "get_reminder", "clear_reminder",
+    # 自己紹介Bot
+    "init_intro_bot_db", "save_intro", "get_intro_ids", "get_intro_ids_many", "invalidate_intro_cache",
+    # 守護神ボット
+    "init_shugoshin_db", "setup_guild", "get_guild_settings", "prefetch_guild_settings", "invalidate_guild_settings",
+    "claim_report_button", "release_report_button",
+    "check_report_limits", "check_cooldown", "apply_spooled_cooldown", "prune_report_daily_counts",
+    "REPORT_DRAFT_FIELDS", "REPORT_DRAFT_TTL_SECONDS",
+    "save_report_draft", "get_report_draft", "delete_report_draft", "prune_report_drafts",
+    "reserve_report_id", "create_report", "create_or_merge_report", "update_report_message_id", "record_warning_issued",
+    "update_report_status", "update_reports_status", "get_report_events",
+    "count_recent_reports_for_target", "rebuild_report_projection",
+    "REPORT_SEARCH_PAGE_SIZE", "REPORT_EXPORT_COLUMNS",
+    "get_report", "search_reports", "iter_reports", "list_reports", "get_report_stats",
+)
+
+
+def load_backend(name=None):
+    """設定されたストレージのモジュールを読み込んで返す（足りない関数があれば起動時に止める）"""
+    name = (name or STORAGE_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"STORAGE_BACKEND の値が不正です: {name}（{', '.join(BACKENDS)} のいずれか）")
+    backend = importlib.import_module(BACKENDS[name])
+    missing = [attr for attr in INTERFACE if not hasattr(backend, attr)]
+    if missing:
+        raise ImportError(f"ストレージ {name} に必要な関数がありません: {', '.join(missing)}")
+    return backend
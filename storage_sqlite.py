@@ -0,0 +1,728 @@
+import os
+import json
+import asyncio
+import sqlite3
+import datetime
+import logging
+import pathlib
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+# Postgres版と共通の定数・例外（関数の引数や戻り値の形をそろえるため）
+from database import (
+    JST, CircuitBreaker, DatabaseUnavailable, GUILD_SETTINGS_COLUMNS, REPORT_DRAFT_FIELDS,
+    REPORT_DRAFT_TTL_SECONDS, REPORT_EXPORT_COLUMNS, REPORT_SEARCH_PAGE_SIZE,
+    DUPLICATE_REPORT_WINDOW_SECONDS, MERGEABLE_REPORT_STATUSES, URGENCY_LEVELS, urgency_rank, report_fingerprint,
+)
+
+# --- 組み込みSQLite版のストレージ ---
+# Supabase（Postgres）を用意しない小規模な1サーバー運用向け。database.py と同じ関数を同じ引数で提供する。
+# 1つのファイルを WAL モードで開き、1プロセスから使う前提（複数プロセス・シャード分割には Postgres を使う）。
+# 書き込みは1本の接続で順番に行い、読み込みは読み取り専用の別の接続で行う（WAL なので書き込み中も待たずに読める）。
+# 読み込みはローカルファイルなのでキャッシュを挟まずそのまま問い合わせる。
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'shugoshin.sqlite3')
+
+breaker = CircuitBreaker()  # ローカルファイルなので開くことはない（Postgres版との互換用）
+
+
+class Record(sqlite3.Row):
+    """asyncpg.Record と同じく、列名・位置・get() で読める行"""
+    def get(self, key, default=None):
+        return self[key] if key in self.keys() else default
+
+
+# 日時はUTCの固定長の文字列で保存する（文字列のまま大小比較できるように）
+def _adapt_datetime(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f+00:00")
+
+sqlite3.register_adapter(datetime.datetime, _adapt_datetime)
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMPTZ", lambda value: datetime.datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATE", lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_converter("BOOLEAN", lambda value: bool(int(value)))
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+_connection = None
+_read_connection = None  # 読み込み用（コミット済みの行だけが見える）
+_connection_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()  # 書き込みとトランザクションは1つずつ（同じ接続で BEGIN が重ならないように）
+
+async def get_connection():
+    global _connection
+    if _connection is None:
+        async with _connection_lock:
+            if _connection is None:
+                connection = await aiosqlite.connect(
+                    SQLITE_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, isolation_level=None
+                )
+                connection.row_factory = Record
+                await connection.execute("PRAGMA journal_mode=WAL")
+                await connection.execute("PRAGMA synchronous=NORMAL")
+                await connection.execute("PRAGMA busy_timeout=5000")
+                _connection = connection
+    return _connection
+
+async def get_read_connection():
+    global _read_connection
+    if _read_connection is None:
+        await get_connection()  # ファイルの作成と WAL への切り替えは書き込み用の接続で済ませておく
+        async with _connection_lock:
+            if _read_connection is None:
+                connection = await aiosqlite.connect(
+                    pathlib.Path(SQLITE_PATH).absolute().as_uri() + "?mode=ro", uri=True,
+                    detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, isolation_level=None
+                )
+                connection.row_factory = Record
+                await connection.execute("PRAGMA busy_timeout=5000")
+                _read_connection = connection
+    return _read_connection
+
+async def close_pool():
+    """接続を閉じる（Postgres版の close_pool に相当）"""
+    global _connection, _read_connection
+    if _read_connection is not None:
+        await _read_connection.close()
+        _read_connection = None
+    if _connection is not None:
+        await _connection.close()
+        _connection = None
+
+@asynccontextmanager
+async def _transaction():
+    connection = await get_connection()
+    async with _write_lock:
+        await connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            await connection.execute("ROLLBACK")
+            raise
+        await connection.execute("COMMIT")
+
+# トランザクションの外の読み込み（トランザクションの中では _fetch_in / _fetchrow_in で書き込み用の接続を使う）
+async def _fetch(sql, *args):
+    return await _fetch_in(await get_read_connection(), sql, *args)
+
+async def _fetchrow(sql, *args):
+    return await _fetchrow_in(await get_read_connection(), sql, *args)
+
+async def _fetchval(sql, *args):
+    record = await _fetchrow(sql, *args)
+    return record[0] if record else None
+
+async def _execute(sql, *args):
+    async with _transaction() as connection:
+        await connection.execute(sql, args)
+
+async def _fetchrow_in(connection, sql, *args):
+    async with connection.execute(sql, args) as cursor:
+        return await cursor.fetchone()
+
+async def _fetch_in(connection, sql, *args):
+    async with connection.execute(sql, args) as cursor:
+        return await cursor.fetchall()
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+# --- BUMPくん用 ---
+async def init_db():
+    connection = await get_connection()
+    # executescript は開いているトランザクションを COMMIT してしまうので、ほかの書き込みと同じくロックを取って行う
+    async with _write_lock:
+        await connection.executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                bump_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS reminders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id INTEGER NOT NULL,
+                remind_at TIMESTAMPTZ NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            INSERT INTO settings (key, value) VALUES ('scan_completed', 'false') ON CONFLICT (key) DO NOTHING;
+            CREATE TABLE IF NOT EXISTS scan_cursors (
+                channel_id INTEGER PRIMARY KEY,
+                last_message_id INTEGER,
+                stop_message_id INTEGER NOT NULL,
+                scanned_messages INTEGER NOT NULL DEFAULT 0,
+                completed BOOLEAN NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ
+            );
+        ''')
+
+async def is_scan_completed():
+    return await _fetchval("SELECT value FROM settings WHERE key = 'scan_completed'") == 'true'
+
+async def mark_scan_as_completed():
+    await _execute("UPDATE settings SET value = 'true' WHERE key = 'scan_completed'")
+
+async def get_scan_cursor(channel_id):
+    return await _fetchrow(
+        "SELECT last_message_id, stop_message_id, scanned_messages, completed FROM scan_cursors WHERE channel_id = ?",
+        channel_id
+    )
+
+async def start_scan_cursor(channel_id, stop_message_id):
+    await _execute(
+        "INSERT INTO scan_cursors (channel_id, stop_message_id, updated_at) VALUES (?, ?, ?) ON CONFLICT (channel_id) DO NOTHING",
+        channel_id, stop_message_id, _now()
+    )
+    return await get_scan_cursor(channel_id)
+
+async def flush_bump_backfill(channel_id, counts, last_message_id, scanned_messages, completed=False):
+    async with _transaction() as connection:
+        if counts:
+            await connection.executemany('''
+                INSERT INTO users (user_id, bump_count) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET bump_count = bump_count + excluded.bump_count
+            ''', list(counts.items()))
+        await connection.execute('''
+            UPDATE scan_cursors
+            SET last_message_id = ?, scanned_messages = scanned_messages + ?, completed = ?, updated_at = ?
+            WHERE channel_id = ?
+        ''', (last_message_id, scanned_messages, completed, _now(), channel_id))
+
+async def reset_scan_cursor(channel_id):
+    await _execute("DELETE FROM scan_cursors WHERE channel_id = ?", channel_id)
+
+async def record_bump(user_id):
+    async with _transaction() as connection:
+        record = await _fetchrow_in(connection, '''
+            INSERT INTO users (user_id, bump_count) VALUES (?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET bump_count = bump_count + 1
+            RETURNING bump_count
+        ''', user_id)
+    return record[0]
+
+async def get_top_users():
+    return await _fetch('SELECT user_id, bump_count FROM users ORDER BY bump_count DESC LIMIT 5')
+
+async def get_user_count(user_id):
+    return await _fetchval('SELECT bump_count FROM users WHERE user_id = ?', user_id) or 0
+
+async def set_reminder(channel_id, remind_time):
+    async with _transaction() as connection:
+        await connection.execute('DELETE FROM reminders')
+        await connection.execute('INSERT INTO reminders (channel_id, remind_at) VALUES (?, ?)', (channel_id, remind_time))
+
+async def get_reminder():
+    return await _fetchrow('SELECT channel_id, remind_at FROM reminders ORDER BY remind_at LIMIT 1')
+
+async def clear_reminder():
+    await _execute('DELETE FROM reminders')
+
+async def get_total_bumps():
+    return await _fetchval('SELECT SUM(bump_count) FROM users') or 0
+
+
+# --- 自己紹介Bot用 ---
+async def init_intro_bot_db():
+    connection = await get_connection()
+    async with _write_lock:
+        await connection.execute('''
+            CREATE TABLE IF NOT EXISTS introductions (
+                user_id INTEGER PRIMARY KEY,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL
+            )
+        ''')
+
+def invalidate_intro_cache(user_id=None):
+    """キャッシュは持たない（Postgres版との互換用）"""
+
+async def save_intro(user_id, channel_id, message_id):
+    await _execute('''
+        INSERT INTO introductions (user_id, channel_id, message_id) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET channel_id = excluded.channel_id, message_id = excluded.message_id
+    ''', user_id, channel_id, message_id)
+
+async def get_intro_ids(user_id):
+    return await _fetchrow("SELECT channel_id, message_id FROM introductions WHERE user_id = ?", user_id)
+
+async def get_intro_ids_many(user_ids):
+    user_ids = list(dict.fromkeys(user_ids))
+    found = {}
+    # SQLite の変数の上限に当たらないよう区切って問い合わせる
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        for record in await _fetch(
+            f"SELECT user_id, channel_id, message_id FROM introductions WHERE user_id IN ({_placeholders(chunk)})", *chunk
+        ):
+            found[record['user_id']] = record
+    return found
+
+
+# --- 守護神ボット用 ---
+async def init_shugoshin_db():
+    connection = await get_connection()
+    async with _write_lock:
+        await connection.executescript('''
+            CREATE TABLE IF NOT EXISTS reports (
+                report_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, message_id INTEGER,
+                target_user_id INTEGER, violated_rule TEXT, details TEXT,
+                message_link TEXT, urgency TEXT, status TEXT DEFAULT '未対応',
+                created_at TIMESTAMPTZ, channel_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS reports_guild_report_idx ON reports (guild_id, report_id DESC);
+            CREATE TABLE IF NOT EXISTS guild_settings (
+                guild_id INTEGER PRIMARY KEY,
+                report_channel_id INTEGER,
+                urgent_role_id INTEGER,
+                report_button_channel_id INTEGER,
+                warning_channel_id INTEGER,
+                admin_only_channel_id INTEGER,
+                rule_announcement_link TEXT
+            );
+            CREATE TABLE IF NOT EXISTS report_events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                report_id INTEGER NOT NULL,
+                guild_id INTEGER,
+                target_user_id INTEGER,
+                event_type TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                created_at TIMESTAMPTZ
+            );
+            CREATE INDEX IF NOT EXISTS report_events_report_id_idx ON report_events (report_id, event_id);
+            CREATE INDEX IF NOT EXISTS report_events_target_idx ON report_events (guild_id, target_user_id, created_at)
+                WHERE event_type = 'created';
+            CREATE TABLE IF NOT EXISTS report_status_counts (
+                guild_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, status)
+            );
+            CREATE TABLE IF NOT EXISTS report_buttons (
+                guild_id INTEGER PRIMARY KEY,
+                channel_id INTEGER,
+                message_id INTEGER,
+                claimed_by TEXT,
+                claimed_until TIMESTAMPTZ
+            );
+            CREATE TABLE IF NOT EXISTS report_daily_counts (
+                user_id INTEGER NOT NULL,
+                day DATE NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            );
+            CREATE TABLE IF NOT EXISTS report_cooldowns (
+                user_id INTEGER PRIMARY KEY,
+                last_report_at TIMESTAMPTZ NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS report_drafts (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                target_user_id INTEGER,
+                violated_rule TEXT,
+                urgency TEXT,
+                issue_warning BOOLEAN NOT NULL DEFAULT 0,
+                details TEXT,
+                message_link TEXT,
+                updated_at TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (guild_id, user_id)
+            );
+        ''')
+        # 後から追加した列（重複報告の指紋と報告者数）は、既存のファイルにも足す
+        columns = {record['name'] for record in await _fetch_in(connection, "PRAGMA table_info(reports)")}
+        for column, definition in (("fingerprint", "TEXT"), ("reporter_count", "INTEGER NOT NULL DEFAULT 1")):
+            if column not in columns:
+                await connection.execute(f"ALTER TABLE reports ADD COLUMN {column} {definition}")
+        await connection.execute(
+            "CREATE INDEX IF NOT EXISTS reports_fingerprint_idx ON reports (fingerprint, created_at DESC) WHERE fingerprint IS NOT NULL"
+        )
+    needs_rebuild = await _fetchval('''
+        SELECT EXISTS (SELECT 1 FROM reports) AND NOT EXISTS (SELECT 1 FROM report_status_counts)
+    ''')
+    if needs_rebuild:
+        await rebuild_report_projection()
+
+def invalidate_guild_settings(guild_id=None):
+    """キャッシュは持たない（Postgres版との互換用）"""
+
+async def setup_guild(guild_id, report_channel_id, urgent_role_id, report_button_channel_id=None,
+                      warning_channel_id=None, admin_only_channel_id=None, rule_announcement_link=None):
+    await _execute('''
+        INSERT INTO guild_settings (guild_id, report_channel_id, urgent_role_id, report_button_channel_id,
+                                    warning_channel_id, admin_only_channel_id, rule_announcement_link)
+        VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7)
+        ON CONFLICT (guild_id) DO UPDATE
+        SET report_channel_id = ?2, urgent_role_id = ?3,
+            report_button_channel_id = COALESCE(?4, report_button_channel_id),
+            warning_channel_id = COALESCE(?5, warning_channel_id),
+            admin_only_channel_id = COALESCE(?6, admin_only_channel_id),
+            rule_announcement_link = COALESCE(?7, rule_announcement_link)
+    ''', guild_id, report_channel_id, urgent_role_id, report_button_channel_id,
+        warning_channel_id, admin_only_channel_id, rule_announcement_link)
+
+async def get_guild_settings(guild_id):
+    return await _fetchrow(f"SELECT {GUILD_SETTINGS_COLUMNS} FROM guild_settings WHERE guild_id = ?", guild_id)
+
+async def prefetch_guild_settings(guild_ids):
+    guild_ids = list(guild_ids)
+    found = {}
+    for start in range(0, len(guild_ids), 500):
+        chunk = guild_ids[start:start + 500]
+        for record in await _fetch(
+            f"SELECT guild_id, {GUILD_SETTINGS_COLUMNS} FROM guild_settings WHERE guild_id IN ({_placeholders(chunk)})", *chunk
+        ):
+            found[record['guild_id']] = record
+    return found
+
+INSTANCE_ID = f"sqlite:{os.getpid()}"
+
+async def claim_report_button(guild_id, lease_seconds=60):
+    now = _now()
+    async with _transaction() as connection:
+        return await _fetchrow_in(connection, '''
+            INSERT INTO report_buttons (guild_id, claimed_by, claimed_until) VALUES (?1, ?2, ?3)
+            ON CONFLICT (guild_id) DO UPDATE
+            SET claimed_by = ?2, claimed_until = excluded.claimed_until
+            WHERE claimed_until IS NULL OR claimed_until < ?4 OR claimed_by = ?2
+            RETURNING channel_id, message_id
+        ''', guild_id, INSTANCE_ID, now + datetime.timedelta(seconds=lease_seconds), now)
+
+async def release_report_button(guild_id, channel_id=None, message_id=None):
+    await _execute('''
+        UPDATE report_buttons
+        SET channel_id = COALESCE(?3, channel_id), message_id = COALESCE(?4, message_id),
+            claimed_by = NULL, claimed_until = NULL
+        WHERE guild_id = ?1 AND claimed_by = ?2
+    ''', guild_id, INSTANCE_ID, channel_id, message_id)
+
+async def check_report_limits(user_id, cooldown_seconds, daily_limit=0):
+    now = _now()
+    day = now.astimezone(JST).date()
+    async with _transaction() as connection:
+        record = await _fetchrow_in(connection, '''
+            SELECT (SELECT last_report_at FROM report_cooldowns WHERE user_id = ?1) AS "last_report_at [TIMESTAMPTZ]",
+                   (SELECT count FROM report_daily_counts WHERE user_id = ?1 AND day = ?2) AS daily_count
+        ''', user_id, day)
+        if record['last_report_at']:
+            elapsed = (now - record['last_report_at']).total_seconds()
+            if elapsed < cooldown_seconds:
+                return cooldown_seconds - elapsed, False
+        if daily_limit and (record['daily_count'] or 0) >= daily_limit:
+            return 0, True
+        await connection.execute('''
+            INSERT INTO report_cooldowns (user_id, last_report_at) VALUES (?1, ?2)
+            ON CONFLICT (user_id) DO UPDATE SET last_report_at = ?2
+        ''', (user_id, now))
+        await connection.execute('''
+            INSERT INTO report_daily_counts (user_id, day, count) VALUES (?1, ?2, 1)
+            ON CONFLICT (user_id, day) DO UPDATE SET count = count + 1
+        ''', (user_id, day))
+    return 0, False
+
+async def check_cooldown(user_id, cooldown_seconds):
+    remaining, _ = await check_report_limits(user_id, cooldown_seconds)
+    return remaining
+
+async def apply_spooled_cooldown(user_id, reported_at):
+    async with _transaction() as connection:
+        await connection.execute('''
+            INSERT INTO report_cooldowns (user_id, last_report_at) VALUES (?1, ?2)
+            ON CONFLICT (user_id) DO UPDATE SET last_report_at = MAX(last_report_at, ?2)
+        ''', (user_id, reported_at))
+        await connection.execute('''
+            INSERT INTO report_daily_counts (user_id, day, count) VALUES (?1, ?2, 1)
+            ON CONFLICT (user_id, day) DO UPDATE SET count = count + 1
+        ''', (user_id, reported_at.astimezone(JST).date()))
+
+async def prune_report_daily_counts(keep_days=2):
+    cutoff = datetime.datetime.now(JST).date() - datetime.timedelta(days=keep_days)
+    await _execute("DELETE FROM report_daily_counts WHERE day < ?", cutoff)
+
+async def save_report_draft(guild_id, user_id, **values):
+    row = tuple(values.get(field, False if field == "issue_warning" else None) for field in REPORT_DRAFT_FIELDS)
+    await _execute('''
+        INSERT OR REPLACE INTO report_drafts
+            (guild_id, user_id, target_user_id, violated_rule, urgency, issue_warning, details, message_link, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', guild_id, user_id, *row, _now())
+
+async def get_report_draft(guild_id, user_id):
+    record = await _fetchrow(f'''
+        SELECT {", ".join(REPORT_DRAFT_FIELDS)} FROM report_drafts
+        WHERE guild_id = ? AND user_id = ? AND updated_at > ?
+    ''', guild_id, user_id, _now() - datetime.timedelta(seconds=REPORT_DRAFT_TTL_SECONDS))
+    return dict(record) if record else None
+
+async def delete_report_draft(guild_id, user_id):
+    await _execute("DELETE FROM report_drafts WHERE guild_id = ? AND user_id = ?", guild_id, user_id)
+
+async def prune_report_drafts():
+    await _execute(
+        "DELETE FROM report_drafts WHERE updated_at <= ?", _now() - datetime.timedelta(seconds=REPORT_DRAFT_TTL_SECONDS)
+    )
+
+async def _append_report_events(connection, events):
+    if not events:
+        return
+    now = _now()
+    await connection.executemany('''
+        INSERT INTO report_events (report_id, guild_id, target_user_id, event_type, payload, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (report_id, guild_id, target_user_id, event_type, json.dumps(payload, ensure_ascii=False), now)
+        for report_id, guild_id, target_user_id, event_type, payload in events
+    ])
+
+async def _apply_status_counts(connection, deltas):
+    totals = {}
+    for guild_id, status, amount in deltas:
+        if guild_id is not None:
+            totals[(guild_id, status)] = totals.get((guild_id, status), 0) + amount
+    if not totals:
+        return
+    await connection.executemany('''
+        INSERT INTO report_status_counts (guild_id, status, count) VALUES (?, ?, ?)
+        ON CONFLICT (guild_id, status) DO UPDATE SET count = count + excluded.count
+    ''', [(guild_id, status, amount) for (guild_id, status), amount in totals.items()])
+
+async def reserve_report_id():
+    # AUTOINCREMENT の採番表を進めておけば、後から自動採番される報告とIDが重ならない
+    async with _transaction() as connection:
+        record = await _fetchrow_in(connection, "UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = 'reports' RETURNING seq")
+        if record is None:
+            await connection.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('reports', 1)")
+            return 1
+    return record[0]
+
+async def _insert_report(connection, guild_id, target_user_id, violated_rule, details, message_link, urgency,
+                         created_at, fingerprint, report_id=None):
+    record = await _fetchrow_in(connection, '''
+        INSERT INTO reports (report_id, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at, fingerprint)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING report_id, status, reporter_count, message_id, channel_id
+    ''', report_id, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at or _now(), fingerprint)
+    await _append_report_events(connection, [(
+        record['report_id'], guild_id, target_user_id, 'created',
+        {'status': record['status'], 'violated_rule': violated_rule, 'urgency': urgency}
+    )])
+    await _apply_status_counts(connection, [(guild_id, record['status'], 1)])
+    return record
+
+async def create_report(guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at=None,
+                        report_id=None):
+    fingerprint = report_fingerprint(guild_id, target_user_id, violated_rule, message_link)
+    async with _transaction() as connection:
+        record = await _insert_report(
+            connection, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at,
+            fingerprint, report_id
+        )
+    return record['report_id']
+
+# 緊急度の順位（URGENCY_LEVELS の位置。不明な値は最も低い扱い）
+_URGENCY_RANK_SQL = "CASE urgency " + " ".join(
+    f"WHEN '{level}' THEN {rank}" for rank, level in enumerate(URGENCY_LEVELS)
+) + " ELSE 0 END"
+
+async def create_or_merge_report(guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at=None,
+                                 report_id=None, issue_warning=False):
+    fingerprint = report_fingerprint(guild_id, target_user_id, violated_rule, message_link)
+    # 書き込みは1つずつなので、探してから更新するまでの間に同じ報告が割り込むことはない
+    async with _transaction() as connection:
+        if fingerprint:
+            since = (created_at or _now()) - datetime.timedelta(seconds=DUPLICATE_REPORT_WINDOW_SECONDS)
+            record = await _fetchrow_in(connection, f'''
+                UPDATE reports SET reporter_count = reporter_count + 1
+                WHERE report_id = (
+                    SELECT report_id FROM reports
+                    WHERE fingerprint = ? AND status IN ({_placeholders(MERGEABLE_REPORT_STATUSES)}) AND created_at > ?
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )
+                  AND {_URGENCY_RANK_SQL} >= ?
+                  AND (NOT ? OR EXISTS (
+                      SELECT 1 FROM report_events AS e
+                      WHERE e.report_id = reports.report_id AND e.event_type = 'warning_issued'
+                  ))
+                RETURNING report_id, reporter_count, message_id, channel_id
+            ''', fingerprint, *MERGEABLE_REPORT_STATUSES, since, urgency_rank(urgency), bool(issue_warning))
+            if record:
+                await _append_report_events(connection, [(
+                    record['report_id'], guild_id, target_user_id, 'duplicate_merged',
+                    {'reporter_count': record['reporter_count'], 'urgency': urgency, 'details': details}
+                )])
+                return record
+        return await _insert_report(
+            connection, guild_id, target_user_id, violated_rule, details, message_link, urgency, created_at,
+            fingerprint, report_id
+        )
+
+async def update_report_message_id(report_id, message_id, channel_id=None):
+    async with _transaction() as connection:
+        record = await _fetchrow_in(connection, '''
+            UPDATE reports SET message_id = ?, channel_id = COALESCE(?, channel_id) WHERE report_id = ?
+            RETURNING guild_id, target_user_id, channel_id, reporter_count
+        ''', message_id, channel_id, report_id)
+        if record:
+            await _append_report_events(connection, [(
+                report_id, record['guild_id'], record['target_user_id'], 'message_linked',
+                {'message_id': message_id, 'channel_id': record['channel_id']}
+            )])
+    return record['reporter_count'] if record else None
+
+async def record_warning_issued(report_id):
+    async with _transaction() as connection:
+        record = await _fetchrow_in(connection, "SELECT guild_id, target_user_id FROM reports WHERE report_id = ?", report_id)
+        if record:
+            await _append_report_events(connection, [(
+                report_id, record['guild_id'], record['target_user_id'], 'warning_issued', {}
+            )])
+
+async def _change_status(connection, report_ids, new_status, guild_id=None):
+    report_ids = list(report_ids)
+    if not report_ids:
+        return []
+    records = await _fetch_in(connection, f'''
+        SELECT report_id, guild_id, target_user_id, message_id, channel_id, status AS old_status FROM reports
+        WHERE report_id IN ({_placeholders(report_ids)}) AND (? IS NULL OR guild_id = ?)
+    ''', *report_ids, guild_id, guild_id)
+    changed = [record for record in records if record['old_status'] != new_status]
+    await connection.executemany(
+        "UPDATE reports SET status = ? WHERE report_id = ?", [(new_status, record['report_id']) for record in records]
+    )
+    await _append_report_events(connection, [
+        (record['report_id'], record['guild_id'], record['target_user_id'], 'status_changed',
+         {'status': new_status, 'previous_status': record['old_status']})
+        for record in changed
+    ])
+    deltas = []
+    for record in changed:
+        deltas.append((record['guild_id'], record['old_status'], -1))
+        deltas.append((record['guild_id'], new_status, 1))
+    await _apply_status_counts(connection, deltas)
+    return records
+
+async def update_report_status(report_id, new_status):
+    async with _transaction() as connection:
+        await _change_status(connection, [report_id], new_status)
+
+async def update_reports_status(report_ids, new_status, guild_id):
+    async with _transaction() as connection:
+        return await _change_status(connection, report_ids, new_status, guild_id)
+
+async def get_report_events(after_event_id=0, limit=1000):
+    return await _fetch('''
+        SELECT event_id, report_id, guild_id, target_user_id, event_type, payload, created_at
+        FROM report_events WHERE event_id > ? ORDER BY event_id LIMIT ?
+    ''', after_event_id, limit)
+
+async def count_recent_reports_for_target(guild_id, target_user_id, hours=24):
+    return await _fetchval('''
+        SELECT COUNT(*) FROM report_events
+        WHERE event_type = 'created' AND guild_id = ? AND target_user_id = ? AND created_at > ?
+    ''', guild_id, target_user_id, _now() - datetime.timedelta(hours=hours))
+
+async def rebuild_report_projection():
+    async with _transaction() as connection:
+        await connection.execute('''
+            INSERT INTO report_events (report_id, guild_id, target_user_id, event_type, payload, created_at)
+            SELECT r.report_id, r.guild_id, r.target_user_id, 'created',
+                   json_object('status', r.status, 'violated_rule', r.violated_rule, 'urgency', r.urgency),
+                   r.created_at
+            FROM reports r
+            WHERE NOT EXISTS (SELECT 1 FROM report_events e WHERE e.report_id = r.report_id)
+        ''')
+        await connection.execute("DELETE FROM report_status_counts")
+        await connection.execute('''
+            INSERT INTO report_status_counts (guild_id, status, count)
+            SELECT guild_id, status, COUNT(*) FROM (
+                SELECT e.guild_id, json_extract(e.payload, '$.status') AS status
+                FROM report_events e
+                WHERE e.event_id = (
+                    SELECT MAX(event_id) FROM report_events
+                    WHERE report_id = e.report_id AND event_type IN ('created', 'status_changed')
+                )
+            )
+            WHERE guild_id IS NOT NULL AND status IS NOT NULL
+            GROUP BY guild_id, status
+        ''')
+
+async def get_report(report_id):
+    return await _fetchrow("SELECT * FROM reports WHERE report_id = ?", report_id)
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+async def search_reports(guild_id, query, before_report_id=None, limit=REPORT_SEARCH_PAGE_SIZE):
+    """報告の部分一致検索（小規模運用向けなので索引は guild_id + report_id だけを使う）"""
+    return await _fetch('''
+        SELECT report_id, target_user_id, violated_rule, urgency, status, created_at,
+               substr(details, 1, 120) AS details_snippet, message_link
+        FROM reports
+        WHERE guild_id = ?1
+          AND (COALESCE(violated_rule, '') || ' ' || COALESCE(details, '') || ' ' || COALESCE(message_link, '')) LIKE ?2 ESCAPE '\\'
+          AND (?3 IS NULL OR report_id < ?3)
+        ORDER BY report_id DESC
+        LIMIT ?4
+    ''', guild_id, f"%{_escape_like(query)}%", before_report_id, limit)
+
+async def iter_reports(guild_id, since=None, until=None, status=None, batch_size=500):
+    # Postgres と同じく1回分ずつ読み切ってから渡す（読み取りのスナップショットを開いたままにしない）
+    query = f'''
+        SELECT {", ".join(REPORT_EXPORT_COLUMNS)} FROM reports
+        WHERE guild_id = ?1
+          AND (?2 IS NULL OR created_at >= ?2)
+          AND (?3 IS NULL OR created_at < ?3)
+          AND (?4 IS NULL OR status = ?4)
+          AND report_id > ?5
+        ORDER BY report_id
+        LIMIT ?6
+    '''
+    last_report_id = 0
+    while True:
+        records = await _fetch(query, guild_id, since, until, status, last_report_id, batch_size)
+        for record in records:
+            yield record
+        if len(records) < batch_size:
+            return
+        last_report_id = records[-1]['report_id']
+
+async def list_reports(status_filter=None):
+    if status_filter and status_filter != 'all':
+        return await _fetch(
+            "SELECT report_id, target_user_id, status FROM reports WHERE status = ? ORDER BY report_id DESC LIMIT 20", status_filter
+        )
+    return await _fetch("SELECT report_id, target_user_id, status FROM reports ORDER BY report_id DESC LIMIT 20")
+
+async def get_report_stats(guild_id=None):
+    stats = await _fetch('''
+        SELECT status, SUM(count) AS count FROM report_status_counts
+        WHERE ? IS NULL OR guild_id = ?
+        GROUP BY status
+        HAVING SUM(count) <> 0
+    ''', guild_id, guild_id)
+    return {row['status']: row['count'] for row in stats}
+
+
+class LeaderElection:
+    """SQLite版は1プロセスで動かす前提なので、起動したらすぐリーダーになる"""
+    def __init__(self, name, on_elected=None, renew_interval=10, retry_interval=5, on_follower=None):
+        self.name = name
+        self.on_elected = on_elected
+        self.is_leader = False
+        self._leader_event = asyncio.Event()
+
+    async def wait_until_leader(self):
+        await self._leader_event.wait()
+
+    async def run(self):
+        self.is_leader = True
+        self._leader_event.set()
+        logging.info(f"リーダーになりました: {self.name} (SQLite)")
+        if self.on_elected:
+            await self.on_elected()
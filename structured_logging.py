@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import datetime
+import contextvars
+import logging.handlers
+
+# --- ログ出力 ---
+# ログはイベントループのスレッドでは書き出さず、QueueHandler でキューに積むだけにして、
+# 書式化と出力はバックグラウンドのスレッド（QueueListener）で行う。
+# LOG_FORMAT=json のときは1行1レコードのJSONで出力し、処理中のインタラクションIDと
+# インタラクション開始からの経過時間を付ける。
+# 件数の多いINFOログは extra={"sampled": True} を付けておくと LOG_INFO_SAMPLE_RATE の割合だけ残す。
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text / json
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+
+# 処理中のインタラクション（ID, 開始時刻）。タスクごとに別の値になる
+_current_interaction = contextvars.ContextVar("current_interaction", default=None)
+_listener = None
+
+
+def bind_interaction(interaction):
+    """以降このタスクで出すログに、インタラクションIDと経過時間を付ける"""
+    _current_interaction.set((interaction.id, time.monotonic()))
+
+
+class InteractionContextFilter(logging.Filter):
+    """ログを出したタスクのインタラクション情報をレコードに写す（キューに積む前に呼ばれる）"""
+    def filter(self, record):
+        current = _current_interaction.get()
+        if current is not None and not hasattr(record, "interaction_id"):
+            record.interaction_id = current[0]
+            record.elapsed_ms = round((time.monotonic() - current[1]) * 1000, 2)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """sampled=True が付いたINFO以下のログを rate の割合だけ通す"""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not getattr(record, "sampled", False) or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """メッセージを書式化せずにキューへ積む QueueHandler
+
+    標準の QueueHandler は積む前に呼び出し元のスレッドで書式化してしまうので、
+    引数の埋め込みや例外の整形もリスナー側で行うようにする（同じプロセス内のキューなので安全）。
+    """
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行のJSONにする"""
+    EXTRA_FIELDS = ("interaction_id", "elapsed_ms", "duration_ms", "guild_id", "user_id")
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """ルートロガーをキュー経由の出力に切り替える（logging.basicConfig の代わり）"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(InteractionContextFilter())
+    handler.addFilter(SamplingFilter(LOG_INFO_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # 終了時にキューに残ったログを書き出してから止める
+    atexit.register(_listener.stop)
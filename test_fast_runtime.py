@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+高速ランタイムのベンチマーク
+Gatewayのイベント（JSON文字列）を、JSONの読み込み → discord.py のパーサー → イベントの配送まで再生し、
+1イベントあたりのCPU時間を JSON（json / orjson）とイベントループ（asyncio / uvloop）の組み合わせごとに比べる。
+インストールされていないものは飛ばす。JSON は計測の間だけ discord.utils の関数を差し替え、終わったら元に戻す。
+
+  python test_fast_runtime.py                    # 代表的なイベントを作って再生
+  python test_fast_runtime.py gateway.jsonl      # 記録したGatewayのフレーム（1行1フレーム）を再生
+"""
+
+import sys
+import json
+import time
+import asyncio
+import contextlib
+
+import discord
+
+import fast_runtime
+from gateway_fixtures import CHANNEL_ID, GUILD_ID, guild_payload, member_payload
+
+REPLAY_EVENTS = 20000
+DRAIN_EVERY = 100  # この件数ごとにイベントループに制御を返し、配送されたタスクを実行させる
+
+
+def sample_frames(count=REPLAY_EVENTS):
+    """忙しいサーバーで多いイベント（メッセージ・入力中・リアクション・メンバー更新）のフレーム"""
+    frames = []
+    for i in range(count):
+        user = dict(member_payload(10**17 + i % 500)["user"], avatar="a" * 32)
+        member = member_payload(10**17 + i % 500, with_user=False)
+        kind = i % 4
+        if kind == 0:
+            event, data = "MESSAGE_CREATE", {
+                "id": str(2 * 10**17 + i), "channel_id": str(CHANNEL_ID), "guild_id": str(GUILD_ID),
+                "author": user, "member": member, "content": "こんにちは、今日もよろしくお願いします！" * 3,
+                "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+                "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+                "embeds": [], "pinned": False, "type": 0,
+            }
+        elif kind == 1:
+            event, data = "TYPING_START", {
+                "channel_id": str(CHANNEL_ID), "guild_id": str(GUILD_ID), "user_id": user["id"],
+                "timestamp": 1704067200, "member": dict(member, user=user),
+            }
+        elif kind == 2:
+            event, data = "MESSAGE_REACTION_ADD", {
+                "user_id": user["id"], "channel_id": str(CHANNEL_ID), "message_id": str(2 * 10**17 + i - 2),
+                "guild_id": str(GUILD_ID), "emoji": {"id": None, "name": "👍"}, "member": dict(member, user=user),
+            }
+        else:
+            event, data = "GUILD_MEMBER_UPDATE", dict(member, guild_id=str(GUILD_ID), user=user)
+        frames.append(json.dumps({"op": 0, "t": event, "s": i + 1, "d": data}, ensure_ascii=False))
+    return frames
+
+
+@contextlib.contextmanager
+def json_codec(name):
+    """discord.py の JSON の読み書きを一時的に json / orjson にする（orjson がなければ None を返す）"""
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            yield None
+            return
+        decode, encode = orjson.loads, lambda obj: orjson.dumps(obj).decode("utf-8")
+    else:
+        decode, encode = json.loads, lambda obj: json.dumps(obj, separators=(",", ":"), ensure_ascii=True)
+    original = discord.utils._from_json, discord.utils._to_json
+    discord.utils._from_json, discord.utils._to_json = decode, encode
+    try:
+        yield name
+    finally:
+        discord.utils._from_json, discord.utils._to_json = original
+
+
+def load_frames(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_client():
+    intents = discord.Intents.default()
+    intents.members = True
+    client = discord.Client(intents=intents)
+    state = client._connection
+    state._add_guild_from_data(guild_payload(500, large=False))
+
+    # 配送先があるイベントは、実際と同じくリスナーごとにタスクが作られる
+    @client.event
+    async def on_message(message):
+        pass
+
+    @client.event
+    async def on_raw_reaction_add(payload):
+        pass
+
+    return client
+
+
+async def replay(frames):
+    """フレームを読み込み・パース・配送し、1イベントあたりのCPU時間（マイクロ秒）を返す"""
+    client = build_client()
+    client.loop = asyncio.get_running_loop()  # client.run / login を通さないので自分で設定する
+    parsers = client._connection.parsers
+    decode = discord.utils._from_json
+    started = time.process_time()
+    for i, frame in enumerate(frames, 1):
+        message = decode(frame)
+        parser = parsers.get(message["t"])
+        if parser is not None:
+            parser(message["d"])
+        if i % DRAIN_EVERY == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    return (time.process_time() - started) / len(frames) * 1_000_000
+
+
+def run_replay(frames, loop_factory=None):
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(replay(frames))
+
+
+def test_json_codecs_agree():
+    """orjson でも、読み書きの結果が標準の json と同じであること（終わったら元の実装に戻っていること）"""
+    frames = sample_frames(200)
+    original = discord.utils._from_json, discord.utils._to_json
+    with json_codec("json"):
+        expected = [discord.utils._from_json(frame) for frame in frames]
+        encoded = [discord.utils._to_json(message) for message in expected]
+    with json_codec("orjson") as codec:
+        if codec:
+            assert [discord.utils._from_json(frame) for frame in frames] == expected
+            assert [json.loads(discord.utils._to_json(message)) for message in expected] == expected
+            assert [discord.utils._from_json(text) for text in encoded] == expected
+    assert (discord.utils._from_json, discord.utils._to_json) == original
+
+
+if __name__ == "__main__":
+    frames = load_frames(sys.argv[1]) if len(sys.argv) > 1 else sample_frames()
+    test_json_codecs_agree()
+    print("✅ JSONの読み書きの結果は json / orjson で同じです")
+
+    loops = {"asyncio": None}
+    try:
+        import uvloop
+        loops["uvloop"] = uvloop.new_event_loop
+    except ImportError:
+        print("ℹ️  uvloop がインストールされていないため asyncio だけで測ります")
+
+    print(f"⏱️  {len(frames):,}イベントを再生したときの1イベントあたりのCPU時間（µs）")
+    for loop_name, loop_factory in loops.items():
+        for name in ("json", "orjson"):
+            with json_codec(name) as codec:
+                if not codec:
+                    continue
+                run_replay(frames[:1000], loop_factory)  # 初回の準備の分は除く
+                print(f"  - {loop_name:7} + {codec:6}: {run_replay(frames, loop_factory):6.1f}")
+    print(f"ℹ️  このボットが使う JSON: {fast_runtime.runtime_info['json']}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メモリプロファイルの確認とベンチマーク
+MEMORY_PROFILE（full / balanced / lean）ごとに、メンバー数の多いサーバーを1つ読み込んで
+メッセージとインタラクションを流したときの discord.py のキャッシュのメモリ使用量を測る。
+Discordには接続せず、Gatewayから届くのと同じ形のデータを ConnectionState に直接渡す。
+
+  python test_memory_profile.py                  # 1万人・10万人
+  python test_memory_profile.py 50000            # 人数を指定
+"""
+
+import gc
+import sys
+import asyncio
+import tracemalloc
+
+import discord
+from discord.member import Member
+
+import memory_profile
+from gateway_fixtures import CHANNEL_ID, GUILD_ID, FakeGateway, guild_payload, member_payload
+
+MESSAGE_EVENTS = 5000      # 流すメッセージの数（このボットは読まないが、既定ではキャッシュされる）
+ACTIVE_MEMBERS = 1000      # インタラクションを送ってくるメンバーの数
+MEMBER_SEARCHES = 10       # 報告ウィザードのユーザー検索（guild.query_members）の回数
+
+
+def build_client(profile):
+    intents = discord.Intents.default()
+    intents.members = True
+    intents.guilds = True
+    return discord.Client(intents=intents, **memory_profile.client_options(intents, profile))
+
+
+async def load_guild(client, member_count):
+    """GUILD_CREATE を渡す（起動時のメンバー取得をするか・取得したメンバーをキャッシュするかは discord.py が決める）"""
+    state = client._connection
+    state.loop = asyncio.get_running_loop()  # client.run / login を通さないので自分で設定する
+    gateway = FakeGateway(state, member_count)
+    state._get_websocket = gateway
+    state.parse_guild_create(guild_payload(member_count))
+    await gateway.drain()
+    return state._get_guild(GUILD_ID), gateway
+
+
+async def replay_traffic(client, guild):
+    """メッセージ・ユーザー検索・一部のメンバーからのインタラクション相当のデータを流す"""
+    state = client._connection
+    for i in range(MESSAGE_EVENTS):
+        user_id = i % ACTIVE_MEMBERS + 1
+        state.parse_message_create({
+            "id": str(10**17 + i), "channel_id": str(CHANNEL_ID), "guild_id": str(GUILD_ID),
+            "author": member_payload(user_id)["user"], "member": member_payload(user_id, with_user=False),
+            "content": "こんにちは" * 10, "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+            "embeds": [], "pinned": False, "type": 0,
+        })
+    # ユーザー検索はボットと同じく cache=False で問い合わせる（search_member_candidates）
+    for i in range(MEMBER_SEARCHES):
+        await guild.query_members(f"user{i + 1}", limit=100, cache=False)
+    # インタラクションの Member は毎回ペイロードから作られ、キャッシュには入らない
+    for user_id in range(1, ACTIVE_MEMBERS + 1):
+        Member(data=member_payload(user_id), guild=guild, state=state)
+
+
+async def _measure(profile, member_count):
+    gc.collect()
+    tracemalloc.start()
+    client = build_client(profile)
+    guild, gateway = await load_guild(client, member_count)
+    await replay_traffic(client, guild)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    caches = memory_profile.memory_snapshot(client)["caches"]
+    startup_chunked = any(request["query"] == "" for request in gateway.requests)
+    del client, guild, gateway
+    gc.collect()
+    return allocated, caches, startup_chunked
+
+
+def measure(profile, member_count):
+    """プロファイルごとに、増えたメモリ（バイト）・キャッシュの件数・起動時にメンバーを取得したかを返す"""
+    return asyncio.run(_measure(profile, member_count))
+
+
+def test_lean_profile_keeps_no_members_or_messages():
+    """lean では起動時にメンバーを取得せず、検索で届いたメンバーもメッセージもキャッシュに残らないこと"""
+    _, caches, startup_chunked = measure("lean", 10000)
+    assert not startup_chunked
+    assert caches["members"] == 0 and caches["messages"] == 0
+
+
+def test_full_profile_keeps_all_members():
+    """full（従来どおり）では起動時に全メンバーを取得し、全メンバーとメッセージがキャッシュに残ること"""
+    _, caches, startup_chunked = measure("full", 10000)
+    assert startup_chunked
+    assert caches["members"] == 10000 and caches["messages"] == 1000
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    test_lean_profile_keeps_no_members_or_messages()
+    test_full_profile_keeps_all_members()
+    print("✅ プロファイルごとのキャッシュ設定が反映されています")
+    for member_count in counts:
+        print(f"📦 メンバー {member_count:,}人（メッセージ {MESSAGE_EVENTS}件・アクティブ {ACTIVE_MEMBERS}人）")
+        for profile in memory_profile.PROFILES:
+            allocated, caches, _ = measure(profile, member_count)
+            print(f"  - {profile:8}: {allocated / 1024 / 1024:7.1f} MB "
+                  f"（メンバー {caches['members']:,} / ユーザー {caches['users']:,} / メッセージ {caches['messages']:,}）")
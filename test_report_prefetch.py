@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ボタン式報告の送信時間のベンチマーク
+DB（1クエリ DB_LATENCY）と Discord の REST（1リクエスト REST_LATENCY）を待ち時間だけの偽物に差し替え、
+「送信する」ボタンを押してから処理が終わるまでの時間を、従来の順番どおりの処理・先読みなし・先読みありで比べる。
+DBにもDiscordにも接続しないので、このままどこでも実行できる。
+
+  python test_report_prefetch.py
+  python test_report_prefetch.py 0.005 0.08    # DB と REST の待ち時間（秒）を指定
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import functools
+import contextlib
+import statistics
+
+main = None  # load_main() で読み込む（pytest の収集だけではボットを作らない）
+
+DB_LATENCY = 0.02
+REST_LATENCY = 0.1
+THINK_TIME = 0.3   # 最終確認を読んでから「送信する」を押すまでの時間
+ROUNDS = 10
+GUILD_ID = 1300291307314610316
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = GUILD_ID
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        return self.channels.setdefault(channel_id, FakeChannel(channel_id))
+
+
+class FakeResponse:
+    async def defer(self, ephemeral=False):
+        await asyncio.sleep(REST_LATENCY)
+
+    def is_done(self):
+        return True
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content, ephemeral=False):
+        await asyncio.sleep(REST_LATENCY)
+        self.sent.append(content)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeInteraction:
+    def __init__(self, guild, user_id):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = FakeUser(user_id)
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+class FakeStorage:
+    """報告の登録に使うDB関数の偽物（呼び出しは記録し、1回ごとに DB_LATENCY 待つ）"""
+
+    def __init__(self):
+        self.drafts = {}
+        self.next_id = 1
+        self.created = []
+        self.merge = False
+        self.reserve_failures = 0  # この回数だけ reserve_report_id を失敗させる
+
+    async def _query(self):
+        await asyncio.sleep(DB_LATENCY)
+
+    async def get_report_draft(self, guild_id, user_id):
+        await self._query()
+        return self.drafts.get((guild_id, user_id))
+
+    async def delete_report_draft(self, guild_id, user_id):
+        await self._query()
+        self.drafts.pop((guild_id, user_id), None)
+
+    async def get_guild_settings(self, guild_id):
+        return None  # 実際はキャッシュから返るので待たない
+
+    async def reserve_report_id(self):
+        await self._query()
+        if self.reserve_failures:
+            self.reserve_failures -= 1
+            raise RuntimeError("採番に失敗")
+        report_id, self.next_id = self.next_id, self.next_id + 1
+        return report_id
+
+    async def create_or_merge_report(self, guild_id, target_user_id, violated_rule, details, message_link, urgency,
+                                     created_at=None, report_id=None, issue_warning=False):
+        await self._query()
+        if report_id is None:
+            report_id = await self.reserve_report_id()
+        self.created.append(report_id)
+        return {"report_id": report_id, "status": "未対応", "reporter_count": 2 if self.merge else 1,
+                "message_id": 1, "channel_id": 1}
+
+    async def update_report_message_id(self, report_id, message_id, channel_id):
+        await self._query()
+
+    async def record_warning_issued(self, report_id):
+        await self._query()
+
+
+class FakeSendQueue:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, channel, content=None, embed=None, priority=None):
+        await asyncio.sleep(REST_LATENCY)
+        self.sent.append(embed.title)
+        return FakeMessage(len(self.sent), channel)
+
+
+async def fake_refresh_report_button(guild):
+    # 設定の取得・古いボタンの削除・新しいボタンの送信
+    await asyncio.sleep(REST_LATENCY * 2)
+
+
+async def fake_show_reporter_count(guild, record):
+    await asyncio.sleep(REST_LATENCY * 2)
+
+
+DB_FUNCTIONS = ("get_report_draft", "delete_report_draft", "get_guild_settings", "reserve_report_id",
+                "create_or_merge_report", "update_report_message_id", "record_warning_issued")
+
+
+def load_main():
+    global main
+    if main is None:
+        import main
+    return main
+
+
+@contextlib.contextmanager
+def fake_backend():
+    """DB関数・送信キュー・報告ボタンの移動を偽物に差し替える（抜けるときに元に戻す）"""
+    load_main()
+    storage = FakeStorage()
+    patches = {(main.db, name): getattr(storage, name) for name in DB_FUNCTIONS}
+    patches[(main, "send_queue")] = FakeSendQueue()
+    patches[(main, "refresh_report_button")] = fake_refresh_report_button
+    patches[(main, "show_reporter_count")] = fake_show_reporter_count
+    originals = {target: getattr(*target) for target in patches}
+    for (obj, name), value in patches.items():
+        setattr(obj, name, value)
+    try:
+        yield storage
+    finally:
+        for (obj, name), value in originals.items():
+            setattr(obj, name, value)
+        main._report_prefetch.clear()
+
+
+def run_async(test):
+    """async のテストを pytest からも呼べる同期関数にする"""
+    @functools.wraps(test)
+    def wrapper():
+        asyncio.run(test())
+    return wrapper
+
+
+def save_draft(storage, user_id, issue_warning=False, details="荒らし行為を繰り返しています"):
+    values = {"target_user_id": 10**17 + user_id, "violated_rule": "ルール1", "urgency": "中",
+              "issue_warning": issue_warning, "details": details,
+              "message_link": f"https://discord.com/channels/{GUILD_ID}/1/{user_id}"}
+    storage.drafts[(GUILD_ID, user_id)] = values
+    return main.ReportData(GUILD_ID, user_id, **values)
+
+
+async def serial_submit(interaction):
+    """先読みを入れる前の送信処理（1つずつ順番に待つ）"""
+    await interaction.response.defer(ephemeral=True)
+    report_data = await main.load_report_draft(interaction)
+    config = await main.get_report_config(interaction.guild.id)
+    report_channel = main.report_destination(interaction.guild, config, report_data.issue_warning)
+    record = await main.db.create_or_merge_report(
+        interaction.guild.id, report_data.target_user_id, report_data.violated_rule,
+        report_data.details, report_data.message_link, report_data.urgency
+    )
+    await report_data.discard()
+    await main.post_button_report(report_channel, config, record['report_id'], report_data)
+    await interaction.followup.send("✅", ephemeral=True)
+    await main.refresh_report_button(interaction.guild)
+
+
+@run_async
+async def test_prefetched_report_is_used():
+    """先読みした報告IDと埋め込みがそのまま登録・送信に使われること"""
+    with fake_backend() as storage:
+        guild = FakeGuild()
+        main.prefetch_button_report(guild, save_draft(storage, 1))
+        await asyncio.sleep(DB_LATENCY * 3)
+        interaction = FakeInteraction(guild, 1)
+        await main.submit_button_report(interaction)
+        assert storage.created == [1]
+        assert main.send_queue.sent == ["⚠️ 新規の匿名報告 (ID: 1)"]
+        assert (GUILD_ID, 1) not in storage.drafts
+        assert interaction.followup.sent[-1].startswith("✅ 報告を送信しました")
+        assert not main._report_prefetch
+
+
+@run_async
+async def test_changed_draft_is_rerendered():
+    """先読みの後に内容が変わったら、採番済みのIDのまま作り直すこと"""
+    with fake_backend() as storage:
+        guild = FakeGuild()
+        main.prefetch_button_report(guild, save_draft(storage, 2))
+        await asyncio.sleep(DB_LATENCY * 3)
+        save_draft(storage, 2, issue_warning=True, details="別の内容")
+        await main.submit_button_report(FakeInteraction(guild, 2))
+        assert storage.created == [1]
+        assert main.send_queue.sent == ["⚠️ 新規の匿名報告 (ID: 1)"]
+        assert list(guild.channels) == [main.ADMIN_ONLY_CHANNEL_ID, main.WARNING_CHANNEL_ID]
+
+
+@run_async
+async def test_failed_prefetch_falls_back():
+    """先読みが失敗しても、送信時にその場で用意して送れること"""
+    with fake_backend() as storage:
+        storage.reserve_failures = 1
+        guild = FakeGuild()
+        main.prefetch_button_report(guild, save_draft(storage, 4))
+        await asyncio.sleep(DB_LATENCY * 3)
+        interaction = FakeInteraction(guild, 4)
+        await main.submit_button_report(interaction)
+        assert storage.created == [1]
+        assert interaction.followup.sent[-1].startswith("✅ 報告を送信しました")
+
+
+@run_async
+async def test_merged_report_is_not_sent():
+    """既存の報告にまとめられたら、先読みした埋め込みは送らないこと"""
+    with fake_backend() as storage:
+        storage.merge = True
+        guild = FakeGuild()
+        main.prefetch_button_report(guild, save_draft(storage, 3))
+        interaction = FakeInteraction(guild, 3)
+        await main.submit_button_report(interaction)
+        assert main.send_queue.sent == []
+        assert interaction.followup.sent == [main.DUPLICATE_REPORT_MESSAGE]
+
+
+async def measure(path, user_id):
+    with fake_backend() as storage:
+        guild = FakeGuild()
+        report_data = save_draft(storage, user_id)
+        if path == "prefetched":
+            main.prefetch_button_report(guild, report_data)
+            await asyncio.sleep(THINK_TIME)
+        interaction = FakeInteraction(guild, user_id)
+        started = time.perf_counter()
+        if path == "before":
+            await serial_submit(interaction)
+        else:
+            await main.submit_button_report(interaction)
+        return (time.perf_counter() - started) * 1000
+
+
+async def benchmark():
+    print(f"⏱️  「送信する」を押してから完了までの時間（DB {DB_LATENCY * 1000:.0f}ms / REST {REST_LATENCY * 1000:.0f}ms, {ROUNDS}回の中央値）")
+    for path, label in (("before", "従来（順番どおり）"), ("serial", "先読みなし"), ("prefetched", "先読みあり")):
+        samples = [await measure(path, 100 + i) for i in range(ROUNDS)]
+        print(f"  - {label}: {statistics.median(samples):6.1f}ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        DB_LATENCY = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        REST_LATENCY = float(sys.argv[2])
+    load_main()
+    logging.getLogger().setLevel(logging.WARNING)  # 送信ごとの計測ログは表示しない
+    for test in (test_prefetched_report_is_used, test_changed_draft_is_rerendered, test_failed_prefetch_falls_back,
+                 test_merged_report_is_not_sent):
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+        except AssertionError as e:
+            print(f"❌ {test.__doc__}: {e}")
+    asyncio.run(benchmark())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+起動時間の予算チェック
+main.py のインポートにかかる時間が STARTUP_IMPORT_BUDGET_MS を超えていないか確認する
+（重いインポートが少しずつ増えていくのを防ぐための回帰テスト）
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import startup_profile
+
+# 別プロセスで main.py をインポートし、計測結果をJSONで受け取る
+PROBE = (
+    "import json, sys, time; t = time.perf_counter(); import main, startup_profile; "
+    "print(json.dumps({'wall_ms': (time.perf_counter() - t) * 1000, "
+    "'imports_ms': startup_profile.import_timings(), "
+    "'flask_loaded': 'flask' in sys.modules}))"
+)
+
+
+def measure_import():
+    """新しいインタプリタで main.py をインポートしたときの時間を測る"""
+    env = dict(os.environ, STARTUP_PROFILE="0")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_budget():
+    """main.py のインポートが予算内に収まっていること"""
+    measured = measure_import()
+    budget = startup_profile.IMPORT_BUDGET_MS
+    assert measured["wall_ms"] <= budget, (
+        f"main.py のインポートに {measured['wall_ms']:.0f}ms かかりました（予算 {budget:.0f}ms）: {measured['imports_ms']}"
+    )
+    # Flask はWebサーバースレッドで遅延インポートするため、ここでは読み込まれないこと
+    # （計測対象の一覧ではなく、子プロセスの sys.modules で確かめる）
+    assert not measured["flask_loaded"], "main.py のインポート時に flask が読み込まれています"
+
+
+if __name__ == "__main__":
+    measured = measure_import()
+    print(f"⏱️  main.py のインポート時間: {measured['wall_ms']:.0f}ms（予算 {startup_profile.IMPORT_BUDGET_MS:.0f}ms）")
+    for name, ms in sorted(measured["imports_ms"].items(), key=lambda x: -x[1]):
+        print(f"  - {name}: {ms}ms")
+    try:
+        test_import_budget()
+        print("✅ 起動時間は予算内です")
+    except AssertionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
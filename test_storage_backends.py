@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ストレージの適合テストとベンチマーク
+storage.INTERFACE の関数を、選んだストレージ（postgres / sqlite）それぞれに同じ手順で実行し、
+結果が同じになること（適合）と、操作ごとの所要時間（ベンチマーク）を確認する。
+
+  python test_storage_backends.py                 # sqlite（一時ファイル）と、DATABASE_URL があれば postgres
+  python test_storage_backends.py sqlite          # 指定したものだけ
+  STORAGE_BENCH_ROUNDS=1000 python test_storage_backends.py
+  python -m pytest test_storage_backends.py       # 適合テストだけ（postgres は DATABASE_URL があるときだけ）
+
+postgres では過去データの一括取り込み（import_history.py）も、各種類を1回ずつと同じファイルの2回目を試す。
+
+postgres はローカル開発用のDBに対して実行すること（実行ごとに別のIDでテスト用の行を書き込む）。
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import datetime
+import tempfile
+import statistics
+
+import storage
+
+BENCH_ROUNDS = int(os.getenv("STORAGE_BENCH_ROUNDS", "200"))
+
+
+def unique_id():
+    """実行ごとに重ならないID（Discordのスノーフレークと同じくらいの大きさ）"""
+    return 900_000_000_000_000_000 + time.time_ns() % 10**17
+
+
+async def check_conformance(db):
+    """どのストレージでも同じ結果になるべき振る舞い"""
+    guild_id, user_id, target_id = unique_id(), unique_id() + 1, unique_id() + 2
+    await db.init_db()
+    await db.init_intro_bot_db()
+    await db.init_shugoshin_db()
+
+    # BUMP
+    total_before = await db.get_total_bumps()
+    assert await db.record_bump(user_id) == 1
+    assert await db.record_bump(user_id) == 2
+    assert await db.get_user_count(user_id) == 2
+    assert await db.get_user_count(user_id + 100) == 0
+    assert await db.get_total_bumps() == total_before + 2
+    channel_id = unique_id()
+    cursor = await db.start_scan_cursor(channel_id, 12345)
+    assert cursor['last_message_id'] is None and cursor['stop_message_id'] == 12345 and not cursor['completed']
+    await db.flush_bump_backfill(channel_id, {user_id: 3}, 999, 100, completed=True)
+    cursor = await db.get_scan_cursor(channel_id)
+    assert cursor['last_message_id'] == 999 and cursor['scanned_messages'] == 100 and cursor['completed']
+    assert await db.get_user_count(user_id) == 5
+    await db.reset_scan_cursor(channel_id)
+    assert await db.get_scan_cursor(channel_id) is None
+    remind_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=2)
+    await db.set_reminder(channel_id, remind_at)
+    reminder = await db.get_reminder()
+    assert reminder['channel_id'] == channel_id and abs((reminder['remind_at'] - remind_at).total_seconds()) < 0.001
+    await db.clear_reminder()
+    assert await db.get_reminder() is None
+
+    # 自己紹介
+    await db.save_intro(user_id, 10, 20)
+    await db.save_intro(user_id, 11, 21)
+    # get_intro_ids はチャンネルIDとメッセージIDの2つだけ（展開して使う呼び出し側があるため）
+    assert tuple(await db.get_intro_ids(user_id)) == (11, 21)
+    found = await db.get_intro_ids_many([user_id, user_id + 100])
+    assert list(found) == [user_id] and found[user_id]['message_id'] == 21
+    assert await db.get_intro_ids(user_id + 100) is None
+
+    # サーバー設定・報告ボタン
+    await db.setup_guild(guild_id, 1, 2, report_button_channel_id=3)
+    await db.setup_guild(guild_id, 4, 5)
+    db.invalidate_guild_settings(guild_id)
+    settings = await db.get_guild_settings(guild_id)
+    assert (settings['report_channel_id'], settings['urgent_role_id'], settings['report_button_channel_id']) == (4, 5, 3)
+    assert guild_id in await db.prefetch_guild_settings([guild_id, guild_id + 100])
+    assert await db.claim_report_button(guild_id) is not None
+    await db.release_report_button(guild_id, channel_id=6, message_id=7)
+    button = await db.claim_report_button(guild_id)
+    assert (button['channel_id'], button['message_id']) == (6, 7)
+    await db.release_report_button(guild_id)
+
+    # クールダウン・1日の上限
+    assert await db.check_report_limits(user_id, 0, daily_limit=2) == (0, False)
+    assert await db.check_report_limits(user_id, 0, daily_limit=2) == (0, False)
+    assert await db.check_report_limits(user_id, 0, daily_limit=2) == (0, True)
+    remaining, _ = await db.check_report_limits(user_id + 1, 60)
+    assert remaining == 0
+    remaining, _ = await db.check_report_limits(user_id + 1, 60)
+    assert 0 < remaining <= 60
+
+    # 報告ウィザードの途中経過
+    await db.save_report_draft(guild_id, user_id, target_user_id=target_id, violated_rule="ルール1", issue_warning=True)
+    draft = await db.get_report_draft(guild_id, user_id)
+    assert set(draft) == set(db.REPORT_DRAFT_FIELDS)
+    assert draft['target_user_id'] == target_id and draft['issue_warning'] is True and draft['details'] is None
+    await db.delete_report_draft(guild_id, user_id)
+    assert await db.get_report_draft(guild_id, user_id) is None
+
+    # 報告
+    first = await db.create_report(guild_id, target_id, "ルール1", "100% 荒らし_です", None, "高")
+    second = await db.create_report(guild_id, target_id, "ルール2", "スパム", "https://discord.com/x", "低")
+    assert second > first
+    assert await db.update_report_message_id(first, 777, channel_id=888) == 1
+    await db.record_warning_issued(first)
+    report = await db.get_report(first)
+    assert report['status'] == '未対応' and report['message_id'] == 777 and report['channel_id'] == 888
+    assert report['created_at'].tzinfo is not None
+    assert await db.count_recent_reports_for_target(guild_id, target_id) == 2
+    assert await db.get_report_stats(guild_id) == {'未対応': 2}
+
+    await db.update_report_status(first, '対応中')
+    changed = await db.update_reports_status([first, second], '却下', guild_id)
+    assert sorted(record['old_status'] for record in changed) == ['対応中', '未対応']
+    assert await db.update_reports_status([first], '解決済み', guild_id + 100) == []
+    # 0件になったステータスは含めない（集計を作り直した後と同じ形）
+    assert await db.get_report_stats(guild_id) == {'却下': 2}
+
+    # 検索（LIKE のワイルドカードは文字として扱う）・続きの取得
+    assert [r['report_id'] for r in await db.search_reports(guild_id, "100%")] == [first]
+    assert [r['report_id'] for r in await db.search_reports(guild_id, "荒らし_")] == [first]
+    assert await db.search_reports(guild_id, "50%") == []
+    assert [r['report_id'] for r in await db.search_reports(guild_id, "discord.com")] == [second]
+    page = await db.search_reports(guild_id, "ルール", limit=1)
+    assert [r['report_id'] for r in page] == [second]
+    page = await db.search_reports(guild_id, "ルール", before_report_id=second, limit=1)
+    assert [r['report_id'] for r in page] == [first]
+
+    exported = [record async for record in db.iter_reports(guild_id, batch_size=1)]
+    assert [r['report_id'] for r in exported] == [first, second]
+    assert tuple(exported[0].keys()) == tuple(db.REPORT_EXPORT_COLUMNS)
+    assert [r async for r in db.iter_reports(guild_id, status='未対応')] == []
+
+    # イベントログから集計を作り直しても同じ件数になる
+    events = await db.get_report_events()
+    assert {'created', 'message_linked', 'warning_issued', 'status_changed'} <= {e['event_type'] for e in events}
+    await db.rebuild_report_projection()
+    assert await db.get_report_stats(guild_id) == {'却下': 2}
+
+    # 重複報告のまとめ（同じ対象・ルール・メッセージリンクの未解決の報告があれば1件にまとめる）
+    other_guild_id = guild_id + 1
+    link = f"https://discord.com/channels/{other_guild_id}/1/{unique_id()}"
+    original = await db.create_or_merge_report(other_guild_id, target_id, "ルール1", "1人目", link, "中")
+    assert original['reporter_count'] == 1
+    merged = await db.create_or_merge_report(
+        other_guild_id, target_id, "ルール1", "2人目", link.replace("://discord.com/", "://ptb.discord.com/"), "低"
+    )
+    assert merged['report_id'] == original['report_id'] and merged['reporter_count'] == 2
+    assert (await db.get_report(original['report_id']))['details'] == "1人目"
+    # 元の報告の送信中にまとめられた分は、メッセージを記録するときの報告者数に含まれる
+    assert await db.update_report_message_id(original['report_id'], unique_id(), channel_id=1) == 2
+    assert (await db.create_or_merge_report(other_guild_id, target_id, "ルール2", None, link, "低"))['reporter_count'] == 1
+    assert (await db.create_or_merge_report(other_guild_id, target_id, "ルール1", None, None, "低"))['reporter_count'] == 1
+    assert (await db.create_or_merge_report(other_guild_id, target_id, "ルール1", None, None, "低"))['reporter_count'] == 1
+    await db.update_report_status(original['report_id'], '解決済み')
+    reopened = await db.create_or_merge_report(other_guild_id, target_id, "ルール1", "3人目", link, "低")
+    assert reopened['report_id'] != original['report_id'] and reopened['reporter_count'] == 1
+    assert await db.get_report_stats(other_guild_id) == {'未対応': 4, '解決済み': 1}
+
+    # 新しい報告の方が重い（緊急度が高い・まだ発行していない警告を求める）ときはまとめない
+    link = f"https://discord.com/channels/{other_guild_id}/1/{unique_id()}"
+    base = await db.create_or_merge_report(other_guild_id, target_id, "ルール1", None, link, "中")
+    urgent = await db.create_or_merge_report(other_guild_id, target_id, "ルール1", None, link, "高")
+    assert urgent['report_id'] != base['report_id'] and urgent['reporter_count'] == 1
+    warned = await db.create_or_merge_report(other_guild_id, target_id, "ルール1", None, link, "低", issue_warning=True)
+    assert warned['report_id'] != urgent['report_id'] and warned['reporter_count'] == 1
+    await db.record_warning_issued(warned['report_id'])
+    again = await db.create_or_merge_report(other_guild_id, target_id, "ルール1", None, link, "低", issue_warning=True)
+    assert again['report_id'] == warned['report_id'] and again['reporter_count'] == 2
+
+    # 先に採番したIDで登録でき、その後の自動採番と重ならない
+    reserved = await db.reserve_report_id()
+    assert reserved > reopened['report_id']
+    later = await db.create_report(other_guild_id, target_id, "ルール3", None, None, "低")
+    assert await db.create_report(other_guild_id, target_id, "ルール3", None, None, "低", report_id=reserved) == reserved
+    assert later > reserved
+    record = await db.create_or_merge_report(other_guild_id, target_id, "ルール3", None, link, "低",
+                                             report_id=await db.reserve_report_id())
+    assert record['report_id'] > later and (await db.get_report(record['report_id']))['violated_rule'] == "ルール3"
+
+
+async def check_import_history(db, directory):
+    """過去データの一括取り込み（postgres のみ）：各種類を取り込み、同じファイルをもう一度取り込んでも何も変わらないこと"""
+    import import_history
+    guild_id, user_id = unique_id(), unique_id() + 1
+    first_id = await db.reserve_report_id() + 1000
+    created_at = "2024-05-01T12:00:00+09:00"
+    files = {
+        'reports': ("reports.csv", [
+            {'report_id': first_id, 'guild_id': guild_id, 'target_user_id': user_id, 'violated_rule': "ルール1",
+             'details': "IDあり", 'urgency': "高", 'status': "解決済み", 'created_at': created_at},
+            {'report_id': first_id + 1, 'guild_id': guild_id, 'target_user_id': user_id, 'violated_rule': "ルール2",
+             'details': "IDあり", 'urgency': "低", 'created_at': created_at},
+            # report_id がない行は新しいIDを振る（2回目は日時・対象・ルールが同じ報告があるので取り込まない）
+            {'guild_id': guild_id, 'target_user_id': user_id, 'violated_rule': "ルール3", 'details': "IDなし",
+             'urgency': "中", 'created_at': created_at},
+            # report_id も created_at もない行は、同じ報告か見分けられないので取り込まない
+            {'guild_id': guild_id, 'target_user_id': user_id, 'violated_rule': "ルール4", 'urgency': "中"},
+        ]),
+        'users': ("users.jsonl", [
+            {'user_id': user_id, 'bump_count': 3}, {'user_id': user_id, 'bump_count': 4},
+            {'user_id': user_id + 1, 'bump_count': 1},
+        ]),
+        'introductions': ("introductions.jsonl", [
+            {'user_id': user_id, 'channel_id': 10, 'message_id': 20},
+            {'user_id': user_id, 'channel_id': 11, 'message_id': 21},
+        ]),
+    }
+    paths = {}
+    for kind, (filename, rows) in files.items():
+        paths[kind] = path = os.path.join(directory, filename)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if filename.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=db.IMPORT_SPECS[kind]['columns'])
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(row) + "\n" for row in rows)
+
+    async def snapshot():
+        exported = [dict(record) async for record in db.iter_reports(guild_id)]
+        events = [(e['report_id'], e['event_type']) for e in await db.get_report_events()
+                  if e['report_id'] in {r['report_id'] for r in exported}]
+        return (exported, sorted(events), await db.get_report_stats(guild_id),
+                await db.get_user_count(user_id), await db.get_user_count(user_id + 1),
+                tuple(await db.get_intro_ids(user_id)))
+
+    expected = {'reports': (4, 3), 'users': (3, 2), 'introductions': (2, 1)}
+    for kind, path in paths.items():
+        assert await import_history.import_history(kind, path, batch_size=2) == expected[kind], kind
+    before = await snapshot()
+    exported, _, stats, bumps, other_bumps, intro = before
+    assert [r['report_id'] for r in exported][:2] == [first_id, first_id + 1] and len(exported) == 3
+    assert exported[2]['report_id'] > first_id + 1 and exported[1]['status'] == '未対応'
+    assert stats == {'解決済み': 1, '未対応': 2}
+    assert (bumps, other_bumps, intro) == (7, 1, (11, 21))
+
+    for kind, path in paths.items():
+        loaded, merged = await import_history.import_history(kind, path, batch_size=2)
+        assert (loaded, merged) == (expected[kind][0], 0), kind
+    assert await snapshot() == before
+
+
+async def run_benchmark(db):
+    """よく使う操作の1回あたりの所要時間（ミリ秒）"""
+    guild_id, user_id = unique_id(), unique_id() + 1
+    await db.setup_guild(guild_id, 1, 2)
+    report_id = await db.create_report(guild_id, user_id, "ルール1", "ベンチマーク", None, "中")
+    await db.save_intro(user_id, 1, 2)
+    user_ids = [user_id + i for i in range(100)]
+
+    operations = {
+        "record_bump": lambda: db.record_bump(user_id),
+        "get_user_count": lambda: db.get_user_count(user_id),
+        "get_top_users": db.get_top_users,
+        "get_intro_ids": lambda: db.get_intro_ids(user_id),
+        "get_intro_ids_many(100)": lambda: db.get_intro_ids_many(user_ids),
+        "get_guild_settings": lambda: db.get_guild_settings(guild_id),
+        "save_report_draft": lambda: db.save_report_draft(guild_id, user_id, violated_rule="ルール1"),
+        "get_report_draft": lambda: db.get_report_draft(guild_id, user_id),
+        "create_report": lambda: db.create_report(guild_id, user_id, "ルール1", "ベンチマーク", None, "中"),
+        "get_report": lambda: db.get_report(report_id),
+        "search_reports": lambda: db.search_reports(guild_id, "ベンチ"),
+        "get_report_stats": lambda: db.get_report_stats(guild_id),
+    }
+    results = {}
+    for name, operation in operations.items():
+        await operation()  # 初回の接続・準備の分は除く
+        timings = []
+        for _ in range(BENCH_ROUNDS):
+            started = time.perf_counter()
+            await operation()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1])
+    return results
+
+
+async def run_backend(name):
+    db = storage.load_backend(name)
+    try:
+        await check_conformance(db)
+        print(f"✅ {name}: 適合テストに合格しました")
+        if name == "postgres":
+            with tempfile.TemporaryDirectory() as directory:
+                await check_import_history(db, directory)
+            print(f"✅ {name}: 過去データの取り込みを2回行っても結果が変わりませんでした")
+        results = await run_benchmark(db)
+    finally:
+        await db.close_pool()
+    print(f"⏱️  {name}: {BENCH_ROUNDS}回ずつの所要時間（中央値 / p95, ms）")
+    for operation, (median, p95) in results.items():
+        print(f"  - {operation}: {median:.3f} / {p95:.3f}")
+
+
+def run_conformance(db):
+    async def run():
+        try:
+            await check_conformance(db)
+        finally:
+            await db.close_pool()
+    asyncio.run(run())
+
+
+def test_sqlite_backend():
+    """sqlite（一時ファイル）が適合テストに合格すること"""
+    with tempfile.TemporaryDirectory() as directory:
+        import storage_sqlite
+        storage_sqlite.SQLITE_PATH = os.path.join(directory, "conformance.sqlite3")
+        run_conformance(storage.load_backend("sqlite"))
+
+
+def test_postgres_backend():
+    """postgres が sqlite と同じ適合テストに合格すること（DATABASE_URL のDBに書き込む。未設定ならスキップ）"""
+    if not os.getenv("DATABASE_URL"):
+        import pytest
+        pytest.skip("DATABASE_URL が設定されていません")
+    run_conformance(storage.load_backend("postgres"))
+
+
+def test_postgres_import_history():
+    """過去データの取り込みが postgres で動き、同じファイルを2回取り込んでも何も変わらないこと（DATABASE_URL がなければスキップ）"""
+    if not os.getenv("DATABASE_URL"):
+        import pytest
+        pytest.skip("DATABASE_URL が設定されていません")
+    db = storage.load_backend("postgres")
+    async def run():
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                await check_import_history(db, directory)
+        finally:
+            await db.close_pool()
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or ["sqlite"] + (["postgres"] if os.getenv("DATABASE_URL") else [])
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.setdefault("SQLITE_PATH", os.path.join(directory, "conformance.sqlite3"))
+        for name in names:
+            try:
+                asyncio.run(run_backend(name))
+            except AssertionError:
+                import traceback
+                traceback.print_exc()
+                print(f"❌ {name}: 適合テストに失敗しました")
+                failed = True
+    sys.exit(1 if failed else 0)